@@ -0,0 +1,104 @@
+"""Timing and memory records of the stages of a model run"""
+
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the memory use is not recorded
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss():
+    """Peak resident set size of the process so far in bytes, or None where it cannot be measured"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageTrace:
+    """Records the wall time, CPU time, peak memory growth and number of settlements of each stage of a run
+
+    Use stage as a context manager, or timed as a decorator, around each stage. Each stage gives a record with its
+    name, the labels it was given (e.g. year and grid), the number of rows, the start time (seconds since the trace was
+    created), the wall and CPU time in seconds and the growth of the peak resident set size of the process in bytes.
+    The peak only grows when a stage uses more memory than any stage before it, so small values do not mean that the
+    stage uses little memory. The CPU time is that of the current process, without the worker processes.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows=None, **labels):
+        """Records the stage run within the with block
+
+        Arguments
+        ---------
+        name : str
+        rows : int, optional
+            Number of settlements the stage works on
+        labels
+            Other values stored in the record, e.g. year or grid
+        """
+        peak_before = peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            peak_after = peak_rss()
+            record = {'stage': name}
+            record.update(labels)
+            record.update({'rows': rows,
+                           'start': wall_start - self.start,
+                           'wall_time': wall_time,
+                           'cpu_time': cpu_time,
+                           'peak_rss_delta': None if peak_before is None else peak_after - peak_before})
+            self.records.append(record)
+            logger.info('{} took {:.3f} s'.format(' '.join([name] + [str(value) for value in labels.values()]),
+                                                  wall_time))
+
+    def timed(self, name, **labels):
+        """Decorator recording each call of a function as a stage"""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def to_frame(self):
+        """The records as a table, one row per stage in the order they finished
+
+        The labels come after the stage name, and are empty in the records of stages that were not given them.
+        """
+        columns = []
+        for record in self.records:
+            columns += [column for column in record if column not in columns]
+        metrics = ['rows', 'start', 'wall_time', 'cpu_time', 'peak_rss_delta']
+        columns = [column for column in columns if column not in metrics] + metrics
+        # Nullable types keep integer labels, such as years, integers where other records lack them
+        return pd.DataFrame(self.records, columns=columns).convert_dtypes()
+
+    def write(self, path):
+        """Writes the records as JSON if the path ends in .json, otherwise as csv"""
+        if os.path.splitext(path)[1].lower() == '.json':
+            self.to_frame().to_json(path, orient='records', indent=2)
+        else:
+            self.to_frame().to_csv(path, index=False)
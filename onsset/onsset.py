@@ -1,4 +1,8 @@
+import copy
+import heapq
 import logging
+import os
+from functools import lru_cache
 from math import exp, log, pi
 from typing import Dict
 import scipy.spatial
@@ -6,7 +10,6 @@ import scipy.spatial
 import numpy as np
 import pandas as pd
 
-logging.basicConfig(format='%(asctime)s\t\t%(message)s', level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
 # Columns in settlements file must match these exactly
@@ -89,10 +92,34 @@ SET_SA_DIESEL_FUEL = 'SADieselFuelCost'
 SET_MG_DIESEL_FUEL = 'MGDieselFuelCost'
 SET_PRE_SCREEN = 'PreScreening'
 
+# File extensions of the columnar settlement formats, any other extension is read and written as csv
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+FEATHER_EXTENSIONS = ('.feather', '.arrow')
+
+# Columns holding status or technology codes, stored as int8 in the compact settlement store.
+# Columns with a year suffix (e.g. FinalElecCode2025) are matched as well
+COMPACT_CODE_COLUMNS = [SET_URBAN, SET_ELEC_CURRENT, SET_TIER, SET_ELEC_FINAL_CODE, SET_MIN_OFFGRID_CODE,
+                        SET_MIN_OVERALL_CODE, SET_LIMIT, SET_PRE_SCREEN]
+
 # General
 LHV_DIESEL = 9.9445485  # (kWh/l) lower heating value
 HOURS_PER_YEAR = 8760
 
+# Classification of the grid penalty factors: column, bin edges, class of each bin, weight in the combined
+# classification and whether the lowest edge belongs to the first bin. See SettlementProcessor.grid_penalties
+GRID_PENALTY_CLASSES = [(SET_ROAD_DIST, [0, 5, 10, 25, 50, float("inf")], [5, 4, 3, 2, 1], 0.15, True),
+                        (SET_SUBSTATION_DIST, [0, 0.5, 1, 5, 10, float("inf")], [5, 4, 3, 2, 1], 0.20, False),
+                        (SET_ELEVATION, [float("-inf"), 500, 1000, 2000, 3000, float("inf")], [5, 4, 3, 2, 1], 0.15,
+                         False),
+                        (SET_SLOPE, [0, 10, 20, 30, 40, float("inf")], [5, 4, 3, 2, 1], 0.30, True)]
+# Class of each land cover type (1 to 17) and weight of the land cover in the combined classification
+GRID_PENALTY_LAND_COVER_LABELS = [3, 4, 3, 4, 3, 2, 5, 2, 5, 5, 1, 3, 3, 5, 3, 5, 1]
+GRID_PENALTY_LAND_COVER_WEIGHT = 0.20
+
+# Power output (kW) of the default 600 kW wind turbine at wind speeds of 1, 2, ... 25 m/s
+WIND_POWER_CURVE = (0, 0, 0, 0, 30, 77, 135, 208, 287, 371, 450, 514, 558,
+                    582, 594, 598, 600, 600, 600, 600, 600, 600, 600, 600, 600)
+
 
 class Technology:
     """
@@ -138,6 +165,8 @@ class Technology:
         self.diesel_truck_consumption = diesel_truck_consumption
         self.diesel_truck_volume = diesel_truck_volume
         self.om_of_td_lines = om_of_td_lines
+        # Demand and output of the last distribution_networks call, see cached_distribution_networks
+        self.distribution_cache = None
 
     @classmethod
     def set_default_values(cls, base_year, start_year, end_year, discount_rate, hv_line_type=69, hv_line_cost=43000,
@@ -177,7 +206,8 @@ class Technology:
     def get_lcoe(self, energy_per_cell, people, num_people_per_hh, start_year, end_year, new_connections,
                  total_energy_per_cell, prev_code, grid_cell_area, additional_mv_line_length=0.0,
                  capacity_factor=0.9, grid_penalty_ratio=1, fuel_cost=0, elec_loop=0, productive_nodes=0,
-                 additional_transformer=0, penalty=1, get_investment_cost=False, get_max_dist=False):
+                 additional_transformer=0, penalty=1, get_investment_cost=False, get_max_dist=False,
+                 distribution=None, rows=None, out=None):
         """Calculates the LCOE depending on the parameters. Optionally calculates the investment cost instead.
 
         Parameters
@@ -212,12 +242,35 @@ class Technology:
         grid_penalty_ratio : float or pandas.Series
         fuel_cost : float or pandas.Series
         get_investment_cost : bool
+        distribution : tuple, optional
+            Pre-calculated output of distribution_networks, see td_network_cost
+        rows : numpy.ndarray, optional
+            Boolean mask or positions of the settlements to calculate. The array inputs (and distribution) must then
+            cover all settlements, and the results of the other settlements are left as they are in out
+        out : tuple, optional
+            Preallocated (lcoe, investment cost) arrays of all settlements that the results of the rows are written
+            into. Arrays of NaN by default
 
         Returns
         -------
         lcoe or discounted investment cost
         """
 
+        if rows is not None:
+            size = len(people)
+
+            def take(values):
+                return values if np.ndim(values) == 0 else np.asarray(values)[rows]
+
+            energy_per_cell, people, num_people_per_hh, new_connections, total_energy_per_cell, prev_code, \
+                grid_cell_area, additional_mv_line_length, capacity_factor, grid_penalty_ratio, fuel_cost, \
+                elec_loop, productive_nodes, penalty = \
+                map(take, (energy_per_cell, people, num_people_per_hh, new_connections, total_energy_per_cell,
+                           prev_code, grid_cell_area, additional_mv_line_length, capacity_factor, grid_penalty_ratio,
+                           fuel_cost, elec_loop, productive_nodes, penalty))
+            if distribution is not None:
+                distribution = tuple(tuple(take(values) for values in network) for network in distribution)
+
         if type(people) == int or type(people) == float or type(people) == np.float64:
             if people == 0:
                 # If there are no people, the investment cost is zero.
@@ -253,7 +306,8 @@ class Technology:
                                                                                   additional_transformer,
                                                                                   productive_nodes,
                                                                                   elec_loop,
-                                                                                  penalty)
+                                                                                  penalty,
+                                                                                  distribution)
         generation_per_year = pd.Series(generation_per_year)
         peak_load = pd.Series(peak_load)
         td_investment_cost = pd.Series(td_investment_cost)
@@ -279,65 +333,153 @@ class Technology:
         if self.grid_price > 0:
             fuel_cost = self.grid_price
 
-        # Perform the time-value LCOE calculation
+        # Perform the time-value LCOE calculation. Every cost stream is constant per settlement over the years in
+        # which it occurs, so the discounting reduces to scalar sums of the discount factors.
         project_life = end_year - self.base_year + 1
-        reinvest_year = 0
         step = start_year - self.base_year
+        investment_factor, salvage_factor, generation_factor = \
+            self.discount_factor_sums(self.tech_life, step, project_life, self.discount_rate)
+
+        generation_per_year = np.asarray(generation_per_year)
+        total_investment_cost = np.asarray(total_investment_cost)
+        total_om_cost = np.asarray(total_om_cost)
+        fuel_cost = np.asarray(fuel_cost)
+
+        investment_cost = (total_investment_cost + np.asarray(peak_load) * self.grid_capacity_investment) * \
+            investment_factor
+        discounted_costs = total_investment_cost * (investment_factor - salvage_factor) + \
+            (total_om_cost + generation_per_year * fuel_cost) * generation_factor
+        discounted_generation = generation_per_year * generation_factor
+        lcoe = discounted_costs / discounted_generation
+
+        if rows is not None:
+            if out is None:
+                out = np.full(size, np.nan), np.full(size, np.nan)
+            out[0][rows] = lcoe
+            out[1][rows] = investment_cost
+            lcoe, investment_cost = out
+            if get_max_dist:
+                all_peak_load = np.zeros(size)
+                all_peak_load[rows] = peak_load
+                peak_load = all_peak_load
+
+        lcoe = pd.DataFrame(lcoe[:, np.newaxis])
+        investment_cost = pd.DataFrame(investment_cost[:, np.newaxis])
+
+        if get_investment_cost:
+            return investment_cost
+        elif get_max_dist:
+            return lcoe, investment_cost, peak_load
+        else:
+            return lcoe, investment_cost
+
+    @staticmethod
+    def get_lcoes(technologies, energy_per_cell, people, num_people_per_hh, start_year, end_year, new_connections,
+                  total_energy_per_cell, prev_code, grid_cell_area, productive_nodes=0, tech_inputs=None):
+        """Calculates the LCOE and investment cost of several technologies in one pass
+
+        The demand inputs are shared by all technologies, and the distribution network is only sized once for each
+        group of technologies with the same sizing parameters (e.g. all mini-grids, all stand-alone systems).
+
+        Parameters
+        ----------
+        technologies : list of Technology
+        tech_inputs : list of dict, optional
+            Technology specific keyword arguments passed on to get_lcoe, e.g. capacity_factor, fuel_cost or
+            additional_mv_line_length, in the same order as technologies
+        energy_per_cell, people, num_people_per_hh, start_year, end_year, new_connections, total_energy_per_cell,
+        prev_code, grid_cell_area, productive_nodes
+            As in get_lcoe
+
+        Returns
+        -------
+        lcoes : numpy.ndarray
+            Array of shape (number of settlements, number of technologies)
+        investments : numpy.ndarray
+            Discounted investment costs, same shape as lcoes
+        """
+        if tech_inputs is None:
+            tech_inputs = [{}] * len(technologies)
+
+        people = np.maximum(people, 0.00001)
+        energy_per_cell = np.maximum(energy_per_cell, 0.000000000001)
+
+        lcoes = np.zeros((len(people), len(technologies)))
+        investments = np.zeros((len(people), len(technologies)))
+        distributions = {}
+
+        for i, (tech, inputs) in enumerate(zip(technologies, tech_inputs)):
+            key = tech.distribution_sizing_key()
+            if key not in distributions:
+                distributions[key] = tech.distribution_networks(people, new_connections, total_energy_per_cell,
+                                                                energy_per_cell, num_people_per_hh, grid_cell_area,
+                                                                productive_nodes)
+
+            lcoe, investment = tech.get_lcoe(energy_per_cell=energy_per_cell,
+                                             start_year=start_year,
+                                             end_year=end_year,
+                                             people=people,
+                                             new_connections=new_connections,
+                                             total_energy_per_cell=total_energy_per_cell,
+                                             prev_code=prev_code,
+                                             num_people_per_hh=num_people_per_hh,
+                                             grid_cell_area=grid_cell_area,
+                                             productive_nodes=productive_nodes,
+                                             distribution=distributions[key],
+                                             **inputs)
+            lcoes[:, i] = lcoe[0]
+            investments[:, i] = investment[0]
+
+        return lcoes, investments
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def discount_factor_sums(tech_life, step, project_life, discount_rate):
+        """Calculates the discount factor sums used in the LCOE calculation
+
+        The result only depends on the arguments, so it is cached and shared between all settlements and calls.
+
+        Arguments
+        ---------
+        tech_life : int
+            Technology life in years
+        step : int
+            Year (counted from the base year) in which the investment is made
+        project_life : int
+            Number of years from the base year to the end year, inclusive
+        discount_rate : float
+
+        Returns
+        -------
+        investment_factor : float
+            Discount factor sum of the initial investment and the re-investment (if any)
+        salvage_factor : float
+            Discounted share of the investment that is recovered as salvage value in the last year
+        generation_factor : float
+            Discount factor sum of the years with generation, O&M and fuel costs
+        """
+        reinvest_year = 0
         # If the technology life is less than the project life, we will have to invest twice to buy it again
-        if self.tech_life + step < project_life:
-            reinvest_year = self.tech_life + step
+        if tech_life + step < project_life:
+            reinvest_year = tech_life + step
 
         year = np.arange(project_life)
-        el_gen = np.outer(np.asarray(generation_per_year), np.ones(project_life))
-        for s in range(step):
-            el_gen[:, s] = 0
-        discount_factor = (1 + self.discount_rate) ** year
-        investments = np.zeros(project_life)
-        investments[step] = 1
-        # Calculate the year of re-investment if tech_life is smaller than project life
-        if reinvest_year:
-            investments[reinvest_year] = 1
-        investments = np.outer(total_investment_cost, investments)
+        discount_factor = (1 + discount_rate) ** year
 
-        grid_capacity_investments = np.zeros(project_life)
-        grid_capacity_investments[step] = 1
-        # Calculate the year of re-investment if tech_life is smaller than project life
+        investment_factor = 1 / discount_factor[step]
         if reinvest_year:
-            grid_capacity_investments[reinvest_year] = 1
-        grid_capacity_investments = np.outer(peak_load * self.grid_capacity_investment, grid_capacity_investments)
+            investment_factor += 1 / discount_factor[reinvest_year]
 
         # Calculate salvage value if tech_life is bigger than project life
-        salvage = np.zeros(project_life)
         if reinvest_year > 0:
-            used_life = (project_life - step) - self.tech_life
+            used_life = (project_life - step) - tech_life
         else:
             used_life = project_life - step - 1
-        salvage[-1] = 1
-        salvage = np.outer(total_investment_cost * (1 - used_life / self.tech_life), salvage)
+        salvage_factor = (1 - used_life / tech_life) / discount_factor[-1]
 
-        operation_and_maintenance = np.ones(project_life)
-        for s in range(step):
-            operation_and_maintenance[s] = 0
-        operation_and_maintenance = np.outer(total_om_cost, operation_and_maintenance)
-        fuel = np.outer(np.asarray(generation_per_year), np.zeros(project_life))
-        for p in range(project_life):
-            fuel[:, p] = el_gen[:, p] * fuel_cost
-
-        discounted_investments = investments / discount_factor
-        dicounted_grid_capacity_investments = grid_capacity_investments / discount_factor
-        investment_cost = np.sum(discounted_investments, axis=1) + np.sum(dicounted_grid_capacity_investments, axis=1)
-        discounted_costs = (investments + operation_and_maintenance + fuel - salvage) / discount_factor
-        discounted_generation = el_gen / discount_factor
-        lcoe = np.sum(discounted_costs, axis=1) / np.sum(discounted_generation, axis=1)
-        lcoe = pd.DataFrame(lcoe[:, np.newaxis])
-        investment_cost = pd.DataFrame(investment_cost[:, np.newaxis])
+        generation_factor = np.sum(1 / discount_factor[step:])
 
-        if get_investment_cost:
-            return investment_cost
-        elif get_max_dist:
-            return lcoe, investment_cost, peak_load
-        else:
-            return lcoe, investment_cost
+        return investment_factor, salvage_factor, generation_factor
 
     def transmission_network(self, peak_load, additional_mv_line_length=0, additional_transformer=0,
                              mv_distribution=False):
@@ -476,9 +618,75 @@ class Technology:
 
         return cluster_mv_lines_length, lv_km, no_of_service_transf, consumption, peak_load, total_nodes
 
+    def distribution_networks(self, people, new_connections, total_energy_per_cell, energy_per_cell,
+                              num_people_per_hh, grid_cell_area, productive_nodes=0):
+        """Sizes the distribution network for the total, the already met and the new demand in each settlement
+
+        The result only depends on the demand inputs and on the sizing parameters of the technology
+        (see distribution_sizing_key), so it can be shared between technologies and extension rounds.
+
+        Arguments
+        ---------
+        people : float or pandas.Series
+            Number of people in settlement
+        new_connections : float or pandas.Series
+            Number of new people in settlement to connect
+        total_energy_per_cell : float or pandas.Series
+            Total annual energy demand in cell, including already met demand
+        energy_per_cell : float or pandas.Series
+            Annual energy demand in cell, excluding already met demand
+        num_people_per_hh : float or pandas.Series
+            Number of people per household in settlement
+        grid_cell_area : float or pandas.Series
+            Area of settlement (km2)
+        productive_nodes : int or pandas.Series
+            Additional connections (schools, health facilities, shops)
+
+        Returns
+        -------
+        tuple
+            The output of distribution_network for the total, existing and new demand
+        """
+        total = self.distribution_network(people, total_energy_per_cell, num_people_per_hh, grid_cell_area,
+                                          productive_nodes)
+        existing = self.distribution_network(np.maximum((people - new_connections), 1),
+                                             (total_energy_per_cell - energy_per_cell),
+                                             num_people_per_hh, grid_cell_area, productive_nodes)
+        new = self.distribution_network(people, energy_per_cell, num_people_per_hh, grid_cell_area,
+                                        productive_nodes)
+
+        return total, existing, new
+
+    def cached_distribution_networks(self, people, new_connections, total_energy_per_cell, energy_per_cell,
+                                     num_people_per_hh, grid_cell_area, productive_nodes=0):
+        """distribution_networks, recalculated only when the demand changes
+
+        Within a year the grid extension rounds only change the connection distance, the electrification order and
+        the transformers, so the distribution network can be sized once and reused by every round. A copy of the
+        demand of the last calculation is kept and compared with the demand of each call.
+        """
+        demand = [np.asarray(values, dtype=float) for values in (people, new_connections, total_energy_per_cell,
+                                                                 energy_per_cell, num_people_per_hh, grid_cell_area,
+                                                                 productive_nodes)]
+        if self.distribution_cache is None or \
+                not all(np.array_equal(cached, values, equal_nan=True)
+                        for cached, values in zip(self.distribution_cache[0], demand)):
+            self.distribution_cache = ([values.copy() for values in demand],
+                                       self.distribution_networks(people, new_connections, total_energy_per_cell,
+                                                                  energy_per_cell, num_people_per_hh, grid_cell_area,
+                                                                  productive_nodes))
+        return self.distribution_cache[1]
+
+    def distribution_sizing_key(self):
+        """The technology parameters that distribution_network depends on
+
+        Technologies with the same key get the same distribution network for the same demand.
+        """
+        return self.standalone, self.distribution_losses, self.base_to_peak_load_ratio
+
     def td_network_cost(self, people, new_connections, prev_code, total_energy_per_cell, energy_per_cell,
                         num_people_per_hh, grid_cell_area, additional_mv_line_length=0, additional_transformer=0,
-                        productive_nodes=0, elec_loop=0, penalty=1):
+                        productive_nodes=0, elec_loop=0, penalty=1, distribution=None):
         """Calculates all the transmission and distribution network components
 
         Parameters
@@ -507,20 +715,23 @@ class Technology:
             Round of extension in grid extension algorithm
         penalty : float
             Cost penalty factor for T&D network, e.g. https://www.mdpi.com/2071-1050/12/3/777
+        distribution : tuple, optional
+            The output of distribution_networks for the same inputs, if it has already been calculated
         """
 
+        if distribution is None:
+            distribution = self.distribution_networks(people, new_connections, total_energy_per_cell,
+                                                      energy_per_cell, num_people_per_hh, grid_cell_area,
+                                                      productive_nodes)
+        distribution_total, distribution_existing, distribution_new = distribution
+
         # Start by calculating the distribution network required to meet all of the demand
         cluster_mv_lines_length_total, cluster_lv_lines_length_total, no_of_service_transf_total, \
-            generation_per_year_total, peak_load_total, total_nodes_total = \
-            self.distribution_network(people, total_energy_per_cell, num_people_per_hh, grid_cell_area,
-                                      productive_nodes)
+            generation_per_year_total, peak_load_total, total_nodes_total = distribution_total
 
         # Next calculate the network that is already there
         cluster_mv_lines_length_existing, cluster_lv_lines_length_existing, no_of_service_transf_existing, \
-            generation_per_year_existing, peak_load_existing, total_nodes_existing = \
-            self.distribution_network(np.maximum((people - new_connections), 1),
-                                      (total_energy_per_cell - energy_per_cell),
-                                      num_people_per_hh, grid_cell_area, productive_nodes)
+            generation_per_year_existing, peak_load_existing, total_nodes_existing = distribution_existing
 
         # Then calculate the difference between the two
         mv_lines_distribution_length_additional = \
@@ -560,8 +771,7 @@ class Technology:
 
         # If no distribution network is present, perform the calculations only once
         mv_lines_distribution_length_new, total_lv_lines_length_new, num_transformers_new, generation_per_year_new, \
-            peak_load_new, total_nodes_new = self.distribution_network(people, energy_per_cell, num_people_per_hh,
-                                                                       grid_cell_area, productive_nodes)
+            peak_load_new, total_nodes_new = distribution_new
 
         mv_distribution = np.where(mv_lines_distribution_length_new > 0, True, False)
 
@@ -623,14 +833,71 @@ class Technology:
         return generation_per_year, peak_load, td_investment_cost
 
 
+class CompactFrame(pd.DataFrame):
+    """Settlements of the compact store, with each column assigned to them stored in its compact type
+
+    The float columns are stored as float32 and the code columns without missing values as int8 as soon as they are
+    assigned, as compact_dtypes would store them. The columns added during a year of the analysis are so never held
+    in float64.
+    """
+
+    @property
+    def _constructor(self):
+        return CompactFrame
+
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            value = self.compact_values(key, value)
+        super().__setitem__(key, value)
+
+    @staticmethod
+    def compact_values(column, value):
+        """The values to store in a column, in the compact type of the column if they have one
+
+        Arguments
+        ---------
+        column : str
+        value : scalar, numpy.ndarray or pandas.Series
+
+        Returns
+        -------
+        The values, converted or not
+        """
+        if isinstance(value, float):
+            return np.float32(value)
+        dtype = getattr(value, 'dtype', None)
+        if dtype is None or dtype.kind not in 'fi' or getattr(value, 'ndim', 0) != 1:
+            return value
+        if SettlementProcessor.is_code_column(column) and not (dtype.kind == 'f' and np.isnan(value).any()):
+            return value.astype(np.int8)
+        if dtype == np.float64:
+            return value.astype(np.float32)
+        return value
+
+
 class SettlementProcessor:
     """
     Processes the DataFrame and adds all the columns to determine the cheapest option and the final costs and summaries
     """
 
-    def __init__(self, path):
+    def __init__(self, path, compact=False, columns=None):
+        """
+        Arguments
+        ---------
+        path : str
+            Path to the settlements file. Parquet (.parquet, .pq) and Feather/Arrow IPC (.feather, .arrow) files are
+            read as such, any other file as csv
+        compact : bool
+            If True, the numeric settlement attributes are stored as float32 from load time and the code columns
+            as int8 (see compact_dtypes), as are the columns added to them (see CompactFrame). This roughly halves
+            the memory use, at the cost of single precision inputs and results.
+        columns : list, optional
+            Only these columns are loaded from the file. By default all columns are loaded
+        """
+        self.compact = compact
+
         try:
-            self.df = pd.read_csv(path)
+            self.df = self.read_settlements(path, columns=columns)
         except FileNotFoundError:
             print("Please make sure that the country name you provided and the .csv file, both have the same name")
             raise
@@ -638,13 +905,101 @@ class SettlementProcessor:
         try:
             self.df[SET_GHI]
         except KeyError:
-            self.df = pd.read_csv(path, sep=';')
+            self.df = self.read_settlements(path, sep=';', columns=columns)
             try:
                 self.df[SET_GHI]
             except ValueError:
                 print('Colonne "GHI" introuvable, vérifiez les noms des colonnes dans le fichier csv calibré')
                 raise
 
+        if compact:
+            self.compact_dtypes()
+            self.df = CompactFrame(self.df)
+
+    def read_settlements(self, path, sep=',', columns=None):
+        """Reads the settlements file in the format given by its extension
+
+        Arguments
+        ---------
+        path : str
+        sep : str
+            Separator of the csv file, not used for the columnar formats
+        columns : list, optional
+            Columns to load, all by default
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension in PARQUET_EXTENSIONS:
+            return pd.read_parquet(path, columns=columns)
+        elif extension in FEATHER_EXTENSIONS:
+            return pd.read_feather(path, columns=columns)
+        else:
+            return self.read_csv(path, sep=sep, columns=columns)
+
+    def read_csv(self, path, sep=',', columns=None):
+        """Reads the settlements csv file, with the float columns as float32 if the compact store is used
+        """
+        dtype = None
+        if self.compact:
+            # Infer the column types from the first rows, so that the float columns are never held in float64
+            sample = pd.read_csv(path, sep=sep, nrows=1000, usecols=columns)
+            dtype = {column: np.float32 for column in sample.columns if sample[column].dtype == 'float64'}
+
+        return pd.read_csv(path, sep=sep, dtype=dtype, usecols=columns)
+
+    @staticmethod
+    def write_settlements(df, path):
+        """Writes the settlements in the format given by the extension of the path, see read_settlements
+
+        Arguments
+        ---------
+        df : pandas.DataFrame
+        path : str
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension in PARQUET_EXTENSIONS:
+            df.to_parquet(path, index=False)
+        elif extension in FEATHER_EXTENSIONS:
+            df.reset_index(drop=True).to_feather(path)
+        else:
+            df.to_csv(path, index=False)
+
+    def copy(self):
+        """Returns a SettlementProcessor with its own copy of the settlements
+
+        Used to run several scenarios from settlements loaded once, without changing the loaded data.
+        """
+        processor = copy.copy(self)
+        processor.df = self.df.copy()
+        return processor
+
+    @staticmethod
+    def is_code_column(column):
+        """Whether the column holds status or technology codes, see COMPACT_CODE_COLUMNS
+        """
+        for name in COMPACT_CODE_COLUMNS:
+            if column == name or (column.startswith(name) and column[len(name):].isdigit()):
+                return True
+        return False
+
+    def compact_dtypes(self, codes=True):
+        """Downcasts the numeric columns to the smallest types that hold them
+
+        Floats are stored as float32 and integers as the smallest signed integer type. If codes is True, the code
+        columns without missing values are stored as int8.
+
+        Arguments
+        ---------
+        codes : bool
+        """
+        for column in self.df.columns:
+            values = self.df[column]
+            if codes and self.is_code_column(column) and values.dtype.kind in 'fi' and not values.isnull().any():
+                self.df[column] = values.astype(np.int8)
+            elif values.dtype == 'float64':
+                self.df[column] = pd.to_numeric(values, downcast='float')
+            elif values.dtype == 'int64':
+                self.df[column] = pd.to_numeric(values, downcast='signed')
+
     @staticmethod
     def _diesel_fuel_cost_calculator(diesel_price: float,
                                      diesel_truck_consumption: float,
@@ -732,7 +1087,7 @@ class SettlementProcessor:
         Do any initial data conditioning that may be required.
         """
 
-        logging.info('Ensure that columns that are supposed to be numeric are numeric')
+        logger.info('Ensure that columns that are supposed to be numeric are numeric')
         self.df[SET_NIGHT_LIGHTS] = pd.to_numeric(self.df[SET_NIGHT_LIGHTS], errors='coerce')
         self.df[SET_POP] = pd.to_numeric(self.df[SET_POP], errors='coerce')
         self.df[SET_GRID_CELL_AREA] = pd.to_numeric(self.df[SET_GRID_CELL_AREA], errors='coerce')
@@ -766,10 +1121,10 @@ class SettlementProcessor:
 
         self.df.loc[self.df[SET_ELEC_POP] > self.df[SET_POP], SET_ELEC_POP] = self.df[SET_POP]
 
-        logging.info('Replace null values with zero')
+        logger.info('Replace null values with zero')
         self.df.fillna(0, inplace=True)
 
-        logging.info('Sort by country, Y and X')
+        logger.info('Sort by country, Y and X')
         self.df.sort_values(by=[SET_Y_DEG, SET_X_DEG], inplace=True)
 
     @staticmethod
@@ -854,85 +1209,165 @@ class SettlementProcessor:
         land_cover_labels = [3, 4, 3, 4, 3, 2, 5, 2, 5, 5, 1, 3, 3, 5, 3, 5, 1]
         return column.apply(lambda x: land_cover_labels[int(x-1)])
 
-    def grid_penalties(self, data_frame):
+    @staticmethod
+    def classify_bins(values, bins, labels, include_lowest=False):
+        """Class of each value, as pandas.cut with right-closed bins, but on arrays
+
+        Arguments
+        ---------
+        values : numpy.ndarray
+        bins : list
+            Increasing bin edges
+        labels : list
+            Class of each bin
+        include_lowest : bool
+            Whether the lowest edge belongs to the first bin
+
+        Returns
+        -------
+        numpy.ndarray
+            The classes as floats, NaN for values outside the bins
+        """
+        values = np.asarray(values, dtype=np.float64)
+        bins = np.asarray(bins, dtype=np.float64)
+        position = np.searchsorted(bins, values, side='left') - 1
+        if include_lowest:
+            position[values == bins[0]] = 0
+        inside = (position >= 0) & (position < len(labels))
+        return np.where(inside, np.asarray(labels, dtype=np.float64)[np.where(inside, position, 0)], np.nan)
+
+    def grid_penalties(self, data_frame, classes=GRID_PENALTY_CLASSES,
+                       land_cover_labels=GRID_PENALTY_LAND_COVER_LABELS,
+                       land_cover_weight=GRID_PENALTY_LAND_COVER_WEIGHT):
 
         """this method calculates the grid penalties in each settlement
 
-        First step classifies the parameters and creates new columns with classification
+        First step classifies the parameters and sums the weighted classes
 
         Second step adds the grid penalty to increase grid cost in areas that higher road distance, higher substation
         distance, unsuitable land cover, high slope angle or high elevation
 
+        Arguments
+        ---------
+        data_frame : pandas.DataFrame
+        classes : list
+            (column, bins, labels, weight, include_lowest) of each binned factor, see GRID_PENALTY_CLASSES
+        land_cover_labels : list
+            Class of each land cover type, starting from type 1
+        land_cover_weight : float
         """
 
-        logging.info('Classify road dist')
-        road_dist_classified = self.classify_road_distance(data_frame[SET_ROAD_DIST])
-
-        logging.info('Classify substation dist')
-        substation_dist_classified = self.classify_substation_distance(data_frame[SET_SUBSTATION_DIST])
+        logger.info('Combined classification')
+        classification = None
+        for column, bins, labels, weight, include_lowest in classes:
+            classified = weight * self.classify_bins(data_frame[column].values, bins, labels, include_lowest)
+            classification = classified if classification is None else classification + classified
 
-        logging.info('Classify elevation')
-        elevation_classified = self.classify_elevation(data_frame[SET_ELEVATION])
+        land_cover_type = (data_frame[SET_LAND_COVER].values - 1).astype(int)
+        classification = classification + land_cover_weight * np.asarray(land_cover_labels)[land_cover_type]
 
-        logging.info('Classify slope')
-        slope_classified = self.classify_slope(data_frame[SET_SLOPE])
-
-        logging.info('Classify land cover')
-        land_cover_classified = self.classify_land_cover(data_frame[SET_LAND_COVER])
-
-        logging.info('Combined classification')
-        combined_classification = (0.15 * road_dist_classified +
-                                   0.20 * substation_dist_classified +
-                                   0.15 * elevation_classified +
-                                   0.30 * slope_classified +
-                                   0.20 * land_cover_classified)
-
-        logging.info('Grid penalty')
+        logger.info('Grid penalty')
         """this calculates the penalty from the results obtained from the combined classifications"""
-        classification = combined_classification.astype(float)
-
         c = 1 + (np.exp(.85 * np.abs(1 - classification)) - 1) / 100
 
-        return c
+        return pd.Series(c, index=data_frame.index)
 
     @staticmethod
-    def get_wind_cf(wind_velocity):
+    def get_wind_cf(wind_velocity, **turbine):
         """Calculate the wind capacity factor based on the average wind velocity.
 
         Parameters
         ----------
         wind_velocity : float
+        turbine
+            Turbine parameters, see wind_cf
         """
 
-        mu = 0.97  # availability factor
-        t = 8760
-        p_rated = 600
-        z = 55  # hub height
-        zr = 80  # velocity measurement height
-        es = 0.85  # losses in wind electricity
-        u_arr = range(1, 26)
-        p_curve = [0, 0, 0, 0, 30, 77, 135, 208, 287, 371, 450, 514, 558,
-                   582, 594, 598, 600, 600, 600, 600, 600, 600, 600, 600, 600]
-
         if wind_velocity == 0:
             return 0
         elif wind_velocity < 0:
             raise ValueError('Wind velocity must be greater than 0')
 
         else:
-            # Adjust for the correct hub height
-            alpha = (0.37 - 0.088 * log(wind_velocity)) / (1 - 0.088 * log(zr / 10))
-            u_z = wind_velocity * (z / zr) ** alpha
+            return float(SettlementProcessor.wind_cf(wind_velocity, **turbine))
+
+    @staticmethod
+    def wind_cf(wind_velocity, power_curve=WIND_POWER_CURVE, p_rated=600, hub_height=55, measurement_height=80,
+                availability=0.97, losses=0.85):
+        """Wind capacity factor for an array of average wind velocities
+
+        The velocity is adjusted to the hub height and its distribution assumed to be Rayleigh. Velocities of zero or
+        less give a capacity factor of zero, and missing (NaN) velocities a missing capacity factor.
+
+        Parameters
+        ----------
+        wind_velocity : numpy.ndarray or float
+            Average wind velocity (m/s) at the measurement height
+        power_curve : sequence
+            Power output (kW) of the turbine at 1, 2, ... m/s
+        p_rated : float
+            Rated power of the turbine (kW)
+        hub_height : float
+        measurement_height : float
+        availability : float
+        losses : float
+            Share of the wind electricity that is not lost
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        t = HOURS_PER_YEAR
+        wind_velocity = np.asarray(wind_velocity, dtype=np.float64)
+        cf = np.where(np.isnan(wind_velocity), np.nan, 0.)
+        positive = wind_velocity > 0
+        velocity = wind_velocity[positive]
+
+        # Adjust for the correct hub height
+        alpha = (0.37 - 0.088 * np.log(velocity)) / (1 - 0.088 * log(measurement_height / 10))
+        u_z = velocity * (hub_height / measurement_height) ** alpha
+
+        # Rayleigh distribution and sum of series
+        energy_produced = np.zeros(velocity.shape)
+        for u, p in enumerate(power_curve, start=1):
+            rayleigh = (pi / 2) * (u / u_z ** 2) * np.exp((-pi / 4) * (u / u_z) ** 2)
+            energy_produced += availability * losses * t * p * rayleigh
+
+        cf[positive] = energy_produced / (p_rated * t)
+        return cf
 
-            # Rayleigh distribution and sum of series
-            rayleigh = [(pi / 2) * (u / u_z ** 2) * exp((-pi / 4) * (u / u_z) ** 2) for u in u_arr]
-            energy_produced = sum([mu * es * t * p * r for p, r in zip(p_curve, rayleigh)])
+    def calc_wind_cfs(self, wind_velocity=None, lookup_step=None, **turbine):
+        """Wind capacity factor of each settlement, or of the given wind velocities
+
+        Parameters
+        ----------
+        wind_velocity : numpy.ndarray or float, optional
+            By default the WindVel column of the settlements. Missing (NaN) velocities give a missing capacity factor
+            and negative velocities raise a ValueError
+        lookup_step : float, optional
+            If given, the capacity factor is tabulated on a grid of velocities this far apart (m/s) and interpolated,
+            which is faster for many settlements
+        turbine
+            Turbine parameters, see wind_cf
+        """
+        logger.info('Calculate Wind CF')
+        if wind_velocity is None:
+            wind_velocity = self.df[SET_WINDVEL]
 
-            return energy_produced / (p_rated * t)
+        velocity = np.asarray(wind_velocity, dtype=np.float64)
+        if (velocity < 0).any():
+            raise ValueError('Wind velocity must be greater than 0')
+        if lookup_step is None:
+            cf = self.wind_cf(velocity, **turbine)
+        else:
+            table_velocity = np.arange(0, np.nanmax(velocity, initial=0) + 2 * lookup_step, lookup_step)
+            cf = np.interp(velocity, table_velocity, self.wind_cf(table_velocity, **turbine))
 
-    def calc_wind_cfs(self):
-        logging.info('Calculate Wind CF')
-        return self.df[SET_WINDVEL].apply(self.get_wind_cf)
+        if isinstance(wind_velocity, pd.Series):
+            return pd.Series(cf, index=wind_velocity.index)
+        elif np.ndim(wind_velocity) == 0:
+            return float(cf)
+        return cf
 
     def prepare_wtf_tier_columns(self, num_people_per_hh_rural, num_people_per_hh_urban,
                                  tier_1, tier_2, tier_3, tier_4, tier_5):
@@ -942,7 +1377,7 @@ class SettlementProcessor:
         # (BEYOND CONNECTIONS Energy Access Redefined, ESMAP, 2015).
         # Tiers in kWh/capita/year depends on the average ppl/hh which is different in every country
 
-        logging.info('Populate ResidentialDemandTier columns')
+        logger.info('Populate ResidentialDemandTier columns')
         tier_num = [1, 2, 3, 4, 5]
         ppl_hh_average = (num_people_per_hh_urban + num_people_per_hh_rural) / 2
         tier_1 = tier_1 / ppl_hh_average  # 38.7 refers to kWh/household/year (mean value between Tier 1 and Tier 2)
@@ -962,13 +1397,13 @@ class SettlementProcessor:
         on actual values provided by the user for the start year.
         """
 
-        logging.info('Population calibration process')
+        logger.info('Population calibration process')
 
         # First, calculate ratio between GIS retrieved and user provided population
         pop_ratio = pop_actual / self.df[SET_POP].sum()
 
         # Use above ratio to calibrate the population in a new column
-        self.df[SET_POP_CALIB] = self.df.apply(lambda row: row[SET_POP] * pop_ratio, axis=1)
+        self.df[SET_POP_CALIB] = self.df[SET_POP] * pop_ratio
         pop_modelled = self.df[SET_POP_CALIB].sum()
         pop_diff = abs(pop_modelled - pop_actual)
         if abs(pop_modelled - pop_actual) < 0.03:
@@ -980,7 +1415,7 @@ class SettlementProcessor:
         # TODO Why do we apply the ratio to elec_pop? Shouldn't the calibration take place before defining elec_pop?
         self.df[SET_ELEC_POP_CALIB] = self.df[SET_ELEC_POP] * pop_ratio
 
-        logging.info('Urban/rural calibration process')
+        logger.info('Urban/rural calibration process')
         # TODO As indicated below, HRSL classifies in 0, 1 and 2; I don't get why if statement uses 3 here.
         if max(self.df[SET_URBAN]) == 3:  # THIS OPTION IS CURRENTLY DISABLED
             calibrate = True if 'n' in input(
@@ -1033,7 +1468,7 @@ class SettlementProcessor:
         pop_future_low = pop_future_high
 
         # Project future population, with separate growth rates for urban and rural
-        logging.info('Population projection process')
+        logger.info('Population projection process')
 
         # TODO this is a residual of the previous process;
         # shall we delete? Is there any scenario where we don't apply projections?
@@ -1067,18 +1502,38 @@ class SettlementProcessor:
         # RUN_PARAM: Define here the years for which results should be provided in the output file.
         years_of_analysis = [intermediate_year, end_year]
 
+        pop_high = self.project_pop(years_of_analysis, start_year, yearly_urban_growth_rate_high,
+                                    yearly_rural_growth_rate_high)
+        pop_low = self.project_pop(years_of_analysis, start_year, yearly_urban_growth_rate_low,
+                                   yearly_rural_growth_rate_low)
+
         for year in years_of_analysis:
-            self.df[SET_POP + "{}".format(year) + 'High'] = \
-                self.df.apply(lambda row: row[SET_POP_CALIB] * (yearly_urban_growth_rate_high ** (year - start_year))
-                              if row[SET_URBAN] > 1
-                              else row[SET_POP_CALIB] * (yearly_rural_growth_rate_high ** (year - start_year)), axis=1)
+            self.df[SET_POP + "{}".format(year) + 'High'] = pop_high[year]
+            self.df[SET_POP + "{}".format(year) + 'Low'] = pop_low[year]
+
+        self.df[SET_POP + "{}".format(start_year)] = self.df[SET_POP_CALIB]
 
-            self.df[SET_POP + "{}".format(year) + 'Low'] = \
-                self.df.apply(lambda row: row[SET_POP_CALIB] * (yearly_urban_growth_rate_low ** (year - start_year))
-                              if row[SET_URBAN] > 1
-                              else row[SET_POP_CALIB] * (yearly_rural_growth_rate_low ** (year - start_year)), axis=1)
+    def project_pop(self, years, start_year, yearly_urban_growth_rate, yearly_rural_growth_rate):
+        """Projects the calibrated population of each settlement to several years at once
 
-        self.df[SET_POP + "{}".format(start_year)] = self.df.apply(lambda row: row[SET_POP_CALIB], axis=1)
+        Urban settlements (SET_URBAN above 1) grow at the urban rate, the others at the rural rate.
+
+        Arguments
+        ---------
+        years : list
+        start_year : int
+        yearly_urban_growth_rate : float
+        yearly_rural_growth_rate : float
+
+        Returns
+        -------
+        pandas.DataFrame
+            The population of each settlement, with a column per year
+        """
+        years = np.asarray(years)
+        growth_rate = np.where(self.df[SET_URBAN].values > 1, yearly_urban_growth_rate, yearly_rural_growth_rate)
+        pop = self.df[SET_POP_CALIB].values[:, np.newaxis] * growth_rate[:, np.newaxis] ** (years - start_year)
+        return pd.DataFrame(pop, index=self.df.index, columns=years)
 
     def elec_current_and_future(self, elec_actual, elec_actual_urban, elec_actual_rural, start_year,
                                 min_night_lights=0, min_pop=50, max_transformer_dist=2, max_mv_dist=2, max_hv_dist=5):
@@ -1101,7 +1556,7 @@ class SettlementProcessor:
         rural_elec_ratio *= factor
         self.df.loc[self.df[SET_NIGHT_LIGHTS] <= 0, [SET_ELEC_POP_CALIB]] = 0
 
-        logging.info('Calibrate current electrification')
+        logger.info('Calibrate current electrification')
         self.df[SET_ELEC_CURRENT] = 0
 
         # This if function here skims through T&D columns to identify if any non 0 values exist;
@@ -1146,66 +1601,24 @@ class SettlementProcessor:
                     self.df.loc[(self.df[SET_ELEC_CURRENT] == 1) & (self.df[SET_URBAN] > 1), SET_ELEC_POP_CALIB] *= (
                             1 / urban_elec_factor)
                 else:
-                    i = 0
-                    while urban_elec_factor <= 1:
-                        if i < 10:
-                            self.df.loc[
-                                (self.df[SET_ELEC_CURRENT] == 1) & (self.df[SET_URBAN] == 2), SET_ELEC_POP_CALIB] *= 1.1
-                            self.df[SET_ELEC_POP_CALIB] = np.minimum(self.df[SET_ELEC_POP_CALIB],
-                                                                     self.df[SET_POP_CALIB])
-                            urban_elec_modelled = self.df.loc[
-                                (self.df[SET_ELEC_CURRENT] == 1) & (self.df[SET_URBAN] == 2), SET_ELEC_POP_CALIB].sum()
-                            urban_elec_factor = urban_elec_modelled / urban_electrified
-                            i += 1
-                        else:
-                            break
+                    urban_elec_factor = self.scale_up_elec_pop(
+                        (self.df[SET_ELEC_CURRENT] == 1) & (self.df[SET_URBAN] == 2), urban_elec_factor,
+                        urban_electrified)
 
                 if rural_elec_factor > 1:
                     self.df.loc[(self.df[SET_ELEC_CURRENT] == 1) & (self.df[SET_URBAN] <= 1), SET_ELEC_POP_CALIB] *= (
                             1 / rural_elec_factor)
                 else:
-                    i = 0
-                    while rural_elec_factor <= 1:
-                        if i < 10:
-                            self.df.loc[
-                                (self.df[SET_ELEC_CURRENT] == 1) & (self.df[SET_URBAN] < 2), SET_ELEC_POP_CALIB] *= 1.1
-                            self.df[SET_ELEC_POP_CALIB] = np.minimum(self.df[SET_ELEC_POP_CALIB],
-                                                                     self.df[SET_POP_CALIB])
-                            rural_elec_modelled = self.df.loc[
-                                (self.df[SET_ELEC_CURRENT] == 1) & (self.df[SET_URBAN] < 2), SET_ELEC_POP_CALIB].sum()
-                            rural_elec_factor = rural_elec_modelled / rural_electrified
-                            i += 1
-                        else:
-                            break
+                    rural_elec_factor = self.scale_up_elec_pop(
+                        (self.df[SET_ELEC_CURRENT] == 1) & (self.df[SET_URBAN] < 2), rural_elec_factor,
+                        rural_electrified)
 
                 pop_elec = self.df.loc[self.df[SET_ELEC_CURRENT] == 1, SET_ELEC_POP_CALIB].sum()
                 elec_modelled = pop_elec / total_pop
 
                 # REVIEW. Added new calibration step for pop not meeting original steps, if prev elec pop is too small
-                i = 0
-                td_dist_2 = 0.1
-                while elec_actual - elec_modelled > 0.01:
-                    pop_elec_2 = self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                             (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_POP_CALIB].sum()
-                    if i < 50:
-                        if (pop_elec + pop_elec_2) / total_pop > elec_actual:
-                            elec_modelled = (pop_elec + pop_elec_2) / total_pop
-                            self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                        (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_ELEC_POP_CALIB] = self.df[
-                                SET_POP_CALIB]
-                            self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                        (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_ELEC_CURRENT] = 1
-                        else:
-                            i += 1
-                            td_dist_2 += 0.1
-                    else:
-                        self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                    (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_ELEC_POP_CALIB] = self.df[
-                            SET_POP_CALIB]
-                        self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                    (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_ELEC_CURRENT] = 1
-                        elec_modelled = (pop_elec + pop_elec_2) / total_pop
-                        break
+                if elec_actual - elec_modelled > 0.01:
+                    elec_modelled = self.electrify_closest(pop_elec, total_pop, elec_actual, min_pop)
 
                 if elec_modelled > elec_actual:
                     self.df[SET_ELEC_POP_CALIB] *= elec_actual / elec_modelled
@@ -1243,30 +1656,8 @@ class SettlementProcessor:
                 elec_modelled = pop_elec / total_pop
 
                 # REVIEW. Added new calibration step for pop not meeting original steps, if prev elec pop is too small
-                i = 0
-                td_dist_2 = 0.1
-                while elec_actual - elec_modelled > 0.01:
-                    pop_elec_2 = self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                             (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_POP_CALIB].sum()
-                    if i < 50:
-                        if (pop_elec + pop_elec_2) / total_pop > elec_actual:
-                            elec_modelled = (pop_elec + pop_elec_2) / total_pop
-                            self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                        (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_ELEC_POP_CALIB] = self.df[
-                                SET_POP_CALIB]
-                            self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                        (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_ELEC_CURRENT] = 1
-                        else:
-                            i += 1
-                            td_dist_2 += 0.1
-                    else:
-                        self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                    (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_ELEC_POP_CALIB] = self.df[
-                            SET_POP_CALIB]
-                        self.df.loc[(self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop) &
-                                    (self.df[SET_CALIB_GRID_DIST] < td_dist_2), SET_ELEC_CURRENT] = 1
-                        elec_modelled = (pop_elec + pop_elec_2) / total_pop
-                        break
+                if elec_actual - elec_modelled > 0.01:
+                    elec_modelled = self.electrify_closest(pop_elec, total_pop, elec_actual, min_pop)
 
                 if elec_modelled > elec_actual:
                     self.df[SET_ELEC_POP_CALIB] *= elec_actual / elec_modelled
@@ -1285,17 +1676,102 @@ class SettlementProcessor:
                                                                               rural_elec_ratio))
             condition = 1
 
-        self.df[SET_ELEC_FINAL_CODE + "{}".format(start_year)] = \
-            self.df.apply(lambda row: 1 if row[SET_ELEC_CURRENT] == 1 else 99, axis=1)
+        self.df[SET_ELEC_FINAL_CODE + "{}".format(start_year)] = np.where(self.df[SET_ELEC_CURRENT] == 1, 1, 99)
 
         return elec_modelled, rural_elec_ratio, urban_elec_ratio
 
+    def scale_up_elec_pop(self, electrified, elec_factor, electrified_target, rounds=10, scale=1.1):
+        """Scales up the electrified population of a group of settlements until it reaches a target
+
+        At each round the electrified population of the group grows by scale, capped by the population of each
+        settlement, for at most rounds rounds.
+
+        Arguments
+        ---------
+        electrified : pandas.Series
+            Mask of the settlements in the group
+        elec_factor : float
+            Electrified population of the group over the target
+        electrified_target : float
+
+        Returns
+        -------
+        float
+            The final electrified population of the group over the target
+        """
+        elec_pop = self.df[SET_ELEC_POP_CALIB].values.copy()
+        pop = self.df[SET_POP_CALIB].values
+        electrified = electrified.values
+        i = 0
+        while elec_factor <= 1 and i < rounds:
+            elec_pop[electrified] *= scale
+            elec_pop = np.minimum(elec_pop, pop)
+            elec_factor = np.nansum(elec_pop[electrified]) / electrified_target
+            i += 1
+        self.df[SET_ELEC_POP_CALIB] = elec_pop
+        return elec_factor
+
+    def electrify_closest(self, pop_elec, total_pop, elec_actual, min_pop, step=0.1, max_steps=50):
+        """Electrifies the unelectrified settlements closest to the grid, to reach the electrification rate
+
+        The distance limit starts at step km and grows by step km, up to max_steps times, until the populated
+        settlements (more than min_pop) within the limit bring the electrification rate above elec_actual. All of them
+        are then electrified. The limit is found with a binary search over the cumulative population of the settlements
+        sorted by distance, instead of summing the population within each limit in turn.
+
+        Arguments
+        ---------
+        pop_elec : float
+            Population already electrified
+        total_pop : float
+        elec_actual : float
+        min_pop : float
+
+        Returns
+        -------
+        float
+            The modelled electrification rate
+        """
+        candidates = (self.df[SET_ELEC_CURRENT] == 0) & (self.df[SET_POP_CALIB] > min_pop)
+
+        # The same limits as adding step to the distance max_steps times
+        limits = [step]
+        for _ in range(max_steps):
+            limits.append(limits[-1] + step)
+
+        distance = self.df.loc[candidates, SET_CALIB_GRID_DIST].values
+        order = np.argsort(distance, kind='stable')
+        pop = np.nan_to_num(self.df.loc[candidates, SET_POP_CALIB].values[order])
+        cumulative_pop = np.concatenate([[0], np.cumsum(pop)])
+        pop_within = cumulative_pop[np.searchsorted(distance[order], limits, side='left')]
+        reached = (pop_elec + pop_within[:max_steps]) / total_pop > elec_actual
+        k = int(np.argmax(reached)) if reached.any() else max_steps
+
+        def within(limit):
+            return candidates & (self.df[SET_CALIB_GRID_DIST] < limit)
+
+        def exceeds(k):
+            return (pop_elec + self.df.loc[within(limits[k]), SET_POP_CALIB].sum()) / total_pop > elec_actual
+
+        # The cumulative sum rounds differently than a sum of the settlements within a limit, so the limit is confirmed
+        # with the sums themselves
+        while k > 0 and exceeds(k - 1):
+            k -= 1
+        while k < max_steps and not exceeds(k):
+            k += 1
+
+        electrified = within(limits[k])
+        pop_elec_2 = self.df.loc[electrified, SET_POP_CALIB].sum()
+        self.df.loc[electrified, SET_ELEC_POP_CALIB] = self.df[SET_POP_CALIB]
+        self.df.loc[electrified, SET_ELEC_CURRENT] = 1
+        return (pop_elec + pop_elec_2) / total_pop
+
     def pre_electrification(self, grid_price, year, time_step, end_year, grid_calc, grid_capacity_limit,
                             grid_connect_limit, grid_investment, grid_name='Ouest'):
 
         """" ... """
 
-        logging.info('Define the initial electrification status')
+        logger.info('Define the initial electrification status')
         prev_code = self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)].copy(deep=True)
 
         # Grid-electrified settlements
@@ -1314,29 +1790,33 @@ class SettlementProcessor:
         # Two restrictions may be imposed on the grid. The new grid generation capacity that can be added and the
         # number of new households that can be connected. The next step calculates how much of that will be used up due
         # to demand (population) growth in already electrified settlements
-        consumption = sum(self.df.loc[(prev_code == 1) & (self.df['ClosestGrid'] == grid_name)][SET_ENERGY_PER_CELL + "{}".format(year)])
+        consumption = sum(self.df.loc[(prev_code == 1) & (self.df['ClosestGrid'] == grid_name),
+                                      SET_ENERGY_PER_CELL + "{}".format(year)])
         average_load = consumption / (1 - grid_calc.distribution_losses) / HOURS_PER_YEAR  # kW
         peak_load = average_load / grid_calc.base_to_peak_load_ratio  # kW
         grid_capacity_limit -= peak_load
 
-        self.df['Densification_connections'] = self.df[SET_NEW_CONNECTIONS + "{}".format(year)] / self.df[
-            SET_NUM_PEOPLE_PER_HH]
-        grid_connect_limit -= sum(self.df.loc[(prev_code == 1) & (self.df['ClosestGrid'] == grid_name)]['Densification_connections'])
-        del self.df['Densification_connections']
+        densification_connections = self.df[SET_NEW_CONNECTIONS + "{}".format(year)] / self.df[SET_NUM_PEOPLE_PER_HH]
+        grid_connect_limit -= sum(densification_connections.loc[(prev_code == 1) &
+                                                                (self.df['ClosestGrid'] == grid_name)])
 
         return pd.Series(grid_investment), grid_capacity_limit, grid_connect_limit
 
     def current_mv_line_dist(self):
-        logging.info('Determine current MV line length')
+        logger.info('Determine current MV line length')
         self.df[SET_MV_CONNECT_DIST] = 0
         self.df.loc[self.df[SET_ELEC_CURRENT] == 1, SET_MV_CONNECT_DIST] = self.df[SET_HV_DIST_CURRENT]
         self.df[SET_MIN_TD_DIST] = self.df[[SET_MV_DIST_PLANNED, SET_HV_DIST_PLANNED]].min(axis=1)
 
     def elec_extension(self, grid_calc, max_dist, year, start_year, end_year, time_step, grid_capacity_limit,
-                       grid_connect_limit, new_investment, auto_intensification=0, prioritization=0, grid_name='Ouest'):
+                       grid_connect_limit, new_investment, auto_intensification=0, prioritization=0, grid_name='Ouest',
+                       extension_mode='rounds', neighbours=10):
         """
         Iterate through all electrified settlements and find which settlements can be economically connected to the grid
         Repeat with newly electrified settlements until no more are added
+
+        With extension_mode 'heap', the extension from electrified settlements (after the MV and HV rounds) is done
+        in a single priority-queue pass instead of rounds, see heap_extension
         """
 
         prio = int(prioritization)
@@ -1370,7 +1850,8 @@ class SettlementProcessor:
 
             intensification_lcoe, intensification_investment = \
                 self.get_grid_lcoe(dist_adjusted=mv_dist_adjusted, elecorder=0, additional_transformer=0, year=year,
-                                   time_step=time_step, end_year=end_year, grid_calc=grid_calc)
+                                   time_step=time_step, end_year=end_year, grid_calc=grid_calc,
+                                   candidates=self.extension_candidates(electrified, year, grid_name))
             intensification_lcoe = new_lcoes.copy(deep=True)
             intensification_lcoe.loc[(mv_planned < auto_intensification) & (prev_code != 1)] = 0.01
             intensification_lcoe = pd.DataFrame(intensification_lcoe)
@@ -1393,11 +1874,15 @@ class SettlementProcessor:
         # Find the unelectrified settlements where grid can be less costly than off-grid
         filter_lcoe, filter_investment = self.get_grid_lcoe(0, 0, 0, year, time_step, end_year, grid_calc)
         filter_lcoe = filter_lcoe[0]
+        # Grid LCOE and investment without extension distance, which is what the extension rounds give the
+        # settlements that are not re-costed
+        base_lcoe = filter_lcoe.values.copy()
+        base_investment = filter_investment[0].values.copy()
         filter_lcoe.loc[electrified == 1] = 99
         unelectrified = np.where(filter_lcoe < min_code_lcoes)
         unelectrified = unelectrified[0].tolist()
 
-        logging.info('Initially {} electrified'.format(sum(electrified)))
+        logger.info('Initially {} electrified'.format(sum(electrified)))
 
         # First round of extension from MV network
         mv_dist = pd.Series(self.df[SET_MV_DIST_PLANNED])
@@ -1405,7 +1890,9 @@ class SettlementProcessor:
 
         grid_lcoe, grid_investment = self.get_grid_lcoe(dist_adjusted=mv_dist_adjusted, elecorder=0,
                                                         additional_transformer=0, year=year, time_step=time_step,
-                                                        end_year=end_year, grid_calc=grid_calc)
+                                                        end_year=end_year, grid_calc=grid_calc,
+                                                        candidates=self.extension_candidates(electrified, year,
+                                                                                             grid_name))
 
         grid_capacity_limit, grid_connect_limit, cell_path_real, cell_path_adjusted, elecorder, electrified, \
             new_lcoes, new_investment \
@@ -1422,7 +1909,9 @@ class SettlementProcessor:
         #  Second round of extension from HV lines
         grid_lcoe, grid_investment = self.get_grid_lcoe(dist_adjusted=hv_dist_adjusted, elecorder=0,
                                                         additional_transformer=1, year=year, time_step=time_step,
-                                                        end_year=end_year, grid_calc=grid_calc)
+                                                        end_year=end_year, grid_calc=grid_calc,
+                                                        candidates=self.extension_candidates(electrified, year,
+                                                                                             grid_name))
 
         grid_capacity_limit, grid_connect_limit, cell_path_real, cell_path_adjusted, elecorder, electrified, \
             new_lcoes, new_investment \
@@ -1436,6 +1925,19 @@ class SettlementProcessor:
                                               region=grid_region,
                                               grid_name=grid_name)
 
+        if extension_mode == 'heap':
+            cell_path_real, cell_path_adjusted, elecorder, new_lcoes, new_investment = \
+                self.heap_extension(grid_calc=grid_calc, max_dist=max_dist, year=year, time_step=time_step,
+                                    end_year=end_year, grid_capacity_limit=grid_capacity_limit,
+                                    grid_connect_limit=grid_connect_limit, unelectrified=unelectrified,
+                                    electrified=electrified, elecorder=elecorder, cell_path_real=cell_path_real,
+                                    cell_path_adjusted=cell_path_adjusted, new_lcoes=new_lcoes,
+                                    new_investment=new_investment, grid_name=grid_name, neighbours=neighbours)
+
+            return new_lcoes, cell_path_real, elecorder, cell_path_real, pd.DataFrame(new_investment)
+        elif extension_mode != 'rounds':
+            raise ValueError("extension_mode must be 'rounds' or 'heap', not {}".format(extension_mode))
+
         # Third to last round of extension loops from electrified settlements. First considering all
         # electrified settlements up until this point, then from the newly electrified settlements in each round
         prev_electrified = np.zeros(len(prev_code))
@@ -1444,7 +1946,7 @@ class SettlementProcessor:
         while sum(electrified) > sum(prev_electrified) and len(test) > 0:
             new_electrified = electrified - prev_electrified
             prev_electrified = electrified
-            logging.info('Electrification loop {} with {} electrified'.format(loops, int(sum(new_electrified))))
+            logger.info('Electrification loop {} with {} electrified'.format(loops, int(sum(new_electrified))))
             loops += 1
 
             extension_nodes = np.where(new_electrified == 1)
@@ -1452,18 +1954,24 @@ class SettlementProcessor:
             test = np.setdiff1d(unelectrified, extension_nodes).tolist()
 
             if sum(new_electrified) > 1 and len(test) > 1:
+                # Only the candidates that are still unelectrified can be connected in this round, together with the
+                # settlements whose off-grid LCOE is above the 99 used to mask the grid LCOE. All other settlements
+                # keep the LCOE and investment without extension distance
+                test = np.array(test, dtype=int)
+                recost = test[(electrified[test] == 0) | (min_code_lcoes.values[test] > 99)].tolist()
+
                 # Calculating the distance and adjusted distance from each unelectrified settelement to the closest
                 # electrified settlement, as well as the electrification order an total MV distance to that electrified
                 # settlement
                 nearest_dist_adjusted, nearest_elec_order, prev_dist, nearest_dist = \
-                    self.closest_electrified_settlement(new_electrified, unelectrified, cell_path_real,
+                    self.closest_electrified_settlement(new_electrified, recost, cell_path_real,
                                                         grid_penalty_ratio, elecorder)
 
-                grid_lcoe, grid_investment = self.get_grid_lcoe(dist_adjusted=nearest_dist_adjusted,
-                                                                elecorder=nearest_elec_order,
-                                                                additional_transformer=0, year=year,
-                                                                time_step=time_step,
-                                                                end_year=end_year, grid_calc=grid_calc)
+                grid_lcoe, grid_investment = \
+                    self.get_grid_lcoe(dist_adjusted=nearest_dist_adjusted, elecorder=nearest_elec_order,
+                                       additional_transformer=0, year=year, time_step=time_step,
+                                       end_year=end_year, grid_calc=grid_calc, candidates=recost,
+                                       fill=(base_lcoe, base_investment))
 
                 grid_capacity_limit, grid_connect_limit, cell_path_real, cell_path_adjusted, elecorder, electrified, \
                     new_lcoes, new_investment = \
@@ -1482,22 +1990,212 @@ class SettlementProcessor:
 
         return new_lcoes, cell_path_real, elecorder, cell_path_real, pd.DataFrame(new_investment)
 
+    def heap_extension(self, grid_calc, max_dist, year, time_step, end_year, grid_capacity_limit, grid_connect_limit,
+                       unelectrified, electrified, elecorder, cell_path_real, cell_path_adjusted, new_lcoes,
+                       new_investment, grid_name, neighbours=10):
+        """Extends the grid from the electrified settlements in a single priority-queue (Prim-style) pass
+
+        Each candidate settlement is keyed by how much cheaper its grid connection is than its least-cost off-grid
+        option. The most beneficial connection is made first, and the nearest candidates of the newly connected
+        settlement are then queued with a connection from it. These connections are costed once, before the pass. The
+        grid capacity and connection limits are used up in the order the settlements are connected, and the extension
+        stops at the first settlement that exceeds them.
+
+        Unlike the rounds in elec_extension, a settlement can connect to any electrified settlement, not only to those
+        electrified in the previous round, so the results differ slightly.
+
+        Arguments
+        ---------
+        unelectrified : list
+            Positions of the settlements where the grid can be less costly than off-grid
+        electrified, elecorder, cell_path_real, cell_path_adjusted, new_lcoes, new_investment : numpy.ndarray
+            State of the grid extension after the MV and HV rounds
+        neighbours : int
+            Number of nearest candidate settlements queued after each connection
+
+        Returns
+        -------
+        cell_path_real, cell_path_adjusted, elecorder, new_lcoes, new_investment : numpy.ndarray
+        """
+        x = self.df[SET_X_DEG].values
+        y = self.df[SET_Y_DEG].values
+        grid_penalty_ratio = self.df[SET_GRID_PENALTY].values
+        min_code_lcoes = self.df[SET_MIN_OFFGRID_LCOE + "{}".format(year)].values
+        region = self.df['ClosestGrid'].values
+
+        electrified = np.array(electrified)
+        elecorder = np.array(elecorder)
+        cell_path_real = np.array(cell_path_real, dtype=float)
+        cell_path_adjusted = np.array(cell_path_adjusted, dtype=float)
+        new_lcoes = np.array(new_lcoes, dtype=float)
+        new_investment = np.array(new_investment, dtype=float)
+
+        consumption = self.df[SET_ENERGY_PER_CELL + "{}".format(year)].values  # kWh/year
+        average_load = consumption / (1 - grid_calc.distribution_losses) / HOURS_PER_YEAR  # kW
+        peak_load = average_load / grid_calc.base_to_peak_load_ratio  # kW
+        new_grid_connections = (self.df[SET_NEW_CONNECTIONS + "{}".format(year)] /
+                                self.df[SET_NUM_PEOPLE_PER_HH]).values
+
+        candidates = np.array(unelectrified, dtype=int)
+        candidates = candidates[(electrified[candidates] == 0) & (region[candidates] == grid_name)]
+        sources = np.where(electrified == 1)[0]
+        if len(candidates) == 0 or len(sources) == 0:
+            return cell_path_real, cell_path_adjusted, elecorder, new_lcoes, new_investment
+
+        # The connections of each candidate from its nearest candidates are costed up front, so that a connection
+        # made during the pass only takes arithmetic. Their LCOE and investment are linear in the electrification
+        # order (it scales the cost of the connection line only), so they are costed for the orders 0 and 1
+        k = min(neighbours + 1, len(candidates))
+        candidate_tree = scipy.spatial.cKDTree(np.column_stack((x[candidates], y[candidates])))
+        _, nearest = candidate_tree.query(np.column_stack((x[candidates], y[candidates])), k=k)
+        nearest = np.reshape(nearest, (len(candidates), k))
+        # Each candidate is among its own nearest candidates, unless more than k share its location. Its column is
+        # dropped, or the farthest column if it is not there
+        own = nearest == np.arange(len(candidates))[:, np.newaxis]
+        keep = np.ones(nearest.shape, dtype=bool)
+        keep[np.arange(len(candidates)), np.where(own.any(axis=1), own.argmax(axis=1), k - 1)] = False
+        neighbours = k - 1
+        nearest = candidates[nearest[keep].reshape(len(candidates), neighbours)]
+        origins = np.repeat(candidates, neighbours)
+        edge_dist = self.haversine_vector(x[origins], y[origins], x[nearest.ravel()], y[nearest.ravel()])
+        edge_dist_adjusted = np.nan_to_num(edge_dist * grid_penalty_ratio[nearest.ravel()])
+        edge_costs = []
+        for order in [0, 1]:
+            grid_lcoe, grid_investment = self.get_grid_lcoe(dist_adjusted=edge_dist_adjusted,
+                                                            elecorder=np.full(len(origins), order),
+                                                            additional_transformer=0, year=year,
+                                                            time_step=time_step, end_year=end_year,
+                                                            grid_calc=grid_calc, rows=nearest.ravel())
+            edge_costs += [grid_lcoe[0].values.reshape(nearest.shape),
+                           grid_investment[0].values.reshape(nearest.shape)]
+        lcoe_base, investment_base, lcoe_step, investment_step = edge_costs
+        lcoe_step = lcoe_step - lcoe_base
+        investment_step = investment_step - investment_base
+        edge_dist = edge_dist.reshape(nearest.shape)
+        edge_dist_adjusted = edge_dist_adjusted.reshape(nearest.shape)
+        position = np.full(len(x), -1)
+        position[candidates] = np.arange(len(candidates))
+
+        best_key = np.full(len(x), np.inf)
+        connections = []
+
+        def push_connections(rows, origins, dist, dist_adjusted, grid_lcoe, grid_investment):
+            """Queues the beneficial connections of the unelectrified rows from the origins"""
+            order = elecorder[origins] + 1
+            prev_dist = cell_path_real[origins]
+            key = grid_lcoe - min_code_lcoes[rows]
+            for i in np.where((electrified[rows] == 0) & (key < 0) & (grid_lcoe <= new_lcoes[rows]) &
+                              (prev_dist + dist_adjusted <= max_dist) & (key < best_key[rows]))[0]:
+                row = rows[i]
+                best_key[row] = key[i]
+                heapq.heappush(connections, (key[i], row, grid_lcoe[i], grid_investment[i], order[i],
+                                             prev_dist[i] + dist[i], dist_adjusted[i]))
+
+        # Start from the closest electrified settlement of each candidate
+        closest = sources[self.do_kdtree(np.column_stack((x[sources], y[sources])),
+                                         np.column_stack((x[candidates], y[candidates])))]
+        dist = self.haversine_vector(x[closest], y[closest], x[candidates], y[candidates])
+        dist_adjusted = np.nan_to_num(dist * grid_penalty_ratio[candidates])
+        grid_lcoe, grid_investment = self.get_grid_lcoe(dist_adjusted=dist_adjusted, elecorder=elecorder[closest] + 1,
+                                                        additional_transformer=0, year=year, time_step=time_step,
+                                                        end_year=end_year, grid_calc=grid_calc, rows=candidates)
+        push_connections(candidates, closest, dist, dist_adjusted, grid_lcoe[0].values, grid_investment[0].values)
+
+        while connections:
+            key, row, grid_lcoe, grid_investment, order, path_real, dist_adjusted = heapq.heappop(connections)
+            if electrified[row] == 1 or key > best_key[row]:
+                continue
+            if peak_load[row] > grid_capacity_limit or new_grid_connections[row] > grid_connect_limit:
+                break
+            grid_capacity_limit -= peak_load[row]
+            grid_connect_limit -= new_grid_connections[row]
+
+            electrified[row] = 1
+            elecorder[row] = order
+            cell_path_real[row] = path_real
+            cell_path_adjusted[row] = dist_adjusted
+            new_lcoes[row] = grid_lcoe
+            new_investment[row] = grid_investment
+
+            i = position[row]
+            push_connections(nearest[i], np.full(neighbours, row), edge_dist[i], edge_dist_adjusted[i],
+                             lcoe_base[i] + lcoe_step[i] * (order + 1),
+                             investment_base[i] + investment_step[i] * (order + 1))
+
+        logger.info('Heap extension with {} electrified'.format(int(sum(electrified))))
+
+        return cell_path_real, cell_path_adjusted, elecorder, new_lcoes, new_investment
+
+    def extension_candidates(self, electrified, year, grid_name):
+        """Positions of the settlements whose grid LCOE can change the outcome of update_grid_extension_info
+
+        Those are the unelectrified settlements closest to the grid, and the settlements with an off-grid LCOE above
+        the 99 that the grid LCOE of all other settlements is masked with.
+        """
+        min_code_lcoes = self.df[SET_MIN_OFFGRID_LCOE + "{}".format(year)].values
+        return np.where(((np.asarray(electrified) == 0) & (self.df['ClosestGrid'].values == grid_name)) |
+                        (min_code_lcoes > 99))[0]
+
     def get_grid_lcoe(self, dist_adjusted, elecorder, additional_transformer, year, time_step, end_year, grid_calc,
-                      get_max_dist=False):
+                      get_max_dist=False, rows=None, candidates=None, fill=(99, 0)):
+        """Calculates the grid LCOE and investment cost of the settlements
+
+        Arguments
+        ---------
+        rows : list, optional
+            Positions of the settlements to calculate, all settlements by default. The distance and electrification
+            order must then be given for these settlements only, and the results are in the same order
+        candidates : numpy.ndarray, optional
+            Boolean mask or positions of the settlements to calculate. Unlike with rows, the distance and
+            electrification order are given for all settlements and the results cover all settlements, the others
+            getting the fill values
+        fill : tuple
+            LCOE and investment cost of the settlements that are not candidates, scalars or arrays of all settlements
+        """
+        def column(name):
+            if rows is None:
+                return self.df[name]
+            # Plain arrays keep the per-call overhead low when only a few settlements are calculated
+            return self.df[name].values[rows]
+
+        if rows is not None:
+            dist_adjusted = np.asarray(dist_adjusted)
+            elecorder = np.asarray(elecorder)
+
+        # The distribution network of all the settlements is sized at the first call with their demand and only the
+        # connection to the grid is recalculated in the extension rounds that follow
+        distribution = grid_calc.cached_distribution_networks(
+            people=np.maximum(self.df[SET_POP + "{}".format(year)], 0.00001),
+            new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
+            total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
+            energy_per_cell=np.maximum(self.df[SET_ENERGY_PER_CELL + "{}".format(year)], 0.000000000001),
+            num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
+            grid_cell_area=self.df[SET_GRID_CELL_AREA])
+        if rows is not None:
+            distribution = tuple(tuple(values if np.ndim(values) == 0 else np.asarray(values)[rows]
+                                       for values in network) for network in distribution)
+
+        out = None
+        if candidates is not None:
+            out = tuple(np.array(np.broadcast_to(values, len(self.df)), dtype=float) for values in fill)
+
         grid = \
-            grid_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
+            grid_calc.get_lcoe(energy_per_cell=column(SET_ENERGY_PER_CELL + "{}".format(year)),
                                start_year=year - time_step,
                                end_year=end_year,
-                               people=self.df[SET_POP + "{}".format(year)],
-                               new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                               total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                               prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                               num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                               grid_cell_area=self.df[SET_GRID_CELL_AREA],
+                               people=column(SET_POP + "{}".format(year)),
+                               new_connections=column(SET_NEW_CONNECTIONS + "{}".format(year)),
+                               total_energy_per_cell=column(SET_TOTAL_ENERGY_PER_CELL),
+                               prev_code=column(SET_ELEC_FINAL_CODE + "{}".format(year - time_step)),
+                               num_people_per_hh=column(SET_NUM_PEOPLE_PER_HH),
+                               grid_cell_area=column(SET_GRID_CELL_AREA),
                                additional_mv_line_length=dist_adjusted,
                                elec_loop=elecorder,
                                additional_transformer=additional_transformer,
-                               get_max_dist=get_max_dist)
+                               get_max_dist=get_max_dist,
+                               distribution=distribution,
+                               rows=candidates,
+                               out=out)
         if get_max_dist:
             return grid[0], grid[1], grid[2]
         else:
@@ -1624,7 +2322,7 @@ class SettlementProcessor:
         unelectrified = np.where(filter_lcoe < min_code_lcoes)
         unelectrified = unelectrified[0].tolist()
 
-        logging.info('Initially {} electrified'.format(sum(electrified)))
+        logger.info('Initially {} electrified'.format(sum(electrified)))
 
         # First round of extension from MV network
         mv_dist = self.df['extension_distance_' + '{}'.format(year)].copy(deep=True)
@@ -1633,7 +2331,9 @@ class SettlementProcessor:
 
         grid_lcoe, grid_investment = self.get_grid_lcoe(dist_adjusted=mv_dist_adjusted, elecorder=0,
                                                         additional_transformer=0, year=year, time_step=time_step,
-                                                        end_year=end_year, grid_calc=grid_calc)
+                                                        end_year=end_year, grid_calc=grid_calc,
+                                                        candidates=self.extension_candidates(electrified, year,
+                                                                                             grid_name))
 
         cell_path_real, cell_path_adjusted, elecorder, electrified, \
         new_lcoes, new_investment \
@@ -1741,7 +2441,7 @@ class SettlementProcessor:
 
         """
 
-        logging.info('Calculate new connections')
+        logger.info('Calculate new connections')
         # Calculate new connections for grid related purposes
         # TODO - This was changed based on your "newly created" column SET_ELEC_POP.
         # Please review and check whether this creates any problem at your distribution_network function
@@ -1794,7 +2494,7 @@ class SettlementProcessor:
 
         """
 
-        logging.info('Setting electrification demand as per target per year')
+        logger.info('Setting electrification demand as per target per year')
 
         if max(self.df[SET_CAPITA_DEMAND]) == 0:
             # RUN_PARAM: This shall be changed if different urban/rural categorization is decided
@@ -1920,107 +2620,74 @@ class SettlementProcessor:
         self.calculate_total_demand_per_settlement(year)
 
     def calculate_off_grid_lcoes(self, mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc, mg_diesel_calc,
-                                 sa_diesel_calc, year, end_year, time_step, diesel_techs=0):
+                                 sa_diesel_calc, year, end_year, time_step, diesel_techs=0, tech_labels=True):
         """
         Calculate the LCOEs for all off-grid technologies
 
+        Arguments
+        ---------
+        tech_labels : bool
+            Also store the name of the cheapest off-grid technology, see choose_minimum_off_grid_tech
         """
 
-        logging.info('Calculate minigrid hydro LCOE')
-        self.df[SET_LCOE_MG_HYDRO + "{}".format(year)], mg_hydro_investment = \
-            mg_hydro_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                   start_year=year - time_step,
-                                   end_year=end_year,
-                                   people=self.df[SET_POP + "{}".format(year)],
-                                   new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                   total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                   prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                   num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                   grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                   additional_mv_line_length=self.df[SET_HYDRO_DIST])
-
-        logging.info('Calculate minigrid PV LCOE')
-        self.df[SET_LCOE_MG_PV + "{}".format(year)], mg_pv_investment = \
-            mg_pv_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                start_year=year - time_step,
-                                end_year=end_year,
-                                people=self.df[SET_POP + "{}".format(year)],
-                                new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR)
-        self.df.loc[self.df[SET_GHI] <= 1000, SET_LCOE_MG_PV + "{}".format(year)] = 99
+        technologies = [mg_hydro_calc, mg_pv_calc, mg_wind_calc]
+        columns = [SET_LCOE_MG_HYDRO, SET_LCOE_MG_PV, SET_LCOE_MG_WIND]
+        tech_inputs = [{'additional_mv_line_length': self.df[SET_HYDRO_DIST]},
+                       {'capacity_factor': self.df[SET_GHI] / HOURS_PER_YEAR},
+                       {'capacity_factor': self.df[SET_WINDCF]}]
+
+        if diesel_techs != 0:
+            technologies += [mg_diesel_calc, sa_diesel_calc]
+            columns += [SET_LCOE_MG_DIESEL, SET_LCOE_SA_DIESEL]
+            tech_inputs += [{'fuel_cost': self.df[SET_MG_DIESEL_FUEL + "{}".format(year)]},
+                            {'fuel_cost': self.df[SET_SA_DIESEL_FUEL + "{}".format(year)]}]
+
+        technologies.append(sa_pv_calc)
+        columns.append(SET_LCOE_SA_PV)
+        tech_inputs.append({'capacity_factor': self.df[SET_GHI] / HOURS_PER_YEAR})
+
+        logger.info('Calculate off-grid LCOEs')
+        lcoes, investments = \
+            Technology.get_lcoes(technologies,
+                                 energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
+                                 start_year=year - time_step,
+                                 end_year=end_year,
+                                 people=self.df[SET_POP + "{}".format(year)],
+                                 new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
+                                 total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
+                                 prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
+                                 num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
+                                 grid_cell_area=self.df[SET_GRID_CELL_AREA],
+                                 tech_inputs=tech_inputs)
+
+        investment = {}
+        for column in [SET_LCOE_MG_HYDRO, SET_LCOE_MG_PV, SET_LCOE_MG_WIND, SET_LCOE_MG_DIESEL, SET_LCOE_SA_DIESEL,
+                       SET_LCOE_SA_PV]:
+            if column in columns:
+                i = columns.index(column)
+                self.df[column + "{}".format(year)] = lcoes[:, i]
+                investment[column] = pd.DataFrame(investments[:, [i]])
+            else:
+                self.df[column + "{}".format(year)] = 99
+                investment[column] = pd.DataFrame(np.zeros((len(self.df), 1)))
 
-        logging.info('Calculate minigrid wind LCOE')
-        self.df[SET_LCOE_MG_WIND + "{}".format(year)], mg_wind_investment = \
-            mg_wind_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                  start_year=year - time_step,
-                                  end_year=end_year,
-                                  people=self.df[SET_POP + "{}".format(year)],
-                                  new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                  total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                  prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                  num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                  grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                  capacity_factor=self.df[SET_WINDCF])
+        self.df.loc[self.df[SET_GHI] <= 1000, SET_LCOE_MG_PV + "{}".format(year)] = 99
         self.df.loc[self.df[SET_WINDCF] <= 0.1, SET_LCOE_MG_WIND + "{}".format(year)] = 99
-
-        if diesel_techs == 0:
-            self.df[SET_LCOE_MG_DIESEL + "{}".format(year)] = 99
-            self.df[SET_LCOE_SA_DIESEL + "{}".format(year)] = 99
-            sa_diesel_investment = mg_pv_investment * 0
-            mg_diesel_investment = mg_pv_investment * 0
-        else:
-            logging.info('Calculate minigrid diesel LCOE')
-            self.df[SET_LCOE_MG_DIESEL + "{}".format(year)], mg_diesel_investment = \
-                mg_diesel_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                        start_year=year - time_step,
-                                        end_year=end_year,
-                                        people=self.df[SET_POP + "{}".format(year)],
-                                        new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                        total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                        prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                        num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                        grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                        fuel_cost=self.df[SET_MG_DIESEL_FUEL + "{}".format(year)],
-                                        )
-
-            logging.info('Calculate standalone diesel LCOE')
-            self.df[SET_LCOE_SA_DIESEL + "{}".format(year)], sa_diesel_investment = \
-                sa_diesel_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                        start_year=year - time_step,
-                                        end_year=end_year,
-                                        people=self.df[SET_POP + "{}".format(year)],
-                                        new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                        total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                        prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                        num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                        grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                        fuel_cost=self.df[SET_SA_DIESEL_FUEL + "{}".format(year)],
-                                        )
-
-        logging.info('Calculate standalone PV LCOE')
-        self.df[SET_LCOE_SA_PV + "{}".format(year)], sa_pv_investment = \
-            sa_pv_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                start_year=year - time_step,
-                                end_year=end_year,
-                                people=self.df[SET_POP + "{}".format(year)],
-                                new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR)
         self.df.loc[self.df[SET_GHI] <= 1000, SET_LCOE_SA_PV + "{}".format(year)] = 99
 
-        self.choose_minimum_off_grid_tech(year, mg_hydro_calc)
+        sa_diesel_investment = investment[SET_LCOE_SA_DIESEL]
+        sa_pv_investment = investment[SET_LCOE_SA_PV]
+        mg_diesel_investment = investment[SET_LCOE_MG_DIESEL]
+        mg_pv_investment = investment[SET_LCOE_MG_PV]
+        mg_wind_investment = investment[SET_LCOE_MG_WIND]
+        mg_hydro_investment = investment[SET_LCOE_MG_HYDRO]
+
+        self.choose_minimum_off_grid_tech(year, mg_hydro_calc, tech_labels)
 
         return sa_diesel_investment, sa_pv_investment, mg_diesel_investment, mg_pv_investment, mg_wind_investment, \
             mg_hydro_investment
 
-    def choose_minimum_off_grid_tech(self, year, mg_hydro_calc):
+    def choose_minimum_off_grid_tech(self, year, mg_hydro_calc, tech_labels=True):
         """Choose minimum LCOE off-grid technology
 
         First step determines the off-grid technology with minimum LCOE
@@ -2030,78 +2697,95 @@ class SettlementProcessor:
         ---------
         year : int
         mg_hydro_calc : dict
+        tech_labels : bool
+            Also store the LCOE column name of the selected technology in Minimum_Tech_Off_grid<year>
         """
 
-        logging.info('Determine minimum technology (off-grid)')
-        self.df[SET_MIN_OFFGRID + "{}".format(year)] = self.df[[SET_LCOE_SA_PV + "{}".format(year),
-                                                                SET_LCOE_MG_WIND + "{}".format(year),
-                                                                SET_LCOE_MG_PV + "{}".format(year),
-                                                                SET_LCOE_MG_HYDRO + "{}".format(year),
-                                                                SET_LCOE_MG_DIESEL + "{}".format(year),
-                                                                SET_LCOE_SA_DIESEL + "{}".format(year)]].T.idxmin()
+        logger.info('Determine minimum technology (off-grid)')
 
-        # A df with all hydro-power sites, to ensure that they aren't assigned more capacity than is available
-        hydro_used = 'HydropowerUsed'  # the amount of the hydro potential that has been assigned
+        # The hydro-power sites can't be assigned more capacity than is available. The settlements within reach of
+        # each site take its capacity in turn, the ones beyond its capacity can't use hydro-power
         hydro_lcoe = self.df[SET_LCOE_MG_HYDRO + "{}".format(year)].copy()
-        hydro_df = self.df[[SET_HYDRO_FID, SET_HYDRO]].drop_duplicates(subset=SET_HYDRO_FID)
-        hydro_df[hydro_used] = 0
-        hydro_df = hydro_df.set_index(SET_HYDRO_FID)
+        hydro_capacity = self.df[[SET_HYDRO_FID, SET_HYDRO]].drop_duplicates(subset=SET_HYDRO_FID)
+        hydro_capacity = hydro_capacity.set_index(SET_HYDRO_FID)[SET_HYDRO]
         max_hydro_dist = 5  # the max distance in km to consider hydropower viable
         additional_capacity = (
                 (self.df[SET_ENERGY_PER_CELL + "{}".format(year)]) /
                 (HOURS_PER_YEAR * mg_hydro_calc.capacity_factor * mg_hydro_calc.base_to_peak_load_ratio *
                  (1 - mg_hydro_calc.distribution_losses)))
 
-        for index, row in hydro_df.iterrows():
-            hydro_usage = additional_capacity.loc[(self.df[SET_HYDRO_FID] == index) &
-                                                  (self.df[SET_HYDRO_DIST] < max_hydro_dist)].sum()
-            if hydro_usage > hydro_df[SET_HYDRO][index]:
-                hydro_usage_cumsum = additional_capacity.loc[(self.df[SET_HYDRO_FID] == index) &
-                                                             (self.df[SET_HYDRO_DIST] < max_hydro_dist)].cumsum()
-                hydro_usage = hydro_usage_cumsum.loc[hydro_usage_cumsum > hydro_df[SET_HYDRO][index]]
-                hydro_lcoe[hydro_usage.index] = 99
+        in_reach = self.df[SET_HYDRO_DIST] < max_hydro_dist
+        sites = self.df.loc[in_reach, SET_HYDRO_FID]
+        hydro_usage_cumsum = additional_capacity[in_reach].groupby(sites).cumsum()
+        over_capacity = hydro_usage_cumsum > sites.map(hydro_capacity)
+        hydro_lcoe.loc[over_capacity.index[over_capacity.values]] = 99
 
         self.df[SET_LCOE_MG_HYDRO + "{}".format(year)] = hydro_lcoe
 
         self.df.loc[self.df[SET_HYDRO_DIST] > max_hydro_dist, SET_LCOE_MG_HYDRO + "{}".format(year)] = 99
 
-        self.df[SET_MIN_OFFGRID + "{}".format(year)] = self.df[[SET_LCOE_SA_PV + "{}".format(year),
-                                                                SET_LCOE_MG_WIND + "{}".format(year),
-                                                                SET_LCOE_MG_PV + "{}".format(year),
-                                                                SET_LCOE_MG_HYDRO + "{}".format(year),
-                                                                SET_LCOE_MG_DIESEL + "{}".format(year),
-                                                                SET_LCOE_SA_DIESEL + "{}".format(year)]].T.idxmin()
-
-        logging.info('Determine minimum tech LCOE')
-        self.df[SET_MIN_OFFGRID_LCOE + "{}".format(year)] = self.df[[SET_LCOE_SA_PV + "{}".format(year),
-                                                                     SET_LCOE_MG_WIND + "{}".format(year),
-                                                                     SET_LCOE_MG_PV + "{}".format(year),
-                                                                     SET_LCOE_MG_HYDRO + "{}".format(year),
-                                                                     SET_LCOE_MG_DIESEL + "{}".format(year),
-                                                                     SET_LCOE_SA_DIESEL + "{}".format(year)]].T.min()
-
-        codes = {SET_LCOE_MG_HYDRO + "{}".format(year): 7,
-                 SET_LCOE_MG_WIND + "{}".format(year): 6,
-                 SET_LCOE_MG_PV + "{}".format(year): 5,
-                 SET_LCOE_MG_DIESEL + "{}".format(year): 4,
-                 SET_LCOE_SA_DIESEL + "{}".format(year): 2,
-                 SET_LCOE_SA_PV + "{}".format(year): 3}
-
-        self.df.loc[self.df[SET_MIN_OFFGRID + "{}".format(year)] == SET_LCOE_MG_HYDRO + "{}".format(
-            year), SET_MIN_OFFGRID_CODE + "{}".format(year)] = codes[SET_LCOE_MG_HYDRO + "{}".format(year)]
-        self.df.loc[self.df[SET_MIN_OFFGRID + "{}".format(year)] == SET_LCOE_SA_PV + "{}".format(
-            year), SET_MIN_OFFGRID_CODE + "{}".format(year)] = codes[SET_LCOE_SA_PV + "{}".format(year)]
-        self.df.loc[self.df[SET_MIN_OFFGRID + "{}".format(year)] == SET_LCOE_MG_WIND + "{}".format(
-            year), SET_MIN_OFFGRID_CODE + "{}".format(year)] = codes[SET_LCOE_MG_WIND + "{}".format(year)]
-        self.df.loc[self.df[SET_MIN_OFFGRID + "{}".format(year)] == SET_LCOE_MG_PV + "{}".format(
-            year), SET_MIN_OFFGRID_CODE + "{}".format(year)] = codes[SET_LCOE_MG_PV + "{}".format(year)]
-        self.df.loc[self.df[SET_MIN_OFFGRID + "{}".format(year)] == SET_LCOE_MG_DIESEL + "{}".format(
-            year), SET_MIN_OFFGRID_CODE + "{}".format(year)] = codes[SET_LCOE_MG_DIESEL + "{}".format(year)]
-        self.df.loc[self.df[SET_MIN_OFFGRID + "{}".format(year)] == SET_LCOE_SA_DIESEL + "{}".format(
-            year), SET_MIN_OFFGRID_CODE + "{}".format(year)] = codes[SET_LCOE_SA_DIESEL + "{}".format(year)]
+        columns = [SET_LCOE_SA_PV + "{}".format(year),
+                   SET_LCOE_MG_WIND + "{}".format(year),
+                   SET_LCOE_MG_PV + "{}".format(year),
+                   SET_LCOE_MG_HYDRO + "{}".format(year),
+                   SET_LCOE_MG_DIESEL + "{}".format(year),
+                   SET_LCOE_SA_DIESEL + "{}".format(year)]
+        codes = [3, 6, 5, 7, 4, 2]
+
+        position, min_lcoe = self.min_tech(columns)
+
+        if tech_labels:
+            self.df[SET_MIN_OFFGRID + "{}".format(year)] = self.tech_labels(position, columns)
+
+        logger.info('Determine minimum tech LCOE')
+        self.df[SET_MIN_OFFGRID_LCOE + "{}".format(year)] = min_lcoe
+
+        self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] = self.tech_codes(position, codes)
+
+    def min_tech(self, columns):
+        """Position of the lowest of the LCOE columns for each settlement, and its LCOE
+
+        Missing LCOEs are skipped, as with DataFrame.idxmin. Settlements without any LCOE get position -1 and a NaN
+        LCOE.
+
+        Arguments
+        ---------
+        columns : list
+
+        Returns
+        -------
+        position : numpy.ndarray
+        min_lcoe : numpy.ndarray
+        """
+        lcoes = self.df[columns].to_numpy()
+        missing = np.isnan(lcoes)
+        filled = np.where(missing, np.inf, lcoes)
+        position = np.argmin(filled, axis=1)
+        rows = np.arange(len(lcoes))
+
+        # Where the lowest LCOE is infinite, a missing one may come first
+        picked_missing = missing[rows, position]
+        position[picked_missing] = np.argmax(~missing[picked_missing], axis=1)
+
+        min_lcoe = filled[rows, position]
+        no_lcoe = missing.all(axis=1)
+        position[no_lcoe] = -1
+        min_lcoe[no_lcoe] = np.nan
+        return position, min_lcoe
+
+    @staticmethod
+    def tech_codes(position, codes):
+        """Technology code at each position from min_tech, NaN where there is none"""
+        return np.where(position >= 0, np.asarray(codes, dtype=np.float64)[position], np.nan)
+
+    @staticmethod
+    def tech_labels(position, columns):
+        """LCOE column name at each position from min_tech, NaN where there is none"""
+        return np.where(position >= 0, np.asarray(columns, dtype=object)[position], np.nan)
 
     def results_columns(self, year, time_step, prio,
-                        auto_intensification_ouest, auto_intensification_sud, auto_intensification_est):
+                        auto_intensification_ouest, auto_intensification_sud, auto_intensification_est,
+                        tech_labels=True):
         """Calculate the capacity and investment requirements for each settlement
 
         Once the grid extension algorithm has been run, determine the minimum overall option,
@@ -2110,82 +2794,50 @@ class SettlementProcessor:
         Arguments
         ---------
         year : int
+        tech_labels : bool
+            Also store the LCOE column name of the selected technology in MinimumOverall<year>
 
         """
 
-        # logging.info('Determine minimum overall')
-        self.df[SET_MIN_OVERALL + "{}".format(year)] = self.df[[SET_LCOE_GRID + "{}".format(year),
-                                                                SET_LCOE_SA_PV + "{}".format(year),
-                                                                SET_LCOE_MG_WIND + "{}".format(year),
-                                                                SET_LCOE_MG_PV + "{}".format(year),
-                                                                SET_LCOE_MG_HYDRO + "{}".format(year),
-                                                                SET_LCOE_MG_DIESEL + "{}".format(year),
-                                                                SET_LCOE_SA_DIESEL + "{}".format(year)]].T.idxmin()
+        # logger.info('Determine minimum overall')
+        columns = [SET_LCOE_GRID + "{}".format(year),
+                   SET_LCOE_SA_PV + "{}".format(year),
+                   SET_LCOE_MG_WIND + "{}".format(year),
+                   SET_LCOE_MG_PV + "{}".format(year),
+                   SET_LCOE_MG_HYDRO + "{}".format(year),
+                   SET_LCOE_MG_DIESEL + "{}".format(year),
+                   SET_LCOE_SA_DIESEL + "{}".format(year)]
+        codes = [1, 3, 6, 5, 7, 4, 2]
 
-        self.df.loc[self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 1,
-                    SET_MIN_OVERALL + "{}".format(year)] = 'Grid' + "{}".format(year)
+        position, min_lcoe = self.min_tech(columns)
 
-        if (prio == 2) or (prio == 4):
-            self.df.loc[(self.df[SET_MV_DIST_PLANNED] < auto_intensification_ouest) &
-                        (self.df[SET_LCOE_GRID + "{}".format(year)] != 99) &
-                        (self.df['ClosestGrid'] == 'Ouest'),
-                        SET_MIN_OVERALL + "{}".format(year)] = 'Grid' + "{}".format(year)
-
-            self.df.loc[(self.df[SET_MV_DIST_PLANNED] < auto_intensification_sud) &
-                        (self.df[SET_LCOE_GRID + "{}".format(year)] != 99) &
-                        (self.df['ClosestGrid'] == 'Sud'),
-                        SET_MIN_OVERALL + "{}".format(year)] = 'Grid' + "{}".format(year)
-
-            self.df.loc[(self.df[SET_MV_DIST_PLANNED] < auto_intensification_est) &
-                        (self.df[SET_LCOE_GRID + "{}".format(year)] != 99) &
-                        (self.df['ClosestGrid'] == 'Est'),
-                        SET_MIN_OVERALL + "{}".format(year)] = 'Grid' + "{}".format(year)
-
-        # logging.info('Determine minimum overall LCOE')
-        self.df[SET_MIN_OVERALL_LCOE + "{}".format(year)] = self.df[[SET_LCOE_GRID + "{}".format(year),
-                                                                     SET_LCOE_SA_PV + "{}".format(year),
-                                                                     SET_LCOE_MG_WIND + "{}".format(year),
-                                                                     SET_LCOE_MG_PV + "{}".format(year),
-                                                                     SET_LCOE_MG_HYDRO + "{}".format(year),
-                                                                     SET_LCOE_MG_DIESEL + "{}".format(year),
-                                                                     SET_LCOE_SA_DIESEL + "{}".format(year)]].T.min()
-
-        self.df.loc[self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 1,
-                    SET_MIN_OVERALL_LCOE + "{}".format(year)] = self.df[SET_LCOE_GRID + "{}".format(year)]
+        # Settlements that stay on the grid, position 0 is the grid
+        grid = (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 1).values
 
         if (prio == 2) or (prio == 4):
-            self.df.loc[(self.df[SET_MV_DIST_PLANNED] < auto_intensification_ouest) &
-                        (self.df[SET_LCOE_GRID + "{}".format(year)] != 99) &
-                        (self.df['ClosestGrid'] == 'Ouest'),
-                        SET_MIN_OVERALL_LCOE + "{}".format(year)] = self.df[SET_LCOE_GRID + "{}".format(year)]
-
-            self.df.loc[(self.df[SET_MV_DIST_PLANNED] < auto_intensification_sud) &
-                        (self.df[SET_LCOE_GRID + "{}".format(year)] != 99) &
-                        (self.df['ClosestGrid'] == 'Sud'),
-                        SET_MIN_OVERALL_LCOE + "{}".format(year)] = self.df[SET_LCOE_GRID + "{}".format(year)]
-
-            self.df.loc[(self.df[SET_MV_DIST_PLANNED] < auto_intensification_est) &
-                        (self.df[SET_LCOE_GRID + "{}".format(year)] != 99) &
-                        (self.df['ClosestGrid'] == 'Est'),
-                        SET_MIN_OVERALL_LCOE + "{}".format(year)] = self.df[SET_LCOE_GRID + "{}".format(year)]
-
-        # logging.info('Add technology codes')
-        codes = {SET_LCOE_GRID + "{}".format(year): 1,
-                 SET_LCOE_MG_HYDRO + "{}".format(year): 7,
-                 SET_LCOE_MG_WIND + "{}".format(year): 6,
-                 SET_LCOE_MG_PV + "{}".format(year): 5,
-                 SET_LCOE_MG_DIESEL + "{}".format(year): 4,
-                 SET_LCOE_SA_DIESEL + "{}".format(year): 2,
-                 SET_LCOE_SA_PV + "{}".format(year): 3}
-
-        for key in codes.keys():
-            self.df.loc[self.df[SET_MIN_OVERALL + "{}".format(year)] == key,
-                        SET_MIN_OVERALL_CODE + "{}".format(year)] = codes[key]
+            for grid_name, auto_intensification in [('Ouest', auto_intensification_ouest),
+                                                    ('Sud', auto_intensification_sud),
+                                                    ('Est', auto_intensification_est)]:
+                grid |= ((self.df[SET_MV_DIST_PLANNED] < auto_intensification) &
+                         (self.df[SET_LCOE_GRID + "{}".format(year)] != 99) &
+                         (self.df['ClosestGrid'] == grid_name)).values
+
+        position[grid] = 0
+
+        if tech_labels:
+            self.df[SET_MIN_OVERALL + "{}".format(year)] = self.tech_labels(position, columns)
+
+        # logger.info('Determine minimum overall LCOE')
+        self.df[SET_MIN_OVERALL_LCOE + "{}".format(year)] = np.where(grid, self.df[SET_LCOE_GRID + "{}".format(year)],
+                                                                     min_lcoe)
+
+        # logger.info('Add technology codes')
+        self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] = self.tech_codes(position, codes)
 
     def calculate_investments(self, sa_diesel_investment, sa_pv_investment, mg_diesel_investment, mg_pv_investment,
                               mg_wind_investment, mg_hydro_investment, grid_investment, year):
 
-        logging.info('Calculate investment cost')
+        logger.info('Calculate investment cost')
 
         self.df[SET_INVESTMENT_COST + "{}".format(year)] = 0
 
@@ -2204,7 +2856,7 @@ class SettlementProcessor:
     def apply_limitations(self, eleclimit, year, time_step, prioritization, auto_densification_ouest=0,
                           auto_densification_sud=0, auto_densification_est=0):
 
-        logging.info('Determine electrification limits')
+        logger.info('Determine electrification limits')
         choice = int(prioritization)
         self.df[SET_LIMIT + "{}".format(year)] = 0
 
@@ -2257,7 +2909,7 @@ class SettlementProcessor:
         elecrate = self.df.loc[self.df[SET_LIMIT + "{}".format(year)] == 1,
                                SET_POP + "{}".format(year)].sum() / self.df[SET_POP + "{}".format(year)].sum()
 
-        logging.info('Determine final electrification decision')
+        logger.info('Determine final electrification decision')
         self.df[SET_ELEC_FINAL_CODE + "{}".format(year)] = self.df[SET_MIN_OVERALL_CODE + "{}".format(year)]
         self.df.loc[(self.df[SET_LIMIT + "{}".format(year)] == 0), SET_ELEC_FINAL_CODE + "{}".format(year)] = 99
 
@@ -2278,7 +2930,7 @@ class SettlementProcessor:
         elecrate = self.df.loc[self.df[SET_LIMIT + "{}".format(year)] == 1,
                                SET_POP + "{}".format(year)].sum() / self.df[SET_POP + "{}".format(year)].sum()
 
-        logging.info('Determine final electrification decision')
+        logger.info('Determine final electrification decision')
         self.df[SET_ELEC_FINAL_CODE + "{}".format(year)] = self.df[SET_MIN_OVERALL_CODE + "{}".format(year)]
         self.df.loc[(self.df[SET_LIMIT + "{}".format(year)] == 0), SET_ELEC_FINAL_CODE + "{}".format(year)] = 99
 
@@ -2287,7 +2939,7 @@ class SettlementProcessor:
     def pre_screening(self, eleclimit, year, time_step, prioritization, auto_densification_ouest=0,
                           auto_densification_sud=0, auto_densification_est=0):
 
-        logging.info('Pre-select settlements to be electrified')
+        logger.info('Pre-select settlements to be electrified')
         choice = int(prioritization)
         self.df[SET_PRE_SCREEN + "{}".format(year)] = 0
 
@@ -2339,7 +2991,7 @@ class SettlementProcessor:
     def calculate_new_capacity(self, mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc, mg_diesel_calc,
                                sa_diesel_calc, grid_calc_ouest, grid_calc_sud, grid_calc_est, year):
 
-        logging.info('Calculate new capacity')
+        logger.info('Calculate new capacity')
         self.df.loc[self.df[SET_ELEC_FINAL_CODE + "{}".format(year)] == 99, SET_NEW_CAPACITY + "{}".format(year)] = 0
 
         self.df.loc[(self.df[SET_ELEC_FINAL_CODE + "{}".format(year)] == 1) & (self.df['ClosestGrid'] == 'Ouest'),
@@ -2406,7 +3058,7 @@ class SettlementProcessor:
         """The next section calculates the summaries for technology split,
         consumption added and total investment cost"""
 
-        logging.info('Calculate summaries')
+        logger.info('Calculate summaries')
 
         # Population Summaries
         df_summary[year][sumtechs[0]] = sum(self.df.loc[(self.df[SET_ELEC_FINAL_CODE + "{}".format(year)] == 1) &
@@ -3,9 +3,9 @@ import rasterio
 from pathlib import Path
 from skimage.morphology import skeletonize
 from rasterio.transform import xy
+from rasterio.windows import Window, from_bounds
 import shapely.wkt
 from shapely.geometry import Point, LineString
-from rasterio.features import rasterize
 import numpy as np
 try:
     from onsset.pathfinder import *
@@ -24,105 +24,243 @@ def create_geodataframe(df):
     return df
 
 
+# Pixel indices of the settlements, per raster grid and settlement locations, see pixel_indices
+_pixel_index_cache = {}
+
+
+def pixel_indices(df, affine, shape):
+    """Row and column of the raster pixel that contains each settlement
+
+    The settlements are projected to EPSG:3395, the projection of the cost rasters. Settlements outside the raster get
+    row and column -1. The result is cached, so that the projection is done once for all the pathfinder iterations,
+    grids and years that use the same raster grid.
+
+    Arguments
+    ---------
+    df : geopandas.GeoDataFrame
+    affine : affine.Affine
+        Transform of the raster
+    shape : tuple
+        Number of rows and columns of the raster
+    """
+    key = (tuple(affine)[:6], shape, len(df), hash(df['X_deg'].values.tobytes()), hash(df['Y_deg'].values.tobytes()))
+    if key not in _pixel_index_cache:
+        projected = df.geometry.to_crs('EPSG:3395')
+        cols, rows = ~affine * (projected.x.values, projected.y.values)
+        rows = np.floor(rows).astype(np.int64)
+        cols = np.floor(cols).astype(np.int64)
+        outside = (rows < 0) | (rows >= shape[0]) | (cols < 0) | (cols >= shape[1])
+        rows[outside] = -1
+        cols[outside] = -1
+        _pixel_index_cache[key] = (rows, cols)
+    return _pixel_index_cache[key]
+
+
+def target_positions(df, year, time_step, mv_line_max_length, rows):
+    """Positions of the settlements inside the raster that the pathfinder should try to connect
+    """
+    targets = (df['FinalElecCode' + '{}'.format(year - time_step)] != 1) & (df['MaxDist'] > 0) & \
+              (df['PlannedHVLineDist'] < mv_line_max_length) & (df['PreScreening' + "{}".format(year)] == 1)
+    return np.where(targets.values & (rows >= 0))[0]
+
+
+def burn_points(rows, cols, shape, layers):
+    """Burns point values into rasters, one raster per layer of values
+
+    Where several points fall in the same pixel, the last one is kept, as with rasterio.features.rasterize.
+
+    Arguments
+    ---------
+    rows, cols : numpy.ndarray
+        Pixel of each point
+    shape : tuple
+    layers : list
+        Arrays with a value per point
+
+    Returns
+    -------
+    list
+        One raster per layer, with zeros where there is no point
+    """
+    rasters = []
+    for values in layers:
+        values = np.asarray(values)
+        raster = np.zeros(shape, dtype=np.float64 if values.dtype.kind == 'f' else np.int64)
+        raster[rows, cols] = values
+        rasters.append(raster)
+    return rasters
+
+
+def scatter_distances(df, column, distance, id_raster, id_index):
+    """Writes the extension distances found by the pathfinder into a column of the settlements, in place
+
+    Arguments
+    ---------
+    df : geopandas.GeoDataFrame
+    column : str
+    distance : numpy.ndarray
+        Raster with the new extension distance at the connected targets, zero elsewhere
+    id_raster : numpy.ndarray
+        Raster with the id of the settlement in each target pixel
+    id_index : pandas.Index
+        The id of the settlement at each row of df
+    """
+    connected = distance > 0
+    positions = id_index.get_indexer(id_raster[connected])
+    found = positions >= 0
+    values = df[column].values.astype(np.float64)
+    values[positions[found]] = distance[connected][found]
+    df[column] = values
+
+
+def interior(raster):
+    """Copy of a raster with the cells on its edge set to zero
+
+    The pathfinder does not search beyond the edge of the rasters, so the origins and targets must lie inside it, see
+    pathfinder.seek
+    """
+    raster = raster.copy()
+    raster[[0, -1], :] = 0
+    raster[:, [0, -1]] = 0
+    return raster
+
+
+def grid_bounds(df, grid, buffer):
+    """Bounding box of the settlements closest to a grid, grown by a buffer
+
+    Used to crop the cost rasters of the grid, see GridRasterState. The crop is an approximation, as nothing keeps the
+    paths of the pathfinder within a distance of the settlements: the targets are selected on their distance to the
+    planned HV lines rather than to the network of the rasters, and the pathfinder adds up weighted costs, not
+    kilometres, up to the MaxDist of the targets, which is an economic reach. Over the cropped rasters, the
+    pathfinder can therefore miss paths that leave them, and connect fewer settlements or the same ones otherwise.
+
+    Arguments
+    ---------
+    df : geopandas.GeoDataFrame
+    grid : str
+    buffer : float
+        Distance added on each side, in km
+
+    Returns
+    -------
+    tuple
+        (left, bottom, right, top) in EPSG:3395, or None if no settlement is closest to the grid
+    """
+    settlements = df.loc[df['ClosestGrid'] == grid]
+    if len(settlements) == 0:
+        return None
+    left, bottom, right, top = settlements.geometry.to_crs('EPSG:3395').total_bounds
+    buffer = buffer * 1000
+    return left - buffer, bottom - buffer, right + buffer, top + buffer
+
+
+def raster_window(src, bounds):
+    """Window of a raster, in whole pixels, that covers the bounds and lies within the raster
+
+    Returns None, which reads the whole raster, if there are no bounds
+    """
+    if bounds is None:
+        return None
+    window = from_bounds(*bounds, transform=src.transform)
+    col_start = max(int(np.floor(window.col_off)), 0)
+    row_start = max(int(np.floor(window.row_off)), 0)
+    col_stop = min(int(np.ceil(window.col_off + window.width)), src.width)
+    row_stop = min(int(np.ceil(window.row_off + window.height)), src.height)
+    return Window(col_start, row_start, max(col_stop - col_start, 1), max(row_stop - row_start, 1))
+
+
+class GridRasterState:
+    """Pathfinder rasters of one grid, carried in memory from one year of the analysis to the next
+
+    Holds the cost weights, the origins (the grid network found so far) and the cumulative MV distance, so that
+    find_grid_path does not have to write them to GeoTIFF files and read them back at the next time step.
+
+    Arguments
+    ---------
+    gis_costs_folder : str
+        Folder with the <grid>_final_cost.tif and <grid>_power_cost.tif rasters
+    grid : str
+    bounds : tuple, optional
+        Only load this (left, bottom, right, top) part of the rasters, in EPSG:3395, see grid_bounds. The whole
+        rasters by default
+    """
+
+    def __init__(self, gis_costs_folder, grid, bounds=None):
+        with rasterio.open(os.path.join(gis_costs_folder, grid + '_final_cost.tif')) as cost:
+            window = raster_window(cost, bounds)
+            self.weights = cost.read(1, window=window)
+            self.meta = cost.meta.copy()
+            if window is not None:
+                self.meta.update(height=window.height, width=window.width, transform=cost.window_transform(window))
+
+        if self.weights.dtype.kind == 'f':
+            self.weights /= 20
+        else:
+            self.weights = self.weights / 20
+
+        with rasterio.open(os.path.join(gis_costs_folder, grid + '_power_cost.tif')) as power:
+            self.origins = np.where(power.read(1, window=window) == 0, 1, 0)
+
+        self.mv_distance = np.zeros(self.weights.shape)
+
+    def write(self, path, raster):
+        """Exports a raster of this grid as a GeoTIFF"""
+        with rasterio.open(path, 'w', **self.meta) as dst:
+            dst.write(raster, indexes=1)
+
+
 def find_grid_path(df, year, time_step, start_year, max_connections, max_capacity, gis_costs_folder, grid, mv_line_max_length,
-                   results_folder, full=True):
+                   results_folder, full=True, state=None, export_rasters=False):
+    """Extends a grid with the pathfinder towards the settlements that can connect to it
+
+    Arguments
+    ---------
+    state : GridRasterState, optional
+        Rasters of the grid from the previous year, updated in place. Required after the first year of the analysis
+    export_rasters : bool
+        Also write the origins and the cumulative extension distance of the year as GeoTIFF files
+    """
 
     name = 'extension_distance_' + '{}'.format(year)
     if name not in df.columns:
         df[name] = 99
 
-    final_cost_path = os.path.join(gis_costs_folder, grid + '_final_cost.tif')
+    if state is None:
+        if year - time_step != start_year:
+            raise ValueError('The raster state of the {} grid from {} is required'.format(grid, year - time_step))
+        state = GridRasterState(gis_costs_folder, grid)
 
-    if year - time_step == start_year:
-        power_lines_raster = os.path.join(gis_costs_folder, grid + '_power_cost.tif')
-    else:
-        power_lines_raster = os.path.join(results_folder, '{}_origins_{}.tif'.format(grid, year - time_step))
-
-    with rasterio.open(final_cost_path) as cost:
-        weights = cost.read(1) / 20
-        weights_meta = cost.meta
-
-    with rasterio.open(power_lines_raster) as power:
-        power_lines = power.read(1)
-        power_lines_meta = power.meta
+    weights = state.weights.copy()
+    weights_meta = state.meta
+    origins = state.origins.copy()
+    mv_distance = state.mv_distance.copy()
 
     shape = weights.shape
     affine = weights_meta['transform']
 
-    if year - time_step == start_year:
-        origins = np.where(power_lines == 0, 1, 0)
-    else:
-        origins = power_lines
-
-    targets = df.loc[(df['FinalElecCode' + '{}'.format(year - time_step)] != 1) & (df['MaxDist'] > 0) &
-                     (df['PlannedHVLineDist'] < mv_line_max_length) & (df['PreScreening' + "{}".format(year)] == 1)]
-
-    targets = targets.to_crs('EPSG:3395')
-
-    targets_for_raster = [(row.geometry, row.MaxDist) for _, row in targets.iterrows()]
-
-    targets_raster = rasterize(
-        targets_for_raster,
-        out_shape=shape,
-        fill=0,
-        default_value=0,
-        all_touched=True,
-        transform=affine,
-    )
-
-    a = np.where(targets_raster > 1, 1, 0)
-    #print(a.sum())
-
-    targets['new_connections'] = targets['NewConnections' + '{}'.format(year)] / targets['NumPeoplePerHH']
-
-    new_connections_for_raster = [(row.geometry, row.new_connections) for _, row in targets.iterrows()]
-
-    new_connections_raster = rasterize(
-        new_connections_for_raster,
-        out_shape=shape,
-        fill=0,
-        default_value=0,
-        all_touched=True,
-        transform=affine,
-    )
-
-    new_capacity_for_raster = [(row.geometry, row.GridCapacityRequired) for _, row in targets.iterrows()]
-
-    new_capacity_raster = rasterize(
-        new_capacity_for_raster,
-        out_shape=shape,
-        fill=0,
-        default_value=0,
-        all_touched=True,
-        transform=affine,
-    )
-
-    ids_for_raster = [(row.geometry, row.id) for _, row in targets.iterrows()]
-
-    id_raster = rasterize(
-        ids_for_raster,
-        out_shape=shape,
-        fill=0,
-        default_value=0,
-        all_touched=True,
-        transform=affine,
-    )
+    # Pixel of each settlement in the cost raster, computed once for all the targets of this grid and year
+    rows, cols = pixel_indices(df, affine, shape)
 
-    new_lines = np.zeros_like(origins)
+    targets = target_positions(df, year, time_step, mv_line_max_length, rows)
 
-    if year - time_step == start_year:
-        mv_distance = targets_raster * 0
-    else:
-        previous_distance = os.path.join(results_folder, '{}_extension_distance_{}.tif'.format(grid, year - time_step))
-        with rasterio.open(previous_distance) as prev_dist:
-            mv_distance = prev_dist.read(1)
-            mv_distance_meta = prev_dist.meta
+    # Row of each settlement id, for writing back the extension distances found by the pathfinder
+    id_index = pd.Index(df['id'].values)
+
+    new_connections = (df['NewConnections' + '{}'.format(year)] / df['NumPeoplePerHH']).values
+
+    targets_raster, new_connections_raster, new_capacity_raster, id_raster = burn_points(
+        rows[targets], cols[targets], shape,
+        [df['MaxDist'].values[targets], new_connections[targets], df['GridCapacityRequired'].values[targets],
+         df['id'].values[targets]])
+
+    new_lines = np.zeros_like(origins)
 
     mv_distance_new = targets_raster * 0
 
-    pathfinder = seek(origins, mv_distance, new_connections_raster, max_connections,
+    pathfinder = seek(interior(origins), mv_distance, new_connections_raster, max_connections,
                       new_capacity_raster, max_capacity, mv_distance_new,
-                      targets=targets_raster, weights=weights, path_handling='link', debug=False, film=False)
+                      targets=interior(targets_raster), weights=weights, path_handling='link', debug=False,
+                      film=False)
 
     origins = origins + pathfinder['paths']
     origins = np.where(origins > 1, 1, origins)
@@ -133,43 +271,20 @@ def find_grid_path(df, year, time_step, start_year, max_connections, max_capacit
     max_connections = pathfinder['new_connections_remaining']
     mv_distance_new = pathfinder['mv_distance_new']
 
-    distance = pathfinder['mv_distance_new']
-
-    a = np.extract(distance > 0, distance).tolist()
-
-    b = np.extract(distance > 0, id_raster).tolist()
-
-    ext_distances = pd.DataFrame()
-    ext_distances['id'] = b
-    ext_distances['distance'] = a
-
-    df = df.merge(ext_distances, on='id', how='left')
-
-    df['extension_distance_' + '{}'.format(year)] = np.where(df['distance'] > 0, df['distance'], df['extension_distance_' + '{}'.format(year)])
-    del df['distance']
+    scatter_distances(df, name, pathfinder['mv_distance_new'], id_raster, id_index)
 
     i = 0
     while pathfinder['paths'].sum() > 0:
-        targets = df.loc[(df['FinalElecCode' + '{}'.format(year - time_step)] != 1) & (df['MaxDist'] > 0) &
-                         (df['PlannedHVLineDist'] < mv_line_max_length) & (df['PreScreening' + "{}".format(year)] == 1)]
-        targets = targets.to_crs('EPSG:3395')
-        targets_for_raster = [(row.geometry, row.MaxDist) for _, row in targets.iterrows()]
-
-        targets_raster = rasterize(
-            targets_for_raster,
-            out_shape=shape,
-            fill=0,
-            default_value=0,
-            all_touched=True,
-            transform=affine,
-        )
-
-        targets_raster = targets_raster - targets_raster * origins
+        targets = target_positions(df, year, time_step, mv_line_max_length, rows)
+
+        targets_raster, = burn_points(rows[targets], cols[targets], shape, [df['MaxDist'].values[targets]])
+
+        targets_raster = interior(targets_raster - targets_raster * origins)
 
         a = np.where(targets_raster > 1, 1, 0)
         #print(a.sum())
 
-        pathfinder = seek(origins, mv_distance,
+        pathfinder = seek(interior(origins), mv_distance,
                           new_connections_raster, max_connections,
                           new_capacity_raster, max_capacity,
                           mv_distance_new,
@@ -185,31 +300,19 @@ def find_grid_path(df, year, time_step, start_year, max_connections, max_capacit
         max_connections = pathfinder['new_connections_remaining']
         mv_distance_new = pathfinder['mv_distance_new']
 
-        distance = pathfinder['mv_distance_new']
-
-        a = np.extract(distance > 0, distance).tolist()
-
-        b = np.extract(distance > 0, id_raster).tolist()
-
-        ext_distances = pd.DataFrame()
-        ext_distances['id'] = b
-        ext_distances['distance'] = a
-
-        df = df.merge(ext_distances, on='id', how='left')
-
-        df['extension_distance_' + '{}'.format(year)] = np.where(df['distance'] > 0, df['distance'], df['extension_distance_' + '{}'.format(year)])
-        del df['distance']
+        scatter_distances(df, name, pathfinder['mv_distance_new'], id_raster, id_index)
 
         i += 1
         if i > 4:
             break
 
-    new_origins = os.path.join(results_folder, '{}_origins_{}.tif'.format(grid, year))
+    state.origins = origins
+    state.mv_distance = mv_distance
+
     raster_grid_name = os.path.join(results_folder, '{}_grid_{}.tif'.format(grid, year))
-    total_ext_dist = os.path.join(results_folder, '{}_extension_distance_{}.tif'.format(grid, year))
 
-    with rasterio.open(raster_grid_name, 'w', **weights_meta) as dst:
-        dst.write(new_lines, indexes=1)
+    if full or export_rasters:
+        state.write(raster_grid_name, new_lines)
 
     if full:
         from gridfinder import thin, raster_to_lines
@@ -219,14 +322,8 @@ def find_grid_path(df, year, time_step, start_year, max_connections, max_capacit
             guess_gdf = raster_to_lines(raster_grid_name)
             guess_gdf.to_file(shapefile_grid_name, driver='GPKG')
 
-    if year - time_step != start_year:
-        os.remove(power_lines_raster)
-        os.remove(previous_distance)
-    else:
-        with rasterio.open(new_origins, 'w', **weights_meta) as dst:
-            dst.write(origins, indexes=1)
-
-        with rasterio.open(total_ext_dist, 'w', **weights_meta) as dst:
-            dst.write(pathfinder['mv_dist'], indexes=1)
+    if export_rasters:
+        state.write(os.path.join(results_folder, '{}_origins_{}.tif'.format(grid, year)), origins)
+        state.write(os.path.join(results_folder, '{}_extension_distance_{}.tif'.format(grid, year)), mv_distance)
 
     return df
@@ -58,6 +58,8 @@ def seek(
     Like Dijkstra's, Pathfinder assumes that all weights are 0 or greater.
     Negative weights are set to zero.  All input arrays (origins,
     targets, and weights) need to have the same number of rows and columns.
+    The search does not go beyond the cells on the edge of the grid, so
+    no origin or target may lie on the edge.
 
     @param origins, targets: 2D numpy array of ints
         Any non-zero values are the locations of origin and target points,
@@ -115,6 +117,9 @@ def seek(
         targets = np.zeros(origins.shape, dtype=np.int8)
     assert targets.shape == origins.shape
     assert targets.shape == weights.shape
+    for name, points in [('Origins', origins), ('Targets', targets)]:
+        if np.any(points[[0, -1], :]) or np.any(points[:, [0, -1]]):
+            raise ValueError('{} must not lie on the edge of the grid'.format(name))
     path_handling = path_handling.lower()
     assert path_handling in ['none', 'n', 'assimilate', 'a', 'link', 'l']
     n_rows, n_cols = origins.shape
@@ -125,12 +130,9 @@ def seek(
     if path_handling[0] == 'l':
         path_handling = 2
 
-    iteration = 0
     not_visited = 9999999999.
 
     if film:
-        frame_rate = int(1e6)
-        frame_counter = 100000
         frame_dirname = 'frames'
         try:
             os.mkdir(frame_dirname)
@@ -153,7 +155,6 @@ def seek(
     target_locations = np.where(targets)
     n_targets = target_locations[0].size
     n_targets_remaining = n_targets
-    n_targets_remaining_update = n_targets
     for i_target, row in enumerate(target_locations[0]):
         col = target_locations[1][i_target]
         wid = 8
@@ -173,11 +174,125 @@ def seek(
     # from targets to their nearest origin point.
     paths = np.zeros((n_rows, n_cols), dtype=np.int8)
 
+    # Scratch space for tracing paths back from the targets, see nb_trace_back.
+    path_stamp = np.zeros((n_rows, n_cols), dtype=np.int64)
+    path_buffer = path_buffer_for(n_rows * n_cols)
+
     # The halo is the set of points under evaluation. They surround
     # the origin points and expand outward, forming a growing halo
     # around the set of origins that eventually envelops targets.
     # It is implemented using a heap queue, so that the halo point
     # nearest to an origin is always the next one that gets evaluated.
+    # Points at the same distance are evaluated in row, then column order.
+    if not debug and not film:
+        # The whole search, heap included, runs compiled. The heap holds the
+        # flat index row * n_cols + col of each point. The origins all have
+        # a distance of zero and come in increasing flat index order, so
+        # they already form a valid heap.
+        n_halo = origin_locations[0].size
+        halo_distance = np.zeros(max(n_halo, 1024))
+        halo_index = np.zeros(halo_distance.size, dtype=np.int64)
+        halo_index[:n_halo] = origin_locations[0] * n_cols + origin_locations[1]
+        max_connections, max_capacity = nb_seek(
+            halo_distance,
+            halo_index,
+            n_halo,
+            distance,
+            n_cols,
+            n_rows,
+            n_targets_remaining,
+            new_locations_buffer(n_rows * n_cols),
+            not_visited,
+            origins,
+            path_handling,
+            paths,
+            targets,
+            weights,
+            mv_distance,
+            new_connections,
+            new_capacity,
+            max_connections,
+            max_capacity,
+            mv_distance_new,
+            path_stamp,
+            path_buffer,
+        )
+    else:
+        max_connections, max_capacity = _seek_python(
+            distance,
+            film,
+            debug,
+            n_cols,
+            n_rows,
+            n_targets,
+            not_visited,
+            origin_locations,
+            origins,
+            path_handling,
+            paths,
+            rendering,
+            targets,
+            weights,
+            mv_distance,
+            new_connections,
+            new_capacity,
+            max_connections,
+            max_capacity,
+            mv_distance_new,
+            path_stamp,
+            path_buffer,
+        )
+
+    if debug:
+        print('\r                                                 ', end='')
+        sys.stdout.flush()
+        print('')
+    # Add the newfound paths to the visualization.
+    rendering = 1. / (1. + distance / 10.)
+    rendering[np.where(origins)] = 1.
+    rendering[np.where(paths)] = .8
+    results = {'paths': paths, 'distance': distance, 'rendering': rendering, 'mv_dist': mv_distance, 'weights': weights,
+               'new_connections_remaining': max_connections, 'new_capacity_remaining': max_capacity,
+               'mv_distance_new': mv_distance_new}
+    return results
+
+
+def _seek_python(
+    distance,
+    film,
+    debug,
+    n_cols,
+    n_rows,
+    n_targets,
+    not_visited,
+    origin_locations,
+    origins,
+    path_handling,
+    paths,
+    rendering,
+    targets,
+    weights,
+    mv_distance,
+    new_connections,
+    new_capacity,
+    max_connections,
+    max_capacity,
+    mv_distance_new,
+    path_stamp,
+    path_buffer,
+):
+    """
+    The search loop of seek() driven from Python, used to report progress
+    and to save snapshots of the algorithm's progress.
+    """
+    iteration = 0
+    n_targets_remaining = n_targets
+    n_targets_remaining_update = n_targets
+    if film:
+        frame_rate = int(1e6)
+        frame_counter = 100000
+        frame_dirname = 'frames'
+
     halo = []
     for i, origin_row in enumerate(origin_locations[0]):
         origin_col = origin_locations[1][i]
@@ -185,7 +300,7 @@ def seek(
 
     # The temporary array for tracking locations to add to the halo.
     # This gets overwritten with each iteration.
-    new_locs = np.zeros((int(1e6), 3))
+    new_locs = new_locations_buffer(n_rows * n_cols)
     n_new_locs = 0
 
     test_time = 0
@@ -245,23 +360,185 @@ def seek(
             max_connections,
             max_capacity,
             mv_distance_new,
+            path_stamp,
+            path_buffer,
         )
         for i_loc in range(n_new_locs):
             loc = (int(new_locs[i_loc, 1]), int(new_locs[i_loc, 2]))
             heapq.heappush(halo, (new_locs[i_loc, 0], loc))
 
-    if debug:
-        print('\r                                                 ', end='')
-        sys.stdout.flush()
-        print('')
-    # Add the newfound paths to the visualization.
-    rendering = 1. / (1. + distance / 10.)
-    rendering[np.where(origins)] = 1.
-    rendering[np.where(paths)] = .8
-    results = {'paths': paths, 'distance': distance, 'rendering': rendering, 'mv_dist': mv_distance, 'weights': weights,
-               'new_connections_remaining': max_connections, 'new_capacity_remaining': max_capacity,
-               'mv_distance_new': mv_distance_new}
-    return results
+    return max_connections, max_capacity
+
+
+# The temporary array for tracking locations to add to the halo, kept
+# between calls of seek() and only reallocated when a larger one is needed.
+_new_locs = np.zeros((0, 3))
+
+
+def new_locations_buffer(n_cells):
+    """
+    Return the array for tracking locations to add to the halo. It holds
+    up to 1e6 locations, or all the cells of the grid if there are fewer.
+    """
+    global _new_locs
+    size = min(int(1e6), n_cells + 8)
+    if _new_locs.shape[0] < size:
+        _new_locs = np.zeros((size, 3))
+    return _new_locs
+
+
+# The buffer holding the path being traced back, kept between calls of
+# seek() like the new locations buffer.
+_path_buffer = np.zeros((0, 2), dtype=np.int64)
+
+
+def path_buffer_for(n_cells):
+    """
+    Return the array for the (row, col) cells of a path being traced back.
+    Paths are added to the new locations, so it has the same size.
+    """
+    global _path_buffer
+    size = min(int(1e6), n_cells + 8)
+    if _path_buffer.shape[0] < size:
+        _path_buffer = np.zeros((size, 2), dtype=np.int64)
+    return _path_buffer
+
+
+@jit(nopython=True)
+def nb_heap_less(halo_distance, halo_index, i, j):
+    """
+    Order of the halo heap: by distance, then by flat index.
+    """
+    return (halo_distance[i] < halo_distance[j] or
+            (halo_distance[i] == halo_distance[j] and halo_index[i] < halo_index[j]))
+
+
+@jit(nopython=True)
+def nb_heap_swap(halo_distance, halo_index, i, j):
+    halo_distance[i], halo_distance[j] = halo_distance[j], halo_distance[i]
+    halo_index[i], halo_index[j] = halo_index[j], halo_index[i]
+
+
+@jit(nopython=True)
+def nb_heap_push(halo_distance, halo_index, n_halo, distance_here, index_here):
+    """
+    Add a point to the halo heap, which must have room for it.
+    Return the new number of points in the heap.
+    """
+    i = n_halo
+    halo_distance[i] = distance_here
+    halo_index[i] = index_here
+    while i > 0:
+        parent = (i - 1) // 2
+        if nb_heap_less(halo_distance, halo_index, i, parent):
+            nb_heap_swap(halo_distance, halo_index, i, parent)
+            i = parent
+        else:
+            break
+    return n_halo + 1
+
+
+@jit(nopython=True)
+def nb_heap_pop(halo_distance, halo_index, n_halo):
+    """
+    Remove the nearest point from the halo heap.
+    Return its distance, its flat index and the new number of points in the heap.
+    """
+    distance_here = halo_distance[0]
+    index_here = halo_index[0]
+    n_halo -= 1
+    halo_distance[0] = halo_distance[n_halo]
+    halo_index[0] = halo_index[n_halo]
+    i = 0
+    while True:
+        left = 2 * i + 1
+        if left >= n_halo:
+            break
+        smallest = left
+        right = left + 1
+        if right < n_halo and nb_heap_less(halo_distance, halo_index, right, left):
+            smallest = right
+        if nb_heap_less(halo_distance, halo_index, smallest, i):
+            nb_heap_swap(halo_distance, halo_index, i, smallest)
+            i = smallest
+        else:
+            break
+    return distance_here, index_here, n_halo
+
+
+@jit(nopython=True)
+def nb_seek(
+    halo_distance,
+    halo_index,
+    n_halo,
+    distance,
+    n_cols,
+    n_rows,
+    n_targets_remaining,
+    new_locs,
+    not_visited,
+    origins,
+    path_handling,
+    paths,
+    targets,
+    weights,
+    mv_distance,
+    new_connections,
+    new_capacity,
+    max_connections,
+    max_capacity,
+    mv_distance_new,
+    path_stamp,
+    path_buffer,
+):
+    """
+    The search loop of seek(), compiled together with its heap.
+    As in the Python loop without debug output, the search goes on until the
+    halo is empty or a limit is reached, and the number of targets
+    remaining is only checked before starting.
+    """
+    while n_targets_remaining > 0 and n_halo > 0 and max_connections > 0 and max_capacity > 0:
+        distance_here, index_here, n_halo = nb_heap_pop(halo_distance, halo_index, n_halo)
+        row_here = index_here // n_cols
+        col_here = index_here % n_cols
+        n_new_locs, n_targets_remaining_update, max_connections, max_capacity = nb_loop(
+            col_here,
+            distance,
+            distance_here,
+            n_cols,
+            0,
+            n_rows,
+            n_targets_remaining,
+            new_locs,
+            not_visited,
+            origins,
+            path_handling,
+            paths,
+            row_here,
+            targets,
+            weights,
+            mv_distance,
+            new_connections,
+            new_capacity,
+            max_connections,
+            max_capacity,
+            mv_distance_new,
+            path_stamp,
+            path_buffer,
+        )
+        if n_halo + n_new_locs > halo_distance.size:
+            size = max(2 * halo_distance.size, n_halo + n_new_locs)
+            grown_distance = np.zeros(size)
+            grown_distance[:n_halo] = halo_distance[:n_halo]
+            grown_index = np.zeros(size, dtype=np.int64)
+            grown_index[:n_halo] = halo_index[:n_halo]
+            halo_distance = grown_distance
+            halo_index = grown_index
+        for i_loc in range(n_new_locs):
+            n_halo = nb_heap_push(halo_distance, halo_index, n_halo, new_locs[i_loc, 0],
+                                  int(new_locs[i_loc, 1]) * n_cols + int(new_locs[i_loc, 2]))
+
+    return max_connections, max_capacity
 
 
 def render(
@@ -310,18 +587,29 @@ def nb_trace_back(
     targets,
     mv_distance,
     mv_distance_new,
+    path_stamp,
+    path_buffer,
 ):
     """
     Connect each found electrified target to the grid through
     the shortest available path.
+
+    The path is written as (row, col) pairs into path_buffer. The cells
+    on the path are marked in path_stamp with the flat index of the target
+    plus one, which is unique within a search, so that checking whether
+    a cell is already on the path takes constant time.
     """
     # Handle the case where you find more than one target.
-    path = []
+    stamp = target[0] * distance.shape[1] + target[1] + 1
+    path_length = 0
     distance_remaining = distance[target]
     current_location = target
     a = 0
     while distance_remaining > 0.:
-        path.append(current_location)
+        path_buffer[path_length, 0] = current_location[0]
+        path_buffer[path_length, 1] = current_location[1]
+        path_length += 1
+        path_stamp[current_location] = stamp
         (row_here, col_here) = current_location
         # Check each of the neighbors for the lowest distance to grid.
         neighbors = [
@@ -343,7 +631,7 @@ def nb_trace_back(
         # the neighbor position to the grid. It is distance[neighbor]
         # plus the distance to the neighbor from the current position.
         for (neighbor, scale) in neighbors:
-            if neighbor not in path:
+            if path_stamp[neighbor] != stamp:
                 distance_from_neighbor = scale * weights[current_location]
                 neighbor_distance = (distance[neighbor] +
                                      distance_from_neighbor)
@@ -351,7 +639,7 @@ def nb_trace_back(
                     lowest_distance = neighbor_distance
                     best_neighbor = neighbor
 
-        if len(path) == 1:
+        if path_length == 1:
             last_dist = lowest_distance
 
         # This will fail if caught in a local minimum.
@@ -369,24 +657,25 @@ def nb_trace_back(
 
         # if distance_remaining > targets[target]:
         #     distance_remaining == 0
-    if len(path) == 1:
+    if path_length == 1:
         total_ext_dist = (mv_distance[best_neighbor] + lowest_distance)
     else:
-        total_ext_dist = mv_distance[best_neighbor] + distance[path[1]] + lowest_distance
+        total_ext_dist = mv_distance[best_neighbor] + distance[path_buffer[1, 0], path_buffer[1, 1]] + lowest_distance
 
     if (a == 1) or (total_ext_dist > 50):
         pass
     else:
         total_mv_line_dist = 0
 
-        for i_loc, loc in enumerate(path):
+        for i_loc in range(path_length):
+            loc = (path_buffer[i_loc, 0], path_buffer[i_loc, 1])
             if i_loc == 0:
                 total_mv_line_dist += mv_distance[loc]
                 mv_distance[loc] = total_ext_dist
-                if len(path) == 1:
+                if path_length == 1:
                     mv_distance_new[loc] = lowest_distance
                 else:
-                    mv_distance_new[loc] = distance[path[1]] + lowest_distance
+                    mv_distance_new[loc] = distance[path_buffer[1, 0], path_buffer[1, 1]] + lowest_distance
 
             else:
                 total_mv_line_dist += distance[best_neighbor]
@@ -408,13 +697,14 @@ def nb_trace_back(
         ]
 
         for (neighbor, scale) in neighbors:
-            if neighbor not in path:
+            if path_stamp[neighbor] != stamp:
                 weights[neighbor] += 0.1 * mv_distance[loc] / 0.05
 
         ### End of additional weights
 
         # Add this new path.
-        for i_loc, loc in enumerate(path):
+        for i_loc in range(path_length):
+            loc = (path_buffer[i_loc, 0], path_buffer[i_loc, 1])
             if distance[best_neighbor] > 0:
                 pass
             paths[loc] = 1
@@ -458,6 +748,8 @@ def nb_loop(
     max_connections,
     max_capacity,
     mv_distance_new,
+    path_stamp,
+    path_buffer,
 ):
     """
     This is the meat of the computation.
@@ -494,7 +786,9 @@ def nb_loop(
                     weights,
                     targets,
                     mv_distance,
-                    mv_distance_new
+                    mv_distance_new,
+                    path_stamp,
+                    path_buffer,
                 )
                 targets[neighbor] = 0
                 n_targets_remaining -= 1
@@ -1,7 +1,12 @@
 # Defines the modules
 
 import logging
+import copy
+import multiprocessing
+import multiprocessing.connection
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
 import pandas as pd
@@ -18,6 +23,7 @@ try:
                               SPE_NUM_PEOPLE_PER_HH_URBAN, SPE_POP, SPE_POP_FUTURE,
                               SPE_START_YEAR, SPE_URBAN, SPE_URBAN_FUTURE,
                               SPE_URBAN_MODELLED)
+    from onsset.instrumentation import StageTrace
 except ImportError:
     from specs import (SPE_COUNTRY, SPE_ELEC, SPE_ELEC_MODELLED,
                        SPE_ELEC_RURAL, SPE_ELEC_URBAN, SPE_END_YEAR,
@@ -27,9 +33,10 @@ except ImportError:
                        SPE_NUM_PEOPLE_PER_HH_URBAN, SPE_POP, SPE_POP_FUTURE,
                        SPE_START_YEAR, SPE_URBAN, SPE_URBAN_FUTURE,
                        SPE_URBAN_MODELLED)
+    from instrumentation import StageTrace
 from openpyxl import load_workbook
 
-logging.basicConfig(format='%(asctime)s\t\t%(message)s', level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 
 def calibration(specs_path, csv_path, specs_path_calib, calibrated_csv_path):
@@ -41,6 +48,8 @@ def calibration(specs_path, csv_path, specs_path_calib, calibrated_csv_path):
     csv_path
     specs_path_calib
     calibrated_csv_path
+        The calibrated settlements are written as Parquet or Feather if the path has one of their extensions
+        (see SettlementProcessor.read_settlements), otherwise as csv
     """
     specs_data = pd.read_excel(specs_path, sheet_name='SpecsData')
     settlements_in_csv = csv_path
@@ -92,380 +101,642 @@ def calibration(specs_path, csv_path, specs_path_calib, calibrated_csv_path):
     writer.save()
     writer.close()
 
-    logging.info('Calibration finished. Results are transferred to the csv file')
-    onsseter.df.to_csv(settlements_out_csv, index=False)
+    logger.info('Calibration finished. Results are transferred to the csv file')
+    SettlementProcessor.write_settlements(onsseter.df, settlements_out_csv)
 
 
 def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, gis_cost_folder, save_shapefiles,
-             gis_grid_extension, short_results):
+             gis_grid_extension, short_results, compact=False, columns=None, workers=1, extension_mode='rounds',
+             windowed_rasters=False, grid_workers=1, trace_format='csv'):
     """
 
     Arguments
     ---------
     specs_path : str
     calibrated_csv_path : str
+        Calibrated settlements, in csv, Parquet or Feather format. The full and short results are written in the
+        same format
     results_folder : str
     summary_folder : str
+    compact : bool
+        Keep the settlements in the compact (float32/int8) store, see SettlementProcessor
+    columns : list, optional
+        Only load these columns of the calibrated settlements, all by default
+    workers : int
+        Number of processes running the scenarios in parallel. Where processes can be forked (Linux, macOS), each
+        scenario runs in a process forked from this one, which shares the calibrated settlements loaded here
+        copy-on-write: they are neither pickled nor copied, and each process only adds the columns and pages its
+        scenario writes, see _fork_map. Elsewhere, the calibrated settlements are written once to an uncompressed
+        Feather file that each worker reads when it starts, and each worker holds its own copy of them and the
+        working copy of the scenario it runs
+    extension_mode : str
+        'rounds' to extend the grid in rounds from the newly electrified settlements, or 'heap' for a single
+        priority-queue pass, see SettlementProcessor.elec_extension
+    windowed_rasters : bool
+        Only load the part of the cost rasters around the settlements of each grid. This is an approximation, as
+        the pathfinder cannot find the paths that leave that part, see onsset_gis.grid_bounds
+    grid_workers : int
+        Number of processes running the pathfinder grid extension of the regional grids at the same time. Each grid
+        only sees its own settlements, with any number of processes, see extend_grids_gis
+    trace_format : str
+        Format ('csv' or 'json') of the timing and memory trace of the stages written next to the results of each
+        scenario, see run_scenario. None to not write the trace
 
     """
 
-    if gis_grid_extension:
-        import onsset_gis
-
     scenario_info = pd.read_excel(specs_path, sheet_name='ScenarioInfo')
     scenarios = scenario_info['Scenario']
     scenario_parameters = pd.read_excel(specs_path, sheet_name='ScenarioParameters')
     specs_data = pd.read_excel(specs_path, sheet_name='SpecsDataCalib')
     print(specs_data.loc[0, SPE_COUNTRY])
 
-    for scenario in scenarios:
-        print('Scenario: ' + str(scenario + 1))
-        country_id = specs_data.iloc[0]['CountryCode']
-
-        # Population lever
-        pop_index = scenario_info.iloc[scenario]['PopIndex']
-        pop_future = scenario_parameters.iloc[pop_index]['Population2030']
-        urban_future = scenario_parameters.iloc[pop_index]['UrbanRatio2030']
-
-        # Electrification rate target lever
-        electification_rate_index = scenario_info.iloc[scenario]['ElecRateIndex']
-        electrification_rate_2030 = scenario_parameters.iloc[electification_rate_index]['ElecRate2030']
-        electrification_rate_2025 = scenario_parameters.iloc[electification_rate_index]['ElecRate2025']
-
-        #  Household demand lever
-        household_dem_index = scenario_info.iloc[scenario]['ResidentialDemand']
-        rural_tier = int(scenario_parameters.iloc[household_dem_index]['RuralTargetTier'])
-        urban_tier = int(scenario_parameters.iloc[household_dem_index]['UrbanTargetTier'])
-
-        # Social and productive demand lever (Health and education)
-        social_productive_dem_index = scenario_info.iloc[scenario]['SocialProductiveDem']
-        social_productive_demand = scenario_parameters.iloc[social_productive_dem_index]['SocialProductiveDemand']
-
-        # Industrial demand lever
-        ind_dem_index = scenario_info.iloc[scenario]['IndustrialDem']
-        industrial_demand = scenario_parameters.iloc[ind_dem_index]['IndustrialDemand']
-
-        # PV system cost
-        pv_index = scenario_info.iloc[scenario]['PVIndex']
-        pv_capital_cost_adjust = float(scenario_parameters.iloc[pv_index]['PV_Cost_adjust'])
-
-        #  Discount rate lever
-        disscount_index = scenario_info.iloc[scenario]['DiscountIndex']
-        disc_rate = scenario_parameters.iloc[disscount_index]['DiscRate']
-
-        # Make sure the levers here match the order you prefer
-        scenario_name = '{}_{}_{}_{}_{}_{}'.format(pop_index, electification_rate_index, household_dem_index,
-                                                   social_productive_dem_index, ind_dem_index, pv_index)
-
-        out_folder = results_folder + '/' + scenario_name + '/'
-
-        try:
-            os.mkdir(out_folder)
-        except FileExistsError:
-            pass
-
-        settlements_in_csv = calibrated_csv_path
-        onsseter = SettlementProcessor(settlements_in_csv)
-
-        onsseter.df['HealthDemand'] = 0
-        onsseter.df['EducationDemand'] = 0
-        onsseter.df['AgriDemand'] = 0
-        onsseter.df['CommercialDemand'] = 0
-        onsseter.df['HeavyIndustryDemand'] = 0
-
-        if social_productive_demand == 1:
-            onsseter.df['HealthDemand'] = onsseter.df['health_dem_low']
-            onsseter.df['EducationDemand'] = onsseter.df['edu_dem_low']
-            onsseter.df['AgriDemand'] = onsseter.df['agri_dem_low']
-            onsseter.df['CommercialDemand'] = onsseter.df['prod_dem_low']
-        elif social_productive_demand == 2:
-            onsseter.df['HealthDemand'] = onsseter.df['health_dem_mid']
-            onsseter.df['EducationDemand'] = onsseter.df['edu_dem_mid']
-            onsseter.df['AgriDemand'] = onsseter.df['agri_dem_mid']
-            onsseter.df['CommercialDemand'] = onsseter.df['prod_dem_mid']
-        elif social_productive_demand == 3:
-            onsseter.df['HealthDemand'] = onsseter.df['health_dem_high']
-            onsseter.df['EducationDemand'] = onsseter.df['edu_dem_high']
-            onsseter.df['AgriDemand'] = onsseter.df['agri_dem_high']
-            onsseter.df['CommercialDemand'] = onsseter.df['prod_dem_high']
-
-        if industrial_demand == 1:
-            onsseter.df['HeavyIndustryDemand'] = onsseter.df['ind_dem_low']
-        elif industrial_demand == 2:
-                onsseter.df['HeavyIndustryDemand'] = onsseter.df['ind_dem_mid']
-        elif industrial_demand == 3:
-                onsseter.df['HeavyIndustryDemand'] = onsseter.df['ind_dem_high']
-
-        if rural_tier == 6:
-            onsseter.df['ResidentialDemandTierCustom'] = onsseter.df['hh_dem_low']
-        elif rural_tier == 7:
-            onsseter.df['ResidentialDemandTierCustom'] = onsseter.df['hh_dem_mid']
-        elif rural_tier == 8:
-            onsseter.df['ResidentialDemandTierCustom'] = onsseter.df['hh_dem_high']
-
-        onsseter.df.drop(['hh_dem_low', 'hh_dem_mid', 'hh_dem_high', 'health_dem_low', 'health_dem_mid',
-                          'health_dem_high', 'edu_dem_low', 'edu_dem_mid', 'edu_dem_high', 'agri_dem_low',
-                          'agri_dem_mid', 'agri_dem_high', 'prod_dem_low', 'prod_dem_mid', 'prod_dem_high',
-                          'ind_dem_low', 'ind_dem_mid', 'ind_dem_high'], axis=1, inplace=True)
-
-        start_year = specs_data.iloc[0][SPE_START_YEAR]
-        intermediate_year = specs_data.iloc[0]['Intermediate_year']
-        end_year = specs_data.iloc[0][SPE_END_YEAR]
-
-        num_people_per_hh_rural = float(specs_data.iloc[0][SPE_NUM_PEOPLE_PER_HH_RURAL])
-        num_people_per_hh_urban = float(specs_data.iloc[0][SPE_NUM_PEOPLE_PER_HH_URBAN])
-
-        # RUN_PARAM: Fill in general and technology specific parameters (e.g. discount rate, losses etc.)
-        max_grid_extension_dist = 50
-
-        intermediate_electrification_target = electrification_rate_2025
-        end_year_electrification_rate_target = electrification_rate_2030
-
-        # West grid specifications
-        auto_intensification_ouest = 0
-        annual_new_grid_connections_limit_ouest = {intermediate_year: 999999999,
-                                                   end_year: 999999999}
-        annual_grid_cap_gen_limit_ouest = {intermediate_year: 999999999,
-                                           end_year: 999999999}
-
-        grid_generation_cost_ouest = 0.07
-        grid_power_plants_capital_cost_ouest = 2000
-        grid_losses_ouest = 0.08
-
-        # South grid specifications
-        auto_intensification_sud = 0
-        annual_new_grid_connections_limit_sud = {intermediate_year: 999999999,
-                                                 end_year: 999999999}
-        annual_grid_cap_gen_limit_sud = {intermediate_year: 999999999,
-                                         end_year: 999999999}
-
-        grid_generation_cost_sud = 0.07
-        grid_power_plants_capital_cost_sud = 2000
-        grid_losses_sud = 0.08
-
-        # East grid specifications
-        auto_intensification_est = 0
-        annual_new_grid_connections_limit_est = {intermediate_year: 999999999,
-                                                 end_year: 999999999}
-        annual_grid_cap_gen_limit_est = {intermediate_year: 999999999,
-                                         end_year: 999999999}
-        grid_generation_cost_est = 0.07
-        grid_power_plants_capital_cost_est = 2000
-        grid_losses_est = 0.08
-
-
-        Technology.set_default_values(base_year=start_year,
-                                      start_year=start_year,
-                                      end_year=end_year,
-                                      discount_rate=disc_rate)
-
-        grid_calc_ouest = Technology(om_of_td_lines=0.1,
-                                     distribution_losses=grid_losses_ouest,
-                                     connection_cost_per_hh=150,
-                                     base_to_peak_load_ratio=0.8,
-                                     capacity_factor=1,
-                                     tech_life=30,
-                                     grid_capacity_investment=grid_power_plants_capital_cost_ouest,
-                                     grid_price=grid_generation_cost_ouest)
-
-        grid_calc_sud = Technology(om_of_td_lines=0.1,
-                                   distribution_losses=grid_losses_sud,
-                                   connection_cost_per_hh=150,
-                                   base_to_peak_load_ratio=0.8,
-                                   capacity_factor=1,
-                                   tech_life=30,
-                                   grid_capacity_investment=grid_power_plants_capital_cost_sud,
-                                   grid_price=grid_generation_cost_sud)
-
-        grid_calc_est = Technology(om_of_td_lines=0.1,
-                                   distribution_losses=grid_losses_est,
-                                   connection_cost_per_hh=150,
-                                   base_to_peak_load_ratio=0.8,
-                                   capacity_factor=1,
-                                   tech_life=30,
-                                   grid_capacity_investment=grid_power_plants_capital_cost_est,
-                                   grid_price=grid_generation_cost_est)
-
-        mg_hydro_calc = Technology(om_of_td_lines=0.02,
-                                   distribution_losses=0.05,
-                                   connection_cost_per_hh=92,
-                                   base_to_peak_load_ratio=0.85,
-                                   capacity_factor=0.5,
-                                   tech_life=35,
-                                   capital_cost={float("inf"): 5000},
-                                   om_costs=0.03,
-                                   mini_grid=True)
-
-        mg_wind_calc = Technology(om_of_td_lines=0.02,
-                                  distribution_losses=0.05,
-                                  connection_cost_per_hh=92,
-                                  base_to_peak_load_ratio=0.85,
-                                  capital_cost={float("inf"): 3750},
-                                  om_costs=0.02,
-                                  tech_life=20,
-                                  mini_grid=True)
-
-        mg_pv_calc = Technology(om_of_td_lines=0.02,
+    # The scenarios write their results to files named after them, which must not be shared
+    scenario_names = [get_scenario_name(scenario_info, scenario) for scenario in scenarios]
+    duplicates = sorted({name for name in scenario_names if scenario_names.count(name) > 1})
+    if duplicates:
+        raise ValueError('Several scenarios have the name {}, they must differ in a lever other than '
+                         'DiscountIndex'.format(', '.join(duplicates)))
+
+    # The calibrated settlements are loaded once, each scenario works on its own copy or forked process
+    calibrated_settlements = SettlementProcessor(calibrated_csv_path, compact=compact, columns=columns)
+
+    # The full and short results are written in the format of the calibrated settlements
+    results_extension = os.path.splitext(calibrated_csv_path)[1]
+    scenario_arguments = (scenario_info, scenario_parameters, specs_data, results_folder, summary_folder,
+                          gis_cost_folder, save_shapefiles, gis_grid_extension, short_results, results_extension,
+                          compact, extension_mode, windowed_rasters, grid_workers, trace_format)
+
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        summaries = _fork_map(run_scenario, [(calibrated_settlements, scenario) + scenario_arguments
+                                             for scenario in scenarios], workers)
+    elif workers > 1:
+        with tempfile.TemporaryDirectory() as shared_folder:
+            shared_path = os.path.join(shared_folder, 'calibrated.feather')
+            calibrated_settlements.df.reset_index(drop=True).to_feather(shared_path, compression='uncompressed')
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_scenario_worker,
+                                     initargs=(shared_path, compact)) as executor:
+                futures = [executor.submit(_run_scenario_worker, scenario, *scenario_arguments)
+                           for scenario in scenarios]
+                summaries = [future.result() for future in futures]
+    else:
+        summaries = [run_scenario(calibrated_settlements.copy(), scenario, *scenario_arguments)
+                     for scenario in scenarios]
+
+    # The summaries of all scenarios are merged in the order of the ScenarioInfo sheet
+    country_id = specs_data.iloc[0]['CountryCode']
+    sweep_summary = pd.concat([summary_table for _, summary_table in summaries],
+                              keys=[scenario_name for scenario_name, _ in summaries], names=['Scenario', 'Region'])
+    sweep_summary.to_csv(os.path.join(summary_folder, '{}_summaries.csv'.format(country_id)), index=True)
+
+
+def _fork_map(function, tasks, processes):
+    """Calls function(*task) for each task in its own forked process, with at most the given number of processes at a
+    time
+
+    The processes start with the memory of this process, shared copy-on-write: the arguments of the tasks are not
+    pickled, and a process only copies the pages its task writes to. As each process ends with its task, the next
+    task starts again from the arguments as they are in this process.
+
+    Returns
+    -------
+    list
+        The return values of the tasks, in the order of the tasks. The first exception raised by a task is raised
+        again here, after the other processes are stopped
+    """
+    context = multiprocessing.get_context('fork')
+    results = [None] * len(tasks)
+    pending = list(enumerate(tasks))
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < processes:
+                index, task = pending.pop(0)
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=_run_forked_task, args=(sender, function, task))
+                process.start()
+                sender.close()
+                running[receiver] = index, process
+            for receiver in multiprocessing.connection.wait(list(running)):
+                index, process = running.pop(receiver)
+                try:
+                    failed, results[index] = receiver.recv()
+                except EOFError:
+                    failed = True
+                receiver.close()
+                process.join()
+                if failed:
+                    if not isinstance(results[index], BaseException):
+                        results[index] = RuntimeError('The process of task {} ended with exit code {}'
+                                                      .format(index, process.exitcode))
+                    raise results[index]
+    finally:
+        for receiver, (_, process) in running.items():
+            process.terminate()
+            process.join()
+            receiver.close()
+    return results
+
+
+def _run_forked_task(sender, function, task):
+    try:
+        result = False, function(*task)
+    except BaseException as error:
+        logger.exception('Task failed')
+        result = True, error
+    sender.send(result)
+    sender.close()
+
+
+# Calibrated settlements of a scenario worker process where processes cannot be forked, read once per process by
+# _init_scenario_worker. Each scenario works on a copy of them
+_worker_settlements = None
+
+
+def _init_scenario_worker(shared_path, compact):
+    global _worker_settlements
+    _worker_settlements = SettlementProcessor(shared_path, compact=compact)
+
+
+def _run_scenario_worker(scenario, *scenario_arguments):
+    return run_scenario(_worker_settlements.copy(), scenario, *scenario_arguments)
+
+
+def extend_grids_gis(onsseter, grid_tasks, year, time_step, start_year, end_year, gis_cost_folder,
+                     max_grid_extension_dist, out_folder, save_shapefiles, raster_states, grid_workers):
+    """Runs the pathfinder grid extension of the grids, at the same time in one process per grid if grid_workers > 1
+
+    Each grid only works on the settlements whose closest grid it is, so that the grids do not see each other's
+    settlements and the results do not depend on the number of processes. Their results are written back into the
+    settlements and the raster states of the grids are updated.
+
+    Arguments
+    ---------
+    onsseter : SettlementProcessor
+    grid_tasks : list
+        (grid, grid_calc, grid_connect_limit, grid_cap_gen_limit) of each grid
+    raster_states : dict
+        onsset_gis.GridRasterState of each grid
+    grid_workers : int
+        Number of processes, the grids are extended one after the other in this process if 1
+
+    Returns
+    -------
+    numpy.ndarray
+        Grid investment of each settlement, summed over the grids
+    """
+    if year - time_step == start_year:
+        onsseter.df[SET_ELEC_ORDER + "{}".format(year)] = onsseter.df[SET_ELEC_ORDER]
+    else:
+        onsseter.df[SET_ELEC_ORDER + "{}".format(year)] = onsseter.df[SET_ELEC_ORDER + "{}".format(year - time_step)]
+    onsseter.df[SET_MIN_GRID_DIST + "{}".format(year)] = onsseter.df[SET_MV_CONNECT_DIST]
+
+    def tasks():
+        for grid, grid_calc, grid_connect_limit, grid_cap_gen_limit in grid_tasks:
+            print('Running pathfinder for ' + grid + ' grid')
+            grid_settlements = copy.copy(onsseter)
+            grid_settlements.df = onsseter.df.loc[onsseter.df['ClosestGrid'] == grid].reset_index(drop=True)
+            yield (grid_settlements, grid, grid_calc, year, time_step, start_year, end_year, grid_connect_limit,
+                   grid_cap_gen_limit, gis_cost_folder, max_grid_extension_dist, out_folder, save_shapefiles,
+                   raster_states[grid])
+
+    grid_investment = np.zeros(len(onsseter.df))
+    if grid_workers > 1:
+        with ProcessPoolExecutor(max_workers=grid_workers) as executor:
+            futures = [executor.submit(_extend_grid_gis, *task) for task in tasks()]
+            outputs = [future.result() for future in futures]
+    else:
+        outputs = [_extend_grid_gis(*task) for task in tasks()]
+
+    for (grid, _, _, _), (results, investment, raster_states[grid]) in zip(grid_tasks, outputs):
+        in_grid = (onsseter.df['ClosestGrid'] == grid).values
+        for column in results.columns:
+            onsseter.df.loc[in_grid, column] = results[column].values
+        grid_investment[in_grid] = investment
+
+    return grid_investment
+
+
+def _extend_grid_gis(grid_settlements, grid, grid_calc, year, time_step, start_year, end_year, grid_connect_limit,
+                     grid_cap_gen_limit, gis_cost_folder, max_grid_extension_dist, out_folder, save_shapefiles, state):
+    import onsset_gis
+
+    grid_settlements.max_extension_dist(year, time_step, end_year, start_year, grid_calc, grid)
+
+    grid_settlements.df = onsset_gis.find_grid_path(grid_settlements.df, year, time_step, start_year,
+                                                    grid_connect_limit, grid_cap_gen_limit, gis_cost_folder, grid,
+                                                    max_grid_extension_dist, out_folder, save_shapefiles, state=state)
+
+    df = grid_settlements.df
+    df[SET_LCOE_GRID + "{}".format(year)], df[SET_MIN_GRID_DIST + "{}".format(year)], \
+        df[SET_ELEC_ORDER + "{}".format(year)], df[SET_MV_CONNECT_DIST], grid_investment = \
+        grid_settlements.elec_extension_gis(grid_calc, max_grid_extension_dist, year, start_year, end_year, time_step,
+                                            new_investment=np.zeros(len(df)), grid_name=grid)
+
+    columns = ['MaxDist', 'MaxDist' + '{}'.format(year), 'GridCapacityRequired',
+               'GridCapacityRequired' + '{}'.format(year), 'extension_distance_' + '{}'.format(year),
+               SET_LCOE_GRID + "{}".format(year), SET_MIN_GRID_DIST + "{}".format(year),
+               SET_ELEC_ORDER + "{}".format(year), SET_MV_CONNECT_DIST]
+    return pd.DataFrame(df[columns]), np.nan_to_num(grid_investment[0]), state
+
+
+def get_scenario_name(scenario_info, scenario):
+    """Name of a scenario of the ScenarioInfo sheet in its results files, from the indices of its levers
+
+    The name leaves out the DiscountIndex lever, so scenarios that only differ in it have the same name.
+
+    Arguments
+    ---------
+    scenario_info : pandas.DataFrame
+    scenario : int
+        Scenario number in the ScenarioInfo sheet
+
+    Returns
+    -------
+    str
+    """
+    levers = scenario_info.iloc[scenario]
+    return '{}_{}_{}_{}_{}_{}'.format(levers['PopIndex'], levers['ElecRateIndex'], levers['ResidentialDemand'],
+                                      levers['SocialProductiveDem'], levers['IndustrialDem'], levers['PVIndex'])
+
+
+def run_scenario(onsseter, scenario, scenario_info, scenario_parameters, specs_data, results_folder, summary_folder,
+                 gis_cost_folder, save_shapefiles, gis_grid_extension, short_results, results_extension='.csv',
+                 compact=False, extension_mode='rounds', windowed_rasters=False, grid_workers=1, trace_format='csv'):
+    """Runs one scenario of the ScenarioInfo sheet and writes its results and summary
+
+    Arguments
+    ---------
+    onsseter : SettlementProcessor
+        Calibrated settlements, changed in place
+    scenario : int
+        Scenario number in the ScenarioInfo sheet
+    scenario_info : pandas.DataFrame
+    scenario_parameters : pandas.DataFrame
+    specs_data : pandas.DataFrame
+    results_extension : str
+        Extension, and so format, of the full and short results files
+    extension_mode : str
+        Grid extension algorithm, 'rounds' or 'heap'
+    windowed_rasters : bool
+        Crop the cost rasters of each grid to its settlements plus the maximum grid extension distance, an
+        approximation of the grid extension over the whole rasters (see onsset_gis.grid_bounds)
+    grid_workers : int
+        With more than one, the pathfinder grid extension of the grids runs in parallel processes, see
+        extend_grids_gis
+    trace_format : str
+        Format ('csv' or 'json') of the <country>-<scenario>_trace file written with the full results, with the wall
+        time, CPU time, peak memory growth and number of settlements of each stage (see
+        instrumentation.StageTrace). None to not write it
+
+    Returns
+    -------
+    scenario_name : str
+    summary_table : pandas.DataFrame
+    """
+
+    if gis_grid_extension:
+        import onsset_gis
+
+    print('Scenario: ' + str(scenario + 1))
+    country_id = specs_data.iloc[0]['CountryCode']
+
+    # Population lever
+    pop_index = scenario_info.iloc[scenario]['PopIndex']
+    pop_future = scenario_parameters.iloc[pop_index]['Population2030']
+    urban_future = scenario_parameters.iloc[pop_index]['UrbanRatio2030']
+
+    # Electrification rate target lever
+    electification_rate_index = scenario_info.iloc[scenario]['ElecRateIndex']
+    electrification_rate_2030 = scenario_parameters.iloc[electification_rate_index]['ElecRate2030']
+    electrification_rate_2025 = scenario_parameters.iloc[electification_rate_index]['ElecRate2025']
+
+    #  Household demand lever
+    household_dem_index = scenario_info.iloc[scenario]['ResidentialDemand']
+    rural_tier = int(scenario_parameters.iloc[household_dem_index]['RuralTargetTier'])
+    urban_tier = int(scenario_parameters.iloc[household_dem_index]['UrbanTargetTier'])
+
+    # Social and productive demand lever (Health and education)
+    social_productive_dem_index = scenario_info.iloc[scenario]['SocialProductiveDem']
+    social_productive_demand = scenario_parameters.iloc[social_productive_dem_index]['SocialProductiveDemand']
+
+    # Industrial demand lever
+    ind_dem_index = scenario_info.iloc[scenario]['IndustrialDem']
+    industrial_demand = scenario_parameters.iloc[ind_dem_index]['IndustrialDemand']
+
+    # PV system cost
+    pv_index = scenario_info.iloc[scenario]['PVIndex']
+    pv_capital_cost_adjust = float(scenario_parameters.iloc[pv_index]['PV_Cost_adjust'])
+
+    #  Discount rate lever
+    disscount_index = scenario_info.iloc[scenario]['DiscountIndex']
+    disc_rate = scenario_parameters.iloc[disscount_index]['DiscRate']
+
+    # Make sure the levers here match the order you prefer
+    scenario_name = get_scenario_name(scenario_info, scenario)
+
+    out_folder = results_folder + '/' + scenario_name + '/'
+
+    try:
+        os.mkdir(out_folder)
+    except FileExistsError:
+        pass
+
+    trace = StageTrace()
+
+    onsseter.df['HealthDemand'] = 0
+    onsseter.df['EducationDemand'] = 0
+    onsseter.df['AgriDemand'] = 0
+    onsseter.df['CommercialDemand'] = 0
+    onsseter.df['HeavyIndustryDemand'] = 0
+
+    if social_productive_demand == 1:
+        onsseter.df['HealthDemand'] = onsseter.df['health_dem_low']
+        onsseter.df['EducationDemand'] = onsseter.df['edu_dem_low']
+        onsseter.df['AgriDemand'] = onsseter.df['agri_dem_low']
+        onsseter.df['CommercialDemand'] = onsseter.df['prod_dem_low']
+    elif social_productive_demand == 2:
+        onsseter.df['HealthDemand'] = onsseter.df['health_dem_mid']
+        onsseter.df['EducationDemand'] = onsseter.df['edu_dem_mid']
+        onsseter.df['AgriDemand'] = onsseter.df['agri_dem_mid']
+        onsseter.df['CommercialDemand'] = onsseter.df['prod_dem_mid']
+    elif social_productive_demand == 3:
+        onsseter.df['HealthDemand'] = onsseter.df['health_dem_high']
+        onsseter.df['EducationDemand'] = onsseter.df['edu_dem_high']
+        onsseter.df['AgriDemand'] = onsseter.df['agri_dem_high']
+        onsseter.df['CommercialDemand'] = onsseter.df['prod_dem_high']
+
+    if industrial_demand == 1:
+        onsseter.df['HeavyIndustryDemand'] = onsseter.df['ind_dem_low']
+    elif industrial_demand == 2:
+            onsseter.df['HeavyIndustryDemand'] = onsseter.df['ind_dem_mid']
+    elif industrial_demand == 3:
+            onsseter.df['HeavyIndustryDemand'] = onsseter.df['ind_dem_high']
+
+    if rural_tier == 6:
+        onsseter.df['ResidentialDemandTierCustom'] = onsseter.df['hh_dem_low']
+    elif rural_tier == 7:
+        onsseter.df['ResidentialDemandTierCustom'] = onsseter.df['hh_dem_mid']
+    elif rural_tier == 8:
+        onsseter.df['ResidentialDemandTierCustom'] = onsseter.df['hh_dem_high']
+
+    onsseter.df.drop(['hh_dem_low', 'hh_dem_mid', 'hh_dem_high', 'health_dem_low', 'health_dem_mid',
+                      'health_dem_high', 'edu_dem_low', 'edu_dem_mid', 'edu_dem_high', 'agri_dem_low',
+                      'agri_dem_mid', 'agri_dem_high', 'prod_dem_low', 'prod_dem_mid', 'prod_dem_high',
+                      'ind_dem_low', 'ind_dem_mid', 'ind_dem_high'], axis=1, inplace=True)
+
+    start_year = specs_data.iloc[0][SPE_START_YEAR]
+    intermediate_year = specs_data.iloc[0]['Intermediate_year']
+    end_year = specs_data.iloc[0][SPE_END_YEAR]
+
+    num_people_per_hh_rural = float(specs_data.iloc[0][SPE_NUM_PEOPLE_PER_HH_RURAL])
+    num_people_per_hh_urban = float(specs_data.iloc[0][SPE_NUM_PEOPLE_PER_HH_URBAN])
+
+    # RUN_PARAM: Fill in general and technology specific parameters (e.g. discount rate, losses etc.)
+    max_grid_extension_dist = 50
+
+    intermediate_electrification_target = electrification_rate_2025
+    end_year_electrification_rate_target = electrification_rate_2030
+
+    # West grid specifications
+    auto_intensification_ouest = 0
+    annual_new_grid_connections_limit_ouest = {intermediate_year: 999999999,
+                                               end_year: 999999999}
+    annual_grid_cap_gen_limit_ouest = {intermediate_year: 999999999,
+                                       end_year: 999999999}
+
+    grid_generation_cost_ouest = 0.07
+    grid_power_plants_capital_cost_ouest = 2000
+    grid_losses_ouest = 0.08
+
+    # South grid specifications
+    auto_intensification_sud = 0
+    annual_new_grid_connections_limit_sud = {intermediate_year: 999999999,
+                                             end_year: 999999999}
+    annual_grid_cap_gen_limit_sud = {intermediate_year: 999999999,
+                                     end_year: 999999999}
+
+    grid_generation_cost_sud = 0.07
+    grid_power_plants_capital_cost_sud = 2000
+    grid_losses_sud = 0.08
+
+    # East grid specifications
+    auto_intensification_est = 0
+    annual_new_grid_connections_limit_est = {intermediate_year: 999999999,
+                                             end_year: 999999999}
+    annual_grid_cap_gen_limit_est = {intermediate_year: 999999999,
+                                     end_year: 999999999}
+    grid_generation_cost_est = 0.07
+    grid_power_plants_capital_cost_est = 2000
+    grid_losses_est = 0.08
+
+
+    Technology.set_default_values(base_year=start_year,
+                                  start_year=start_year,
+                                  end_year=end_year,
+                                  discount_rate=disc_rate)
+
+    grid_calc_ouest = Technology(om_of_td_lines=0.1,
+                                 distribution_losses=grid_losses_ouest,
+                                 connection_cost_per_hh=150,
+                                 base_to_peak_load_ratio=0.8,
+                                 capacity_factor=1,
+                                 tech_life=30,
+                                 grid_capacity_investment=grid_power_plants_capital_cost_ouest,
+                                 grid_price=grid_generation_cost_ouest)
+
+    grid_calc_sud = Technology(om_of_td_lines=0.1,
+                               distribution_losses=grid_losses_sud,
+                               connection_cost_per_hh=150,
+                               base_to_peak_load_ratio=0.8,
+                               capacity_factor=1,
+                               tech_life=30,
+                               grid_capacity_investment=grid_power_plants_capital_cost_sud,
+                               grid_price=grid_generation_cost_sud)
+
+    grid_calc_est = Technology(om_of_td_lines=0.1,
+                               distribution_losses=grid_losses_est,
+                               connection_cost_per_hh=150,
+                               base_to_peak_load_ratio=0.8,
+                               capacity_factor=1,
+                               tech_life=30,
+                               grid_capacity_investment=grid_power_plants_capital_cost_est,
+                               grid_price=grid_generation_cost_est)
+
+    mg_hydro_calc = Technology(om_of_td_lines=0.02,
+                               distribution_losses=0.05,
+                               connection_cost_per_hh=92,
+                               base_to_peak_load_ratio=0.85,
+                               capacity_factor=0.5,
+                               tech_life=35,
+                               capital_cost={float("inf"): 5000},
+                               om_costs=0.03,
+                               mini_grid=True)
+
+    mg_wind_calc = Technology(om_of_td_lines=0.02,
+                              distribution_losses=0.05,
+                              connection_cost_per_hh=92,
+                              base_to_peak_load_ratio=0.85,
+                              capital_cost={float("inf"): 3750},
+                              om_costs=0.02,
+                              tech_life=20,
+                              mini_grid=True)
+
+    mg_pv_calc = Technology(om_of_td_lines=0.02,
+                            distribution_losses=0.05,
+                            connection_cost_per_hh=92,
+                            base_to_peak_load_ratio=0.85,
+                            tech_life=25,
+                            om_costs=0.015,
+                            capital_cost={float("inf"): 2950 * pv_capital_cost_adjust}, #2950,
+                            mini_grid=True)
+
+    sa_pv_calc = Technology(base_to_peak_load_ratio=0.9,
+                            tech_life=25,
+                            om_costs=0.02,
+                            capital_cost={float("inf"): 6950 * pv_capital_cost_adjust,
+                                          1: 4470 * pv_capital_cost_adjust,
+                                          0.100: 6380 * pv_capital_cost_adjust,
+                                          0.050: 8780 * pv_capital_cost_adjust,
+                                          0.020: 9620 * pv_capital_cost_adjust
+                                          },
+                            standalone=True)
+
+    mg_diesel_calc = Technology(om_of_td_lines=0.02,
                                 distribution_losses=0.05,
                                 connection_cost_per_hh=92,
                                 base_to_peak_load_ratio=0.85,
-                                tech_life=25,
-                                om_costs=0.015,
-                                capital_cost={float("inf"): 2950 * pv_capital_cost_adjust}, #2950,
+                                capacity_factor=0.7,
+                                tech_life=20,
+                                om_costs=0.1,
+                                capital_cost={float("inf"): 672},
                                 mini_grid=True)
 
-        sa_pv_calc = Technology(base_to_peak_load_ratio=0.9,
-                                tech_life=25,
-                                om_costs=0.02,
-                                capital_cost={float("inf"): 6950 * pv_capital_cost_adjust,
-                                              1: 4470 * pv_capital_cost_adjust,
-                                              0.100: 6380 * pv_capital_cost_adjust,
-                                              0.050: 8780 * pv_capital_cost_adjust,
-                                              0.020: 9620 * pv_capital_cost_adjust
-                                              },
+    sa_diesel_calc = Technology(base_to_peak_load_ratio=0.9,
+                                capacity_factor=0.5,
+                                tech_life=20,
+                                om_costs=0.1,
+                                capital_cost={float("inf"): 814},
                                 standalone=True)
 
-        mg_diesel_calc = Technology(om_of_td_lines=0.02,
-                                    distribution_losses=0.05,
-                                    connection_cost_per_hh=92,
-                                    base_to_peak_load_ratio=0.85,
-                                    capacity_factor=0.7,
-                                    tech_life=20,
-                                    om_costs=0.1,
-                                    capital_cost={float("inf"): 672},
-                                    mini_grid=True)
-
-        sa_diesel_calc = Technology(base_to_peak_load_ratio=0.9,
-                                    capacity_factor=0.5,
-                                    tech_life=20,
-                                    om_costs=0.1,
-                                    capital_cost={float("inf"): 814},
-                                    standalone=True)
-
-        sa_diesel_cost = {'diesel_price': 0.8,
-                          'efficiency': 0.28,
-                          'diesel_truck_consumption': 14,
-                          'diesel_truck_volume': 300}
-
-        mg_diesel_cost = {'diesel_price': 0.8,
-                          'efficiency': 0.33,
-                          'diesel_truck_consumption': 33.7,
-                          'diesel_truck_volume': 15000}
-
-        annual_new_grid_connections_limit = {'Est': annual_new_grid_connections_limit_est,
-                                             'Sud': annual_new_grid_connections_limit_sud,
-                                             'Ouest': annual_new_grid_connections_limit_ouest}
-
-        annual_grid_cap_gen_limit = {'Est': annual_grid_cap_gen_limit_est,
-                                     'Sud': annual_grid_cap_gen_limit_sud,
-                                     'Ouest': annual_grid_cap_gen_limit_ouest}
-
-        grids = ['Est', 'Ouest', 'Sud']
-        grid_calcs = [grid_calc_est, grid_calc_ouest, grid_calc_sud]
-        auto_intensifications = [auto_intensification_est, auto_intensification_ouest, auto_intensification_sud]
-
-        onsseter.df.loc[onsseter.df['Region'] == 'Haut-Katanga', 'ClosestGrid'] = 'Sud'
-        onsseter.df.loc[onsseter.df['Region'] == 'Haut-Lomami', 'ClosestGrid'] = 'Sud'
-        onsseter.df.loc[onsseter.df['Region'] == 'Lualaba', 'ClosestGrid'] = 'Sud'
-        onsseter.df.loc[onsseter.df['Region'] == 'Tanganyka', 'ClosestGrid'] = 'Sud'
-        onsseter.df.loc[onsseter.df['Region'] == 'Kasai-Central', 'ClosestGrid'] = 'Sud'
-        onsseter.df.loc[onsseter.df['Region'] == 'Lomami', 'ClosestGrid'] = 'Sud'
-        onsseter.df.loc[onsseter.df['Region'] == 'Kasai-Oriental', 'ClosestGrid'] = 'Sud'
-
-        onsseter.df.loc[onsseter.df['Region'] == 'Kongo Central', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Kinshasa', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Kwango', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Kasai', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Kwilu', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Mai-Ndombe', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Tshuapa', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Equateur', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Mongala', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Sud-Ubangi', 'ClosestGrid'] = 'Ouest'
-        onsseter.df.loc[onsseter.df['Region'] == 'Nord-Ubangi', 'ClosestGrid'] = 'Ouest'
-
-        onsseter.df.loc[onsseter.df['Region'] == 'Sud-Kivu', 'ClosestGrid'] = 'Est'
-        onsseter.df.loc[onsseter.df['Region'] == 'Nord-Kivu', 'ClosestGrid'] = 'Est'
-        onsseter.df.loc[onsseter.df['Region'] == 'Maniema', 'ClosestGrid'] = 'Est'
-        onsseter.df.loc[onsseter.df['Region'] == 'Sankuru', 'ClosestGrid'] = 'Est'
-        onsseter.df.loc[onsseter.df['Region'] == 'Tshopo', 'ClosestGrid'] = 'Est'
-        onsseter.df.loc[onsseter.df['Region'] == 'Ituri', 'ClosestGrid'] = 'Est'
-        onsseter.df.loc[onsseter.df['Region'] == 'Bas-Uele', 'ClosestGrid'] = 'Est'
-        onsseter.df.loc[onsseter.df['Region'] == 'Haut-Uele', 'ClosestGrid'] = 'Est'
-
-        prioritization = 2
-
-        # RUN_PARAM: One shall define here the years of analysis (excluding start year),
-        # together with access targets per interval and timestep duration
-        yearsofanalysis = [intermediate_year, end_year]
-        eleclimits = {intermediate_year: intermediate_electrification_target,
-                      end_year: end_year_electrification_rate_target}
-        time_steps = {intermediate_year: intermediate_year - start_year, end_year: end_year - intermediate_year}
-
-        onsseter.current_mv_line_dist()
-
-        onsseter.project_pop_and_urban(pop_future, urban_future, start_year, end_year, intermediate_year)
-
-        if gis_grid_extension:
-            onsseter.df = onsset_gis.create_geodataframe(onsseter.df)
-
-        for year in yearsofanalysis:
-            eleclimit = eleclimits[year]
-            time_step = time_steps[year]
+    sa_diesel_cost = {'diesel_price': 0.8,
+                      'efficiency': 0.28,
+                      'diesel_truck_consumption': 14,
+                      'diesel_truck_volume': 300}
+
+    mg_diesel_cost = {'diesel_price': 0.8,
+                      'efficiency': 0.33,
+                      'diesel_truck_consumption': 33.7,
+                      'diesel_truck_volume': 15000}
+
+    annual_new_grid_connections_limit = {'Est': annual_new_grid_connections_limit_est,
+                                         'Sud': annual_new_grid_connections_limit_sud,
+                                         'Ouest': annual_new_grid_connections_limit_ouest}
+
+    annual_grid_cap_gen_limit = {'Est': annual_grid_cap_gen_limit_est,
+                                 'Sud': annual_grid_cap_gen_limit_sud,
+                                 'Ouest': annual_grid_cap_gen_limit_ouest}
+
+    grids = ['Est', 'Ouest', 'Sud']
+    grid_calcs = [grid_calc_est, grid_calc_ouest, grid_calc_sud]
+    auto_intensifications = [auto_intensification_est, auto_intensification_ouest, auto_intensification_sud]
+
+    onsseter.df.loc[onsseter.df['Region'] == 'Haut-Katanga', 'ClosestGrid'] = 'Sud'
+    onsseter.df.loc[onsseter.df['Region'] == 'Haut-Lomami', 'ClosestGrid'] = 'Sud'
+    onsseter.df.loc[onsseter.df['Region'] == 'Lualaba', 'ClosestGrid'] = 'Sud'
+    onsseter.df.loc[onsseter.df['Region'] == 'Tanganyka', 'ClosestGrid'] = 'Sud'
+    onsseter.df.loc[onsseter.df['Region'] == 'Kasai-Central', 'ClosestGrid'] = 'Sud'
+    onsseter.df.loc[onsseter.df['Region'] == 'Lomami', 'ClosestGrid'] = 'Sud'
+    onsseter.df.loc[onsseter.df['Region'] == 'Kasai-Oriental', 'ClosestGrid'] = 'Sud'
+
+    onsseter.df.loc[onsseter.df['Region'] == 'Kongo Central', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Kinshasa', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Kwango', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Kasai', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Kwilu', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Mai-Ndombe', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Tshuapa', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Equateur', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Mongala', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Sud-Ubangi', 'ClosestGrid'] = 'Ouest'
+    onsseter.df.loc[onsseter.df['Region'] == 'Nord-Ubangi', 'ClosestGrid'] = 'Ouest'
+
+    onsseter.df.loc[onsseter.df['Region'] == 'Sud-Kivu', 'ClosestGrid'] = 'Est'
+    onsseter.df.loc[onsseter.df['Region'] == 'Nord-Kivu', 'ClosestGrid'] = 'Est'
+    onsseter.df.loc[onsseter.df['Region'] == 'Maniema', 'ClosestGrid'] = 'Est'
+    onsseter.df.loc[onsseter.df['Region'] == 'Sankuru', 'ClosestGrid'] = 'Est'
+    onsseter.df.loc[onsseter.df['Region'] == 'Tshopo', 'ClosestGrid'] = 'Est'
+    onsseter.df.loc[onsseter.df['Region'] == 'Ituri', 'ClosestGrid'] = 'Est'
+    onsseter.df.loc[onsseter.df['Region'] == 'Bas-Uele', 'ClosestGrid'] = 'Est'
+    onsseter.df.loc[onsseter.df['Region'] == 'Haut-Uele', 'ClosestGrid'] = 'Est'
+
+    prioritization = 2
+
+    # RUN_PARAM: One shall define here the years of analysis (excluding start year),
+    # together with access targets per interval and timestep duration
+    yearsofanalysis = [intermediate_year, end_year]
+    eleclimits = {intermediate_year: intermediate_electrification_target,
+                  end_year: end_year_electrification_rate_target}
+    time_steps = {intermediate_year: intermediate_year - start_year, end_year: end_year - intermediate_year}
+
+    onsseter.current_mv_line_dist()
+
+    onsseter.project_pop_and_urban(pop_future, urban_future, start_year, end_year, intermediate_year)
 
+    if gis_grid_extension:
+        onsseter.df = onsset_gis.create_geodataframe(onsseter.df)
+        # The pathfinder rasters of each grid are carried from one year to the next in memory
+        raster_states = {}
+        for grid in grids:
+            bounds = onsset_gis.grid_bounds(onsseter.df, grid, max_grid_extension_dist) if windowed_rasters else None
+            raster_states[grid] = onsset_gis.GridRasterState(gis_cost_folder, grid, bounds)
+
+    for year in yearsofanalysis:
+        eleclimit = eleclimits[year]
+        time_step = time_steps[year]
+
+        with trace.stage('set_scenario_variables', rows=len(onsseter.df), year=year):
             onsseter.set_scenario_variables(year, num_people_per_hh_rural, num_people_per_hh_urban, time_step,
                                             start_year, urban_tier, rural_tier, 1)
 
+        with trace.stage('diesel_cost_columns', rows=len(onsseter.df), year=year):
             onsseter.diesel_cost_columns(sa_diesel_cost, mg_diesel_cost, year)
 
+        with trace.stage('calculate_off_grid_lcoes', rows=len(onsseter.df), year=year):
             sa_diesel_investment, sa_pv_investment, mg_diesel_investment, mg_pv_investment, mg_wind_investment, \
                 mg_hydro_investment = onsseter.calculate_off_grid_lcoes(mg_hydro_calc, mg_wind_calc, mg_pv_calc,
                                                                         sa_pv_calc, mg_diesel_calc,
-                                                                        sa_diesel_calc, year, end_year, time_step)
+                                                                        sa_diesel_calc, year, end_year, time_step,
+                                                                        tech_labels=not short_results)
 
-            grid_investment = np.zeros(len(onsseter.df['X_deg']))
-            grid_investment_combined = np.zeros(len(onsseter.df['X_deg']))
-            onsseter.df[SET_LCOE_GRID + "{}".format(year)] = 99
-            onsseter.df['grid_investment' + "{}".format(year)] = 0
+        grid_investment = np.zeros(len(onsseter.df['X_deg']))
+        grid_investment_combined = np.zeros(len(onsseter.df['X_deg']))
+        onsseter.df[SET_LCOE_GRID + "{}".format(year)] = 99
+        onsseter.df['grid_investment' + "{}".format(year)] = 0
 
-            if gis_grid_extension:
-                print('')
-                onsseter.df['extension_distance_' + '{}'.format(year)] = 99
+        if gis_grid_extension:
+            print('')
+            onsseter.df['extension_distance_' + '{}'.format(year)] = 99
 
-                onsseter.pre_screening(eleclimit, year, time_step, prioritization, auto_intensification_ouest,
-                                       auto_intensification_sud, auto_intensification_est)
+            onsseter.pre_screening(eleclimit, year, time_step, prioritization, auto_intensification_ouest,
+                                   auto_intensification_sud, auto_intensification_est)
 
-            for grid, grid_calc, auto_intensification in zip(grids, grid_calcs, auto_intensifications):
-                grid_cap_gen_limit = time_step * annual_grid_cap_gen_limit[grid][year] * 1000
-                grid_connect_limit = time_step * annual_new_grid_connections_limit[grid][year] * 1000
+        grid_tasks = []
+        for grid, grid_calc, auto_intensification in zip(grids, grid_calcs, auto_intensifications):
+            grid_cap_gen_limit = time_step * annual_grid_cap_gen_limit[grid][year] * 1000
+            grid_connect_limit = time_step * annual_new_grid_connections_limit[grid][year] * 1000
 
+            grid_rows = int((onsseter.df['ClosestGrid'] == grid).sum())
+            with trace.stage('pre_electrification', rows=grid_rows, year=year, grid=grid):
                 grid_investment, grid_cap_gen_limit, grid_connect_limit = \
                     onsseter.pre_electrification(grid_calc.grid_price, year, time_step, end_year, grid_calc,
                                                  grid_cap_gen_limit, grid_connect_limit, grid_investment, grid)
 
-                if gis_grid_extension:
-                    print('Running pathfinder for ' + grid + ' grid')
-
-                    grid_investment = np.zeros(len(onsseter.df['X_deg']))
-                    onsseter.max_extension_dist(year, time_step, end_year, start_year, grid_calc, grid)
-
-                    onsseter.df = onsset_gis.find_grid_path(onsseter.df, year, time_step, start_year, grid_connect_limit,
-                                                 grid_cap_gen_limit, gis_cost_folder, grid, max_grid_extension_dist,
-                                                 out_folder, save_shapefiles)
+            if gis_grid_extension:
+                grid_investment = np.zeros(len(onsseter.df['X_deg']))
+                grid_tasks.append((grid, grid_calc, grid_connect_limit, grid_cap_gen_limit))
 
-                    onsseter.df[SET_LCOE_GRID + "{}".format(year)], onsseter.df[SET_MIN_GRID_DIST + "{}".format(year)], \
-                    onsseter.df[SET_ELEC_ORDER + "{}".format(year)], onsseter.df[
-                        SET_MV_CONNECT_DIST], grid_investment = onsseter.elec_extension_gis(grid_calc,
-                                                                                            max_grid_extension_dist,
-                                                                                            year,
-                                                                                            start_year,
-                                                                                            end_year,
-                                                                                            time_step,
-                                                                                            new_investment=grid_investment,
-                                                                                            grid_name=grid)
-                    grid_investment_combined += np.nan_to_num(grid_investment[0])
-
-                else:
+            else:
+                with trace.stage('elec_extension', rows=grid_rows, year=year, grid=grid):
                     onsseter.df[SET_LCOE_GRID + "{}".format(year)], onsseter.df[SET_MIN_GRID_DIST + "{}".format(year)], \
                     onsseter.df[SET_ELEC_ORDER + "{}".format(year)], onsseter.df[
                         SET_MV_CONNECT_DIST], grid_investment = onsseter.elec_extension(grid_calc, max_grid_extension_dist, year,
@@ -474,22 +745,34 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, gi
                                                                                         grid_connect_limit,
                                                                                         grid_investment,
                                                                                         auto_intensification,
-                                                                                        prioritization, grid_name=grid)
+                                                                                        prioritization, grid_name=grid,
+                                                                                        extension_mode=extension_mode)
 
-            onsseter.df['grid_investment' + "{}".format(year)] = grid_investment_combined
+        if grid_tasks:
+            task_grids = [task[0] for task in grid_tasks]
+            with trace.stage('elec_extension', rows=int(onsseter.df['ClosestGrid'].isin(task_grids).sum()), year=year,
+                             grid=' '.join(task_grids)):
+                grid_investment_combined += extend_grids_gis(onsseter, grid_tasks, year, time_step, start_year,
+                                                             end_year, gis_cost_folder, max_grid_extension_dist,
+                                                             out_folder, save_shapefiles, raster_states, grid_workers)
 
-            if gis_grid_extension:
-                grid_investment = grid_investment_combined
+        onsseter.df['grid_investment' + "{}".format(year)] = grid_investment_combined
 
+        if gis_grid_extension:
+            grid_investment = grid_investment_combined
+
+        with trace.stage('results_columns', rows=len(onsseter.df), year=year):
             onsseter.results_columns(year, time_step, prioritization, auto_intensification_ouest,
-                                     auto_intensification_sud, auto_intensification_est)
+                                     auto_intensification_sud, auto_intensification_est,
+                                     tech_labels=not short_results)
 
-            grid_investment = pd.DataFrame(grid_investment)
+        grid_investment = pd.DataFrame(grid_investment)
 
-            onsseter.calculate_investments(sa_diesel_investment, sa_pv_investment, mg_diesel_investment,
-                                           mg_pv_investment, mg_wind_investment,
-                                           mg_hydro_investment, grid_investment, year)
+        onsseter.calculate_investments(sa_diesel_investment, sa_pv_investment, mg_diesel_investment,
+                                       mg_pv_investment, mg_wind_investment,
+                                       mg_hydro_investment, grid_investment, year)
 
+        with trace.stage('apply_limitations', rows=len(onsseter.df), year=year):
             if gis_grid_extension:
                 print('')
                 onsseter.apply_limitations_gis(year, time_step)
@@ -497,35 +780,37 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, gi
                 onsseter.apply_limitations(eleclimit, year, time_step, prioritization, auto_intensification_ouest,
                                            auto_intensification_sud, auto_intensification_est)
 
-            onsseter.calculate_new_capacity(mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc, mg_diesel_calc,
-                                            sa_diesel_calc, grid_calc_ouest, grid_calc_sud, grid_calc_est, year)
+        onsseter.calculate_new_capacity(mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc, mg_diesel_calc,
+                                        sa_diesel_calc, grid_calc_ouest, grid_calc_sud, grid_calc_est, year)
+
+        onsseter.update_results_columns(year)
 
-            onsseter.update_results_columns(year)
+        if compact:
+            onsseter.compact_dtypes()
 
-        for i in range(len(onsseter.df.columns)):
-            if onsseter.df.iloc[:, i].dtype == 'float64':
-                onsseter.df.iloc[:, i] = pd.to_numeric(onsseter.df.iloc[:, i], downcast='float')
-            elif onsseter.df.iloc[:, i].dtype == 'int64':
-                onsseter.df.iloc[:, i] = pd.to_numeric(onsseter.df.iloc[:, i], downcast='signed')
+    onsseter.compact_dtypes(codes=False)
 
-        ### In the variable below you can choose which results to include
+    ### In the variable below you can choose which results to include
 
-        settlements_out_dir = out_folder
-        summaries_out_dir = summary_folder
+    settlements_out_dir = out_folder
+    summaries_out_dir = summary_folder
 
-        settlements_out_csv = os.path.join(settlements_out_dir, '{}-{}.csv'.format(country_id, scenario_name))
-        settlements_out_short_csv = os.path.join(settlements_out_dir, '{}-{}_short.csv'.format(country_id, scenario_name))
-        summary_csv = os.path.join(summaries_out_dir, '{}-{}_summary.csv'.format(country_id, scenario_name))
+    settlements_out_csv = os.path.join(settlements_out_dir,
+                                       '{}-{}{}'.format(country_id, scenario_name, results_extension))
+    settlements_out_short_csv = os.path.join(settlements_out_dir,
+                                             '{}-{}_short{}'.format(country_id, scenario_name, results_extension))
+    summary_csv = os.path.join(summaries_out_dir, '{}-{}_summary.csv'.format(country_id, scenario_name))
 
+    with trace.stage('write_results', rows=len(onsseter.df)):
         if short_results:
             df_short = onsseter.df[['id', 'X_deg', 'Y_deg', 'Region', 'PopStartYear', 'ElecStart', 'ElecPopCalib', 'Pop2025',
                                     'FinalElecCode2025', 'NewConnections2025', 'NewCapacity2025', 'InvestmentCost2025',
                                     'NewDemand2025', 'TotalDemand2025', 'Pop2030', 'FinalElecCode2030',
                                     'NewConnections2030', 'NewCapacity2030', 'InvestmentCost2030', 'NewDemand2030',
                                     'TotalDemand2030']]
-            df_short.to_csv(settlements_out_short_csv, index=False)
+            SettlementProcessor.write_settlements(df_short, settlements_out_short_csv)
         else:
-            onsseter.df.to_csv(settlements_out_csv, index=False)
+            SettlementProcessor.write_settlements(onsseter.df, settlements_out_csv)
 
             df_short = onsseter.df[
                 ['id', 'X_deg', 'Y_deg', 'Region', 'PopStartYear', 'ElecStart', 'ElecPopCalib', 'Pop2025',
@@ -533,11 +818,18 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, gi
                  'NewDemand2025', 'TotalDemand2025', 'Pop2030', 'FinalElecCode2030',
                  'NewConnections2030', 'NewCapacity2030', 'InvestmentCost2030', 'NewDemand2030',
                  'TotalDemand2030']]
-            
-            df_short.to_csv(settlements_out_short_csv, index=False)
 
+            SettlementProcessor.write_settlements(df_short, settlements_out_short_csv)
+
+    with trace.stage('summaries', rows=len(onsseter.df)):
         summary_table = onsseter.calc_drc_summaries(yearsofanalysis)
 
         summary_table.to_csv(summary_csv, index=True)
 
-        logging.info('Finished')
+    if trace_format is not None:
+        trace.write(os.path.join(settlements_out_dir, '{}-{}_trace.{}'.format(country_id, scenario_name,
+                                                                              trace_format)))
+
+    logger.info('Finished')
+
+    return scenario_name, summary_table
@@ -25,6 +25,7 @@ setuptools.setup(
         'numpy',
         'openpyxl',
         'pandas',
+        'pyarrow',
         'python-dateutil',
         'pytz',
         'six',
@@ -0,0 +1,281 @@
+"""Benchmark the stages of OnSSET on synthetic countries of growing size
+
+Notes
+-----
+
+Run ``PYTHONPATH=. python test/run_benchmarks.py --rows 10000 100000 --output benchmarks.json``
+from the repository root, or without ``PYTHONPATH=.`` once onsset is installed
+(e.g. ``pip install -e .``). Each size runs the calibration and a scenario on synthetic settlements built
+from ``test/test_data/dj-test.csv`` (see ``synthetic_settlements``) and
+records the time spent in each stage, together with a run of the pathfinder on
+a synthetic cost raster with one cell per settlement. The results are written
+as JSON, so that runs of different versions can be compared.
+
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+
+from onsset import SettlementProcessor, Technology
+from onsset.pathfinder import seek
+from onsset.runner import calibration, scenario
+
+TEST_CSV = os.path.join('test', 'test_data', 'dj-test.csv')
+TEST_SPECS = os.path.join('test', 'test_data', 'dj-specs-test.xlsx')
+
+# The methods timed during the calibration and scenario runs. Calls of a stage made by another stage (e.g. get_lcoe
+# within elec_extension) count towards both
+STAGES = [(SettlementProcessor, 'calibrate_current_pop_and_urban'),
+          (SettlementProcessor, 'elec_current_and_future'),
+          (Technology, 'get_lcoe'),
+          (SettlementProcessor, 'choose_minimum_off_grid_tech'),
+          (SettlementProcessor, 'elec_extension'),
+          (SettlementProcessor, 'calc_drc_summaries')]
+
+# A region of each grid of the runner, the synthetic country is split between them from west to east
+REGIONS = ['Kinshasa', 'Lualaba', 'Sud-Kivu']
+
+
+def synthetic_settlements(rows, seed=0):
+    """Settlements with the columns of dj-test.csv and the regional demand columns used by the runner
+
+    The test settlements are tiled side by side until there are enough rows, so that the density of the settlements
+    and the distances between them stay those of the test country. The populations vary by up to 10 % between tiles
+    and the demand levels of the scenarios are drawn at random.
+
+    Arguments
+    ---------
+    rows : int
+        Number of settlements
+    seed : int
+        Seed of the random values, the same seed gives the same settlements
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    base = pd.read_csv(TEST_CSV)
+    rng = np.random.RandomState(seed)
+
+    tiles = -(-rows // len(base))
+    side = int(np.ceil(np.sqrt(tiles)))
+    tile = np.repeat(np.arange(tiles), len(base))[:rows]
+
+    df = base.iloc[np.tile(np.arange(len(base)), tiles)[:rows]].reset_index(drop=True)
+    df['X_deg'] += (tile % side) * (base['X_deg'].max() - base['X_deg'].min() + 0.01)
+    df['Y_deg'] += (tile // side) * (base['Y_deg'].max() - base['Y_deg'].min() + 0.01)
+    df['Pop'] *= rng.uniform(0.9, 1.1, rows)
+    # Each tile has its own hydro-power sites
+    df['HydropowerFID'] += tile * (base['HydropowerFID'].max() + 1)
+    df['id'] = np.arange(1, rows + 1)
+
+    df['Conflict'] = 0
+    df['Region'] = np.array(REGIONS)[np.minimum((df['X_deg'].rank(pct=True) * len(REGIONS)).astype(int),
+                                                len(REGIONS) - 1)]
+    for level, factor in zip(['low', 'mid', 'high'], [1, 2, 3]):
+        df['hh_dem_' + level] = 50 * factor
+        for demand in ['health', 'edu', 'agri', 'prod', 'ind']:
+            df[demand + '_dem_' + level] = rng.rand(rows) * factor
+
+    return df
+
+
+def synthetic_specs(path, rows):
+    """Writes the specs of the test country, scaled to the population of the synthetic settlements, with a scenario
+
+    Arguments
+    ---------
+    path : str
+    rows : int
+        Number of synthetic settlements
+    """
+    scale = rows / len(pd.read_csv(TEST_CSV, usecols=['id']))
+
+    specs_data = pd.read_excel(TEST_SPECS, sheet_name='SpecsData')
+    specs_data['PopStartYear'] *= scale
+    specs_data['PopEndYear'] *= scale
+    specs_data['Intermediate_year'] = 2025
+    specs_data['EndYEar'] = 2030
+
+    scenario_info = pd.DataFrame({'Scenario': [0], 'PopIndex': [0], 'ElecRateIndex': [0], 'ResidentialDemand': [0],
+                                  'SocialProductiveDem': [0], 'IndustrialDem': [0], 'PVIndex': [0],
+                                  'DiscountIndex': [0]})
+    scenario_parameters = pd.DataFrame({'Population2030': [specs_data.loc[0, 'PopEndYear']],
+                                        'UrbanRatio2030': [specs_data.loc[0, 'UrbanRatioEndYear']],
+                                        'ElecRate2030': [1.0], 'ElecRate2025': [0.8],
+                                        'RuralTargetTier': [3], 'UrbanTargetTier': [4],
+                                        'SocialProductiveDemand': [1], 'IndustrialDemand': [1],
+                                        'PV_Cost_adjust': [1.0], 'DiscRate': [0.08]})
+
+    with pd.ExcelWriter(path) as writer:
+        specs_data.to_excel(writer, sheet_name='SpecsData', index=False)
+        scenario_info.to_excel(writer, sheet_name='ScenarioInfo', index=False)
+        scenario_parameters.to_excel(writer, sheet_name='ScenarioParameters', index=False)
+
+
+class StageTimer:
+    """Records the wall time of each call of the stages while in use as a context manager
+
+    Arguments
+    ---------
+    stages : list
+        (class, method name) of each stage
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.times = {name: [] for _, name in stages}
+
+    def __enter__(self):
+        self.originals = []
+        for owner, name in self.stages:
+            original = owner.__dict__[name]
+            self.originals.append((owner, name, original))
+            setattr(owner, name, self.timed(original, self.times[name]))
+        return self
+
+    def __exit__(self, *exc):
+        for owner, name, original in self.originals:
+            setattr(owner, name, original)
+
+    @staticmethod
+    def timed(function, times):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                times.append(time.perf_counter() - start)
+        return wrapper
+
+
+def run_stages(rows, folder, seed=0):
+    """Runs the calibration and the scenario of a synthetic country and times them and their stages
+
+    Returns
+    -------
+    dict
+        Total seconds and number of calls of each stage
+    """
+    settlements = os.path.join(folder, 'settlements.feather')
+    specs = os.path.join(folder, 'specs.xlsx')
+    specs_calib = os.path.join(folder, 'specs_calib.xlsx')
+    calibrated = os.path.join(folder, 'calibrated.feather')
+    results = os.path.join(folder, 'results')
+    os.makedirs(results, exist_ok=True)
+
+    synthetic_settlements(rows, seed).to_feather(settlements)
+    synthetic_specs(specs, rows)
+
+    timings = {}
+    with StageTimer(STAGES) as timer:
+        start = time.perf_counter()
+        calibration(specs, settlements, specs_calib, calibrated)
+        timings['calibration'] = (time.perf_counter() - start, 1)
+
+        start = time.perf_counter()
+        scenario(specs_calib, calibrated, results, results, '', False, False, False)
+        timings['scenario'] = (time.perf_counter() - start, 1)
+
+    for name, times in timer.times.items():
+        timings[name] = (sum(times), len(times))
+    return timings
+
+
+def run_pathfinder(rows, seed=0):
+    """Times the pathfinder on a square cost raster with about one cell per settlement
+
+    A straight existing line crosses the middle of the raster and one cell in a hundred is a target, both away from
+    the edge of the raster, where the pathfinder can't start from.
+    """
+    side = max(int(np.sqrt(rows)), 12)
+    rng = np.random.RandomState(seed)
+
+    origins = np.zeros((side, side), dtype=np.int64)
+    origins[side // 2, 1:-1] = 1
+    weights = rng.uniform(0.5, 1.5, (side, side))
+    targets = np.where(rng.rand(side, side) < 0.01, float(side), 0.)
+    targets[[0, -1], :] = 0
+    targets[:, [0, -1]] = 0
+    new_connections = np.where(targets > 0, 1., 0.)
+    new_capacity = np.where(targets > 0, 1., 0.)
+
+    start = time.perf_counter()
+    seek(origins, np.zeros(origins.shape), new_connections, 1e12, new_capacity, 1e12, np.zeros(origins.shape),
+         targets=targets, weights=weights, path_handling='link')
+    return time.perf_counter() - start, 1
+
+
+def run_benchmarks(sizes, repeats=1, seed=0):
+    """Runs the benchmarks for each number of settlements
+
+    Returns
+    -------
+    dict
+        The environment and one record per size and stage, with the seconds of each repeat
+    """
+    # Compiles the pathfinder, so that the compilation is not counted in the first size
+    run_pathfinder(144, seed)
+
+    records = []
+    for rows in sizes:
+        runs = []
+        for _ in range(repeats):
+            with TemporaryDirectory() as folder:
+                timings = run_stages(rows, folder, seed)
+            timings['pathfinder.seek'] = run_pathfinder(rows, seed)
+            runs.append(timings)
+
+        for stage in runs[0]:
+            seconds = [timings[stage][0] for timings in runs]
+            records.append({'rows': rows,
+                            'stage': stage,
+                            'calls': runs[0][stage][1],
+                            'seconds': seconds,
+                            'best': min(seconds),
+                            'median': float(np.median(seconds))})
+            logging.warning('{} rows, {}: {:.3f} s'.format(rows, stage, min(seconds)))
+
+    try:
+        from importlib.metadata import version
+        onsset_version = version('onsset')
+    except Exception:
+        onsset_version = None
+
+    return {'onsset': onsset_version,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'repeats': repeats,
+            'seed': seed,
+            'results': records}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help='Numbers of settlements, e.g. 10000 100000 1000000 5000000')
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks.json')
+    args = parser.parse_args()
+
+    # The progress of the benchmarks, without the info on every step of the model
+    logging.basicConfig(format='%(asctime)s\t\t%(message)s', level=logging.WARNING)
+
+    benchmarks = run_benchmarks(args.rows, args.repeats, args.seed)
+    with open(args.output, 'w') as output:
+        json.dump(benchmarks, output, indent=2)
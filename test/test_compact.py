@@ -0,0 +1,58 @@
+import os
+
+from onsset import CompactFrame, SettlementProcessor, SET_POP, SET_URBAN
+
+import numpy as np
+import pandas as pd
+from pytest import fixture, approx
+
+
+class TestSettlementProcessor:
+
+    @fixture
+    def setup_settlementprocessors(self):
+        csv_path = os.path.join('test', 'test_data', 'dj-test.csv')
+        return SettlementProcessor(csv_path), SettlementProcessor(csv_path, compact=True)
+
+    def test_compact_store(self, setup_settlementprocessors):
+        """The compact store holds the same settlements as float32, with the codes as int8
+        """
+        full, compact = setup_settlementprocessors
+
+        assert list(compact.df.columns) == list(full.df.columns)
+        assert not (compact.df.dtypes == 'float64').any()
+        assert compact.df[SET_URBAN].dtype == np.int8
+        assert compact.df[SET_POP].values == approx(full.df[SET_POP].values, rel=1e-6)
+        assert compact.df.memory_usage().sum() < full.df.memory_usage().sum()
+
+    def test_added_columns(self, setup_settlementprocessors):
+        """The columns added to the compact store are stored as float32, or int8 for the codes without missing
+        values, from the start, and the frames derived from it stay compact
+        """
+        _, compact = setup_settlementprocessors
+        size = len(compact.df)
+
+        compact.df['Pop2025'] = compact.df[SET_POP] * 1.1
+        compact.df['FinalElecCode2025'] = np.where(compact.df[SET_URBAN] == 1, 1, 99)
+        compact.df['MinimumOverallCode2025'] = np.where(compact.df[SET_URBAN] == 1, 1., np.nan)
+        compact.df['InvestmentCost2025'] = 0.
+        compact.df['Count'] = np.arange(size)
+
+        assert compact.df['Pop2025'].dtype == np.float32
+        assert compact.df['FinalElecCode2025'].dtype == np.int8
+        assert compact.df['MinimumOverallCode2025'].dtype == np.float32
+        assert compact.df['InvestmentCost2025'].dtype == np.float32
+        assert compact.df['Count'].dtype == np.int64
+        assert isinstance(compact.copy().df, CompactFrame)
+        assert isinstance(compact.df.loc[compact.df[SET_URBAN] == 1], CompactFrame)
+
+        # Other frames are left as they are
+        full = pd.DataFrame({SET_POP: np.ones(size)})
+        full['Pop2025'] = full[SET_POP] * 1.1
+        assert full['Pop2025'].dtype == np.float64
+
+    def test_is_code_column(self):
+        assert SettlementProcessor.is_code_column('FinalElecCode2030')
+        assert SettlementProcessor.is_code_column('IsUrban')
+        assert not SettlementProcessor.is_code_column('FinalElecCodeX')
+        assert not SettlementProcessor.is_code_column('Pop')
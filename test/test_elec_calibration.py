@@ -0,0 +1,40 @@
+from onsset import SettlementProcessor, SET_CALIB_GRID_DIST, SET_ELEC_CURRENT, SET_ELEC_POP_CALIB, SET_POP_CALIB
+
+from pandas import DataFrame
+from pytest import fixture, approx
+
+
+class TestElecCalibration:
+
+    @fixture
+    def setup_settlementprocessor(self) -> SettlementProcessor:
+        sp = SettlementProcessor.__new__(SettlementProcessor)
+        sp.df = DataFrame({SET_POP_CALIB: [1000., 100., 200., 300., 400., 30.],
+                           SET_CALIB_GRID_DIST: [0.05, 0.25, 0.15, 0.35, 9., 0.05],
+                           SET_ELEC_CURRENT: [1, 0, 0, 0, 0, 0],
+                           SET_ELEC_POP_CALIB: [1000., 0., 0., 0., 0., 0.]})
+        return sp
+
+    def test_electrify_closest(self, setup_settlementprocessor):
+        """The distance limit grows until the settlements within it reach the electrification rate
+        """
+        sp = setup_settlementprocessor
+        total_pop = sp.df[SET_POP_CALIB].sum()
+
+        elec_modelled = sp.electrify_closest(1000, total_pop, 1250 / total_pop, min_pop=50)
+
+        # The limit of 0.3 km takes the settlements at 0.15 and 0.25 km, the one at 0.05 km is too small
+        assert list(sp.df[SET_ELEC_CURRENT]) == [1, 1, 1, 0, 0, 0]
+        assert elec_modelled == approx(1300 / total_pop)
+        assert sp.df[SET_ELEC_POP_CALIB][2] == 200
+
+    def test_electrify_closest_max_steps(self, setup_settlementprocessor):
+        """Without reaching the rate, the settlements within the last limit are electrified
+        """
+        sp = setup_settlementprocessor
+        total_pop = sp.df[SET_POP_CALIB].sum()
+
+        elec_modelled = sp.electrify_closest(1000, total_pop, 0.99, min_pop=50, max_steps=5)
+
+        assert list(sp.df[SET_ELEC_CURRENT]) == [1, 1, 1, 1, 0, 0]
+        assert elec_modelled == approx(1600 / total_pop)
@@ -0,0 +1,209 @@
+import sys
+from types import ModuleType
+
+from onsset import SettlementProcessor, Technology
+from onsset.runner import extend_grids_gis
+
+import numpy as np
+from pandas import DataFrame
+from pytest import fixture
+
+
+@fixture
+def setup_grid_calc() -> Technology:
+    Technology.set_default_values(base_year=2018, start_year=2018, end_year=2030, discount_rate=0.08)
+
+    return Technology(om_of_td_lines=0.1,
+                      distribution_losses=0.08,
+                      connection_cost_per_hh=150,
+                      base_to_peak_load_ratio=0.8,
+                      capacity_factor=1,
+                      tech_life=30,
+                      grid_capacity_investment=2000,
+                      grid_price=0.07)
+
+
+@fixture
+def setup_settlementprocessor() -> SettlementProcessor:
+    """A 5 x 5 square of settlements about 1.1 km apart, the first row of which is electrified
+
+    The off-grid LCOE is such that the grid only reaches a settlement from its neighbour in the row before, so the
+    rounds and the heap extend the grid the same way, one row at a time.
+    """
+    side = 5
+    x, y = np.meshgrid(np.arange(side) * 0.01, np.arange(side) * 0.01)
+
+    sp = SettlementProcessor.__new__(SettlementProcessor)
+    sp.df = DataFrame({'X_deg': x.ravel(),
+                       'Y_deg': y.ravel(),
+                       'Pop2025': 500.,
+                       'NewConnections2025': 500.,
+                       'NumPeoplePerHH': 5.,
+                       'EnergyPerSettlement2025': 50000.,
+                       'TotalEnergyPerCell': 50000.,
+                       'GridCellArea': 1.,
+                       'GridPenalty': 1.,
+                       'FinalElecCode2018': np.where(np.arange(side * side) < side, 1, 99),
+                       'ElectrificationOrder': 0,
+                       'Minimum_LCOE_Off_grid2025': 0.47,
+                       'Grid2025': 99.,
+                       'MVConnectDist': 0.,
+                       'PlannedMVLineDist': 500.,
+                       'PlannedHVLineDist': 2000.,
+                       'ClosestGrid': 'Ouest'})
+    return sp
+
+
+class TestGridLcoe:
+
+    def test_demand_change(self, setup_settlementprocessor, setup_grid_calc):
+        """The grid LCOE follows a change of the demand columns, with the distribution network recalculated
+        """
+        sp = setup_settlementprocessor
+        dist = np.full(len(sp.df), 1.1)
+
+        before, _ = sp.get_grid_lcoe(dist, 1, 0, 2025, 7, 2030, setup_grid_calc)
+        sp.df['EnergyPerSettlement2025'] *= 5
+        sp.df['TotalEnergyPerCell'] *= 5
+        after, _ = sp.get_grid_lcoe(dist, 1, 0, 2025, 7, 2030, setup_grid_calc)
+
+        grid_calc = Technology(**{name: getattr(setup_grid_calc, name)
+                                  for name in ['om_of_td_lines', 'distribution_losses', 'connection_cost_per_hh',
+                                               'base_to_peak_load_ratio', 'capacity_factor', 'tech_life',
+                                               'grid_capacity_investment', 'grid_price']})
+        expected, _ = sp.get_grid_lcoe(dist, 1, 0, 2025, 7, 2030, grid_calc)
+        assert np.array_equal(after[0].values, expected[0].values)
+        assert not np.allclose(after[0].values, before[0].values)
+
+
+class TestHeapExtension:
+
+    @staticmethod
+    def extend(sp, grid_calc, extension_mode, grid_connect_limit=1e9):
+        return sp.elec_extension(grid_calc, max_dist=50, year=2025, start_year=2018, end_year=2030, time_step=7,
+                                 grid_capacity_limit=1e9, grid_connect_limit=grid_connect_limit,
+                                 new_investment=np.zeros(len(sp.df)), extension_mode=extension_mode)
+
+    def test_heap_agrees_with_rounds(self, setup_settlementprocessor, setup_grid_calc):
+        """Where each settlement can only be reached from one row, the heap gives the results of the rounds
+        """
+        sp = setup_settlementprocessor
+
+        rounds = self.extend(sp, setup_grid_calc, 'rounds')
+        heap = self.extend(sp, setup_grid_calc, 'heap')
+
+        for expected, actual in zip(rounds, heap):
+            assert np.allclose(np.asarray(expected, dtype=float), np.asarray(actual, dtype=float))
+        assert list(np.asarray(heap[2])) == list(np.repeat(np.arange(5), 5))
+        assert (np.asarray(heap[0])[5:] < 99).all()
+
+    def test_limits_in_pop_order(self, setup_settlementprocessor, setup_grid_calc):
+        """The connection limit is used up by the most beneficial connections first, and the extension stops at the
+        first settlement that exceeds it
+        """
+        sp = setup_settlementprocessor
+        # The grid saves the most off-grid cost in the last settlement of the second row
+        sp.df.loc[9, 'Minimum_LCOE_Off_grid2025'] = 0.6
+
+        # 100 households per settlement, enough for two settlements
+        new_lcoes, _, elecorder, _, _ = self.extend(sp, setup_grid_calc, 'heap', grid_connect_limit=250)
+
+        assert list(np.where(np.asarray(new_lcoes) < 99)[0]) == [5, 9]
+        assert list(np.asarray(elecorder)[[5, 9]]) == [1, 1]
+
+    def test_neighbours(self, setup_settlementprocessor, setup_grid_calc):
+        """The neighbours queued after a connection do not include the connected settlement itself
+
+        On a line of settlements closer and closer together, the nearest other settlement of each is the next one. The
+        grid only reaches the first from the electrified end of the line, and the others through their neighbour.
+        """
+        sp = setup_settlementprocessor
+        sp.df = sp.df.iloc[:6].copy()
+        sp.df['X_deg'] = [0, 0.010, 0.019, 0.027, 0.034, 0.040]
+        sp.df['Y_deg'] = 0.
+        sp.df['FinalElecCode2018'] = [1, 99, 99, 99, 99, 99]
+
+        for neighbours in [1, 10]:
+            new_lcoes, _, elecorder, _, _ = sp.elec_extension(setup_grid_calc, max_dist=50, year=2025,
+                                                              start_year=2018, end_year=2030, time_step=7,
+                                                              grid_capacity_limit=1e9, grid_connect_limit=1e9,
+                                                              new_investment=np.zeros(len(sp.df)),
+                                                              extension_mode='heap', neighbours=neighbours)
+
+            assert list(np.where(np.asarray(new_lcoes) < 99)[0]) == [1, 2, 3, 4, 5]
+            assert list(np.asarray(elecorder)) == [0, 1, 2, 3, 4, 5]
+
+        # A single candidate has no neighbours to queue
+        sp.df = sp.df.iloc[:2].copy()
+        new_lcoes, _, elecorder, _, _ = self.extend(sp, setup_grid_calc, 'heap')
+        assert list(np.asarray(elecorder)) == [0, 1]
+
+    def test_unchanged_without_candidates_or_sources(self, setup_settlementprocessor, setup_grid_calc):
+        sp = setup_settlementprocessor
+        size = len(sp.df)
+        state = dict(elecorder=np.zeros(size), cell_path_real=np.zeros(size), cell_path_adjusted=np.zeros(size),
+                     new_lcoes=np.full(size, 99.), new_investment=np.zeros(size))
+
+        for unelectrified, electrified in [([], np.where(np.arange(size) < 5, 1, 0)),
+                                           (list(range(5, size)), np.zeros(size))]:
+            cell_path_real, cell_path_adjusted, elecorder, new_lcoes, new_investment = \
+                sp.heap_extension(setup_grid_calc, max_dist=50, year=2025, time_step=7, end_year=2030,
+                                  grid_capacity_limit=1e9, grid_connect_limit=1e9, unelectrified=unelectrified,
+                                  electrified=electrified, grid_name='Ouest', **state)
+
+            assert np.array_equal(cell_path_real, state['cell_path_real'])
+            assert np.array_equal(cell_path_adjusted, state['cell_path_adjusted'])
+            assert np.array_equal(elecorder, state['elecorder'])
+            assert np.array_equal(new_lcoes, state['new_lcoes'])
+            assert np.array_equal(new_investment, state['new_investment'])
+
+
+def fake_find_grid_path(df, year, time_step, start_year, max_connections, max_capacity, gis_costs_folder, grid,
+                        mv_line_max_length, results_folder, full=True, state=None):
+    """Stands in for onsset_gis.find_grid_path, with extension distances that depend on the settlements it is given"""
+    state['rows'].append(len(df))
+    df['extension_distance_{}'.format(year)] = np.where(df['FinalElecCode2018'] == 1, 99,
+                                                        np.arange(len(df)) % 4 * 1.1)
+    return df
+
+
+class TestExtendGridsGis:
+
+    @fixture
+    def setup_two_grids(self, setup_settlementprocessor, monkeypatch) -> SettlementProcessor:
+        """The settlements split between two grids, with the pathfinder replaced by fake_find_grid_path"""
+        onsset_gis = ModuleType('onsset_gis')
+        onsset_gis.find_grid_path = fake_find_grid_path
+        monkeypatch.setitem(sys.modules, 'onsset_gis', onsset_gis)
+
+        sp = setup_settlementprocessor
+        sp.df['ClosestGrid'] = np.where(np.arange(len(sp.df)) % 3 == 0, 'Sud', 'Ouest')
+        sp.df['id'] = np.arange(len(sp.df))
+        return sp
+
+    @staticmethod
+    def extend_grids(settlements, grid_calc, grid_workers):
+        sp = SettlementProcessor.__new__(SettlementProcessor)
+        sp.df = settlements.copy()
+        raster_states = {'Ouest': {'rows': []}, 'Sud': {'rows': []}}
+        grid_tasks = [('Ouest', grid_calc, 1e9, 1e9), ('Sud', grid_calc, 1e9, 1e9)]
+        grid_investment = extend_grids_gis(sp, grid_tasks, year=2025, time_step=7, start_year=2018, end_year=2030,
+                                           gis_cost_folder='', max_grid_extension_dist=50, out_folder='',
+                                           save_shapefiles=False, raster_states=raster_states,
+                                           grid_workers=grid_workers)
+        return sp.df, grid_investment, raster_states
+
+    def test_workers_agree(self, setup_two_grids, setup_grid_calc):
+        """The grids only see their own settlements, so the results do not depend on the number of processes
+        """
+        settlements = setup_two_grids.df
+
+        sequential, sequential_investment, sequential_states = self.extend_grids(settlements, setup_grid_calc, 1)
+        parallel, parallel_investment, parallel_states = self.extend_grids(settlements, setup_grid_calc, 2)
+
+        assert sequential.equals(parallel)
+        assert np.array_equal(sequential_investment, parallel_investment)
+        assert sequential_states == parallel_states == {'Ouest': {'rows': [16]}, 'Sud': {'rows': [9]}}
+        # The second grid keeps the electrification order given to the settlements of the first grid
+        assert (sequential.loc[sequential['ClosestGrid'] == 'Ouest', 'ElectrificationOrder2025'] > 0).any()
+        assert (sequential.loc[sequential['ClosestGrid'] == 'Sud', 'ElectrificationOrder2025'] > 0).any()
@@ -2,7 +2,7 @@ import os
 
 from onsset import SettlementProcessor
 
-from pandas import DataFrame , Series
+from pandas import DataFrame , Series, cut
 from pandas.testing import assert_frame_equal, assert_series_equal
 from pytest import fixture
 
@@ -49,4 +49,16 @@ class TestSettlementProcessor:
             
         # check_less_precise ensures that it does not consider
         assert_series_equal(actual, expected)
-       
\ No newline at end of file
+       
+    def test_classify_bins(self, setup_settlementprocessor: SettlementProcessor):
+        """The classes match pandas.cut, including the bin edges and the values outside the bins
+        """
+        sp = setup_settlementprocessor
+        values = Series([-1, 0, 0.5, 1, 3, 10, 12.5])
+
+        for include_lowest in [True, False]:
+            actual = sp.classify_bins(values.values, [0, 1, 10, float("inf")], [3, 2, 1], include_lowest)
+            expected = cut(values, [0, 1, 10, float("inf")], labels=[3, 2, 1],
+                           include_lowest=include_lowest).astype(float)
+
+            assert_series_equal(Series(actual), expected)
@@ -0,0 +1,48 @@
+import json
+import os
+
+from onsset.instrumentation import StageTrace
+
+from pytest import fixture
+
+
+class TestStageTrace:
+
+    @fixture
+    def setup_trace(self) -> StageTrace:
+        trace = StageTrace()
+        with trace.stage('set_scenario_variables', rows=10, year=2025):
+            sum(range(1000))
+
+        @trace.timed('summaries')
+        def summaries():
+            return 'summary'
+
+        assert summaries() == 'summary'
+        return trace
+
+    def test_records(self, setup_trace):
+        """A record per stage, with its labels and the time it took
+        """
+        actual = setup_trace.to_frame()
+
+        assert list(actual.columns) == ['stage', 'year', 'rows', 'start', 'wall_time', 'cpu_time', 'peak_rss_delta']
+        assert list(actual['stage']) == ['set_scenario_variables', 'summaries']
+        assert actual['year'][0] == 2025
+        assert actual['rows'][0] == 10
+        assert (actual['wall_time'] >= 0).all()
+        assert actual['start'][1] >= actual['start'][0]
+
+    def test_write(self, setup_trace, tmp_path):
+        csv_path = os.path.join(tmp_path, 'trace.csv')
+        json_path = os.path.join(tmp_path, 'trace.json')
+
+        setup_trace.write(csv_path)
+        setup_trace.write(json_path)
+
+        with open(json_path) as trace:
+            records = json.load(trace)
+        assert [record['stage'] for record in records] == ['set_scenario_variables', 'summaries']
+        assert records[1]['year'] is None
+        with open(csv_path) as trace:
+            assert trace.readline().startswith('stage,year,rows')
@@ -0,0 +1,49 @@
+import os
+
+from onsset import SettlementProcessor, SET_GHI, SET_POP
+
+from pandas.testing import assert_frame_equal
+from pytest import fixture, mark
+
+
+class TestSettlementProcessor:
+
+    @fixture
+    def setup_settlementprocessor(self) -> SettlementProcessor:
+        csv_path = os.path.join('test', 'test_data', 'dj-test.csv')
+        return SettlementProcessor(csv_path)
+
+    @mark.parametrize('extension', ['.parquet', '.feather', '.csv'])
+    def test_write_and_read_settlements(self, setup_settlementprocessor, tmp_path, extension):
+        """The settlements come back unchanged from each format
+        """
+        sp = setup_settlementprocessor
+        path = str(tmp_path / ('settlements' + extension))
+
+        SettlementProcessor.write_settlements(sp.df, path)
+        actual = SettlementProcessor(path)
+
+        assert_frame_equal(actual.df, sp.df, check_exact=False)
+
+    def test_read_columns(self, setup_settlementprocessor, tmp_path):
+        """Only the requested columns are loaded
+        """
+        sp = setup_settlementprocessor
+        path = str(tmp_path / 'settlements.parquet')
+        SettlementProcessor.write_settlements(sp.df, path)
+
+        actual = SettlementProcessor(path, columns=[SET_POP, SET_GHI])
+
+        assert list(actual.df.columns) == [SET_POP, SET_GHI]
+
+    def test_copy(self, setup_settlementprocessor):
+        """Changes to a copy leave the loaded settlements unchanged
+        """
+        sp = setup_settlementprocessor
+        expected = sp.df.copy()
+
+        scenario = sp.copy()
+        scenario.df.loc[0, SET_POP] = -1
+        scenario.df['HealthDemand'] = 1
+
+        assert_frame_equal(sp.df, expected)
@@ -0,0 +1,117 @@
+from onsset import Technology
+
+import numpy as np
+from pandas import Series
+from pytest import fixture, approx
+
+
+class TestTechnology:
+
+    @fixture
+    def setup_technologies(self):
+        Technology.set_default_values(base_year=2018, start_year=2018, end_year=2030, discount_rate=0.08)
+
+        mg_pv_calc = Technology(om_of_td_lines=0.02,
+                                distribution_losses=0.05,
+                                connection_cost_per_hh=92,
+                                base_to_peak_load_ratio=0.85,
+                                tech_life=25,
+                                om_costs=0.015,
+                                capital_cost={float("inf"): 2950},
+                                mini_grid=True)
+
+        mg_diesel_calc = Technology(om_of_td_lines=0.02,
+                                    distribution_losses=0.05,
+                                    connection_cost_per_hh=92,
+                                    base_to_peak_load_ratio=0.85,
+                                    capacity_factor=0.7,
+                                    tech_life=20,
+                                    om_costs=0.1,
+                                    capital_cost={float("inf"): 672},
+                                    mini_grid=True)
+
+        sa_pv_calc = Technology(base_to_peak_load_ratio=0.9,
+                                tech_life=25,
+                                om_costs=0.02,
+                                capital_cost={float("inf"): 6950,
+                                              1: 4470,
+                                              0.100: 6380,
+                                              0.050: 8780,
+                                              0.020: 9620},
+                                standalone=True)
+
+        return [mg_pv_calc, mg_diesel_calc, sa_pv_calc]
+
+    @fixture
+    def setup_inputs(self):
+        inputs = {'energy_per_cell': Series([1000., 25000., 0.]),
+                  'people': Series([50., 800., 20.]),
+                  'num_people_per_hh': Series([5., 5., 5.]),
+                  'start_year': 2025,
+                  'end_year': 2030,
+                  'new_connections': Series([50., 300., 0.]),
+                  'total_energy_per_cell': Series([1000., 60000., 500.]),
+                  'prev_code': Series([99, 1, 3]),
+                  'grid_cell_area': Series([1., 2.5, 0.5])}
+        return inputs
+
+    def test_get_lcoes(self, setup_technologies, setup_inputs):
+        """The batched evaluation gives the same results as calling get_lcoe for each technology
+        """
+        tech_inputs = [{'capacity_factor': Series([0.2, 0.2, 0.2])},
+                       {'fuel_cost': Series([0.3, 0.4, 0.5])},
+                       {'capacity_factor': Series([0.2, 0.2, 0.2])}]
+
+        actual_lcoes, actual_investments = Technology.get_lcoes(setup_technologies, tech_inputs=tech_inputs,
+                                                                **setup_inputs)
+
+        assert actual_lcoes.shape == (3, 3)
+        for i, (tech, inputs) in enumerate(zip(setup_technologies, tech_inputs)):
+            expected_lcoe, expected_investment = tech.get_lcoe(**setup_inputs, **inputs)
+            assert actual_lcoes[:, i] == approx(expected_lcoe[0].values)
+            assert actual_investments[:, i] == approx(expected_investment[0].values)
+
+    def test_discount_factor_sums(self):
+        """A tech life shorter than the project life gives a re-investment and a salvage value
+        """
+        investment, salvage, generation = Technology.discount_factor_sums(10, 2, 13, 0.1)
+
+        discount_factor = 1.1 ** np.arange(13)
+        assert investment == approx(1 / discount_factor[2] + 1 / discount_factor[12])
+        assert salvage == approx((1 - 1 / 10) / discount_factor[12])
+        assert generation == approx(np.sum(1 / discount_factor[2:]))
+
+    def test_cached_distribution_networks(self, setup_technologies, setup_inputs):
+        """The distribution network is reused for the same demand and recalculated when the demand changes, also in
+        place
+        """
+        mg_pv_calc = setup_technologies[0]
+        demand = {name: setup_inputs[name] for name in ['people', 'new_connections', 'total_energy_per_cell',
+                                                        'energy_per_cell', 'num_people_per_hh', 'grid_cell_area']}
+
+        first = mg_pv_calc.cached_distribution_networks(**demand)
+
+        assert mg_pv_calc.cached_distribution_networks(**{name: values.copy() for name, values in demand.items()}) \
+            is first
+
+        demand['energy_per_cell'] *= 5
+        demand['total_energy_per_cell'] *= 5
+        second = mg_pv_calc.cached_distribution_networks(**demand)
+
+        assert second is not first
+        for actual, expected in zip(second, mg_pv_calc.distribution_networks(**demand)):
+            for actual_values, expected_values in zip(actual, expected):
+                assert np.asarray(actual_values) == approx(np.asarray(expected_values))
+
+    def test_get_lcoe_rows(self, setup_technologies, setup_inputs):
+        """Only the rows are calculated and written into out, the other settlements keep their values
+        """
+        mg_pv_calc = setup_technologies[0]
+        out = np.array([99., 99., 99.]), np.zeros(3)
+
+        actual_lcoe, actual_investment = mg_pv_calc.get_lcoe(**setup_inputs, capacity_factor=0.2,
+                                                             rows=np.array([0, 2]), out=out)
+
+        expected_lcoe, expected_investment = mg_pv_calc.get_lcoe(**setup_inputs, capacity_factor=0.2)
+        assert actual_lcoe[0].values == approx([expected_lcoe[0][0], 99, expected_lcoe[0][2]])
+        assert actual_investment[0].values == approx([expected_investment[0][0], 0, expected_investment[0][2]])
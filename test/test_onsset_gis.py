@@ -0,0 +1,238 @@
+"""Tests of the helpers of the pathfinder grid extension, which need rasterio, geopandas and scikit-image
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from pytest import fixture
+
+pytest.importorskip('rasterio')
+pytest.importorskip('geopandas')
+pytest.importorskip('skimage')
+
+import geopandas as gpd  # noqa: E402
+import rasterio  # noqa: E402
+from rasterio.features import rasterize  # noqa: E402
+from rasterio.transform import from_origin  # noqa: E402
+
+from onsset.onsset_gis import (GridRasterState, burn_points, create_geodataframe, find_grid_path,  # noqa: E402
+                               grid_bounds, pixel_indices, raster_window, scatter_distances)
+
+RESOLUTION = 2000.
+SHAPE = (60, 70)
+
+
+@fixture
+def setup_settlements():
+    """The dj-test settlements, with their position in EPSG:3395"""
+    df = create_geodataframe(pd.read_csv(os.path.join('test', 'test_data', 'dj-test.csv')))
+    projected = df.geometry.to_crs('EPSG:3395')
+    return df, projected
+
+
+def rasterize_points(projected, values, affine):
+    """Burns the points the way find_grid_path did before pixel_indices and burn_points"""
+    return rasterize([(geometry, value) for geometry, value in zip(projected, values)], out_shape=SHAPE, fill=0,
+                     default_value=0, all_touched=True, transform=affine)
+
+
+class TestBurnPoints:
+
+    @pytest.mark.parametrize('origin', ['median', 'settlement'])
+    def test_rasterize(self, setup_settlements, origin):
+        """The pixels burnt from the pixel indices are those rasterize burns, with the same values
+
+        With the raster around the median settlement, many settlements are outside it and several fall in the same
+        pixel. With its origin on a settlement, that settlement lies on the corner of four pixels.
+        """
+        df, projected = setup_settlements
+        if origin == 'median':
+            affine = from_origin(np.median(projected.x) - 40 * RESOLUTION, np.median(projected.y) + 40 * RESOLUTION,
+                                 RESOLUTION, RESOLUTION)
+        else:
+            affine = from_origin(projected.x[0] - 20 * RESOLUTION, projected.y[0] + 20 * RESOLUTION, RESOLUTION,
+                                 RESOLUTION)
+
+        rows, cols = pixel_indices(df, affine, SHAPE)
+        inside = rows >= 0
+        assert 0 < inside.sum() < len(df)
+        assert (cols[~inside] == -1).all()
+
+        max_dist = df['Pop'].values
+        ids = df['id'].values
+        burnt_max_dist, burnt_ids = burn_points(rows[inside], cols[inside], SHAPE, [max_dist[inside], ids[inside]])
+
+        assert np.array_equal(burnt_max_dist, rasterize_points(projected, max_dist, affine))
+        assert np.array_equal(burnt_ids, rasterize_points(projected, ids, affine))
+
+    @pytest.mark.parametrize('col, row', [(0, 0), (69.5, 10), (70, 10), (35, 60), (70, 60)])
+    def test_raster_edges(self, setup_settlements, col, row):
+        """A settlement on the left or top edge of the raster is in its first pixel, and one on the right or bottom
+        edge is outside it, as with rasterize
+        """
+        df, projected = setup_settlements
+        df, projected = df.iloc[:1], projected.iloc[:1]
+        affine = from_origin(projected.x[0] - col * RESOLUTION, projected.y[0] + row * RESOLUTION, RESOLUTION,
+                             RESOLUTION)
+
+        rows, cols = pixel_indices(df, affine, SHAPE)
+        inside = rows >= 0
+        burnt, = burn_points(rows[inside], cols[inside], SHAPE, [np.ones(inside.sum())])
+
+        assert np.array_equal(burnt, rasterize_points(projected, [1.], affine))
+        assert inside[0] == (col < SHAPE[1] and row < SHAPE[0])
+
+
+def merge_distances(df, column, distance, id_raster):
+    """Writes the extension distances the way find_grid_path did before scatter_distances"""
+    ext_distances = pd.DataFrame()
+    ext_distances['id'] = np.extract(distance > 0, id_raster).tolist()
+    ext_distances['distance'] = np.extract(distance > 0, distance).tolist()
+
+    df = df.merge(ext_distances, on='id', how='left')
+    df[column] = np.where(df['distance'] > 0, df['distance'], df[column])
+    del df['distance']
+    return df
+
+
+class TestScatterDistances:
+
+    def test_merge(self):
+        """The distances are written to the settlements the merge on id wrote them to
+
+        Some settlements are not in the id raster, some targets are not connected (zero distance), and some ids of
+        the raster are not among the settlements.
+        """
+        rng = np.random.default_rng(0)
+        size = 200
+        df = pd.DataFrame({'id': rng.permutation(np.arange(1, size + 1)), 'extension_distance_2025': 99.},
+                          index=rng.permutation(size))
+        df.loc[df.index[:20], 'extension_distance_2025'] = rng.uniform(1, 5, 20)
+
+        # Three quarters of the settlements and 30 unknown ids, in random pixels of a 30 x 30 raster
+        ids = np.concatenate([rng.choice(df['id'], size * 3 // 4, replace=False), np.arange(1, 31) + 1000])
+        id_raster = np.zeros((30, 30), dtype=np.int64)
+        id_raster.flat[rng.choice(id_raster.size, len(ids), replace=False)] = ids
+        # Half the targets connected
+        distance = np.where((id_raster > 0) & (rng.uniform(size=id_raster.shape) < 0.5),
+                            rng.uniform(0.1, 10, id_raster.shape), 0)
+
+        expected = merge_distances(df, 'extension_distance_2025', distance, id_raster)
+        scatter_distances(df, 'extension_distance_2025', distance, id_raster, pd.Index(df['id'].values))
+
+        assert np.array_equal(df['id'].values, expected['id'].values)
+        assert np.array_equal(df['extension_distance_2025'].values, expected['extension_distance_2025'].values)
+        # The test covers each case
+        connected = np.isin(df['id'], id_raster[distance > 0])
+        unconnected = np.isin(df['id'], id_raster[(distance == 0) & (id_raster > 0)])
+        assert connected.any() and unconnected.any() and (~connected & ~unconnected).any()
+        assert not np.isin(id_raster[distance > 0], df['id']).all()
+
+
+@fixture
+def setup_grid_rasters(tmp_path):
+    """Cost rasters of a 'Nord' grid in a temporary folder, 40 x 40 pixels of 1 km with the existing network along
+    the middle row, and 60 settlements scattered over them
+    """
+    rng = np.random.default_rng(1)
+    affine = from_origin(4700000, 1350000, 1000, 1000)
+    meta = dict(driver='GTiff', height=40, width=40, count=1, dtype='float64', crs='EPSG:3395', transform=affine)
+
+    power = np.ones((40, 40))
+    power[20, 5:15] = 0
+    for name, raster in [('Nord_final_cost.tif', rng.uniform(20, 60, (40, 40))), ('Nord_power_cost.tif', power)]:
+        with rasterio.open(tmp_path / name, 'w', **meta) as dst:
+            dst.write(raster, indexes=1)
+
+    size = 60
+    points = gpd.GeoSeries(gpd.points_from_xy(*(affine * (rng.uniform(2, 38, size), rng.uniform(2, 38, size)))),
+                           crs='EPSG:3395').to_crs('EPSG:4326')
+    settlements = create_geodataframe(pd.DataFrame({'X_deg': points.x, 'Y_deg': points.y}))
+    settlements['id'] = np.arange(size)
+    settlements['MaxDist'] = rng.uniform(5, 30, size)
+    settlements['PlannedHVLineDist'] = 10.
+    settlements['NumPeoplePerHH'] = 5.
+    settlements['GridCapacityRequired'] = 10.
+    settlements['FinalElecCode2020'] = 99
+    for year in [2025, 2030]:
+        settlements['PreScreening{}'.format(year)] = 1
+        settlements['NewConnections{}'.format(year)] = 500.
+    return settlements, tmp_path
+
+
+class TestGridRasterState:
+
+    @staticmethod
+    def extend(df, year, state, folder, export_rasters=False):
+        return find_grid_path(df, year, time_step=5, start_year=2020, max_connections=1e9, max_capacity=1e9,
+                              gis_costs_folder=str(folder), grid='Nord', mv_line_max_length=50,
+                              results_folder=str(folder), full=False, state=state, export_rasters=export_rasters)
+
+    def test_geotiff_round_trip(self, setup_grid_rasters):
+        """The rasters carried in memory to the next year are those find_grid_path read back from the GeoTIFF files
+        it wrote: the origins and the MV distance of the previous year, and the cost weights read again
+        """
+        settlements, folder = setup_grid_rasters
+
+        state = GridRasterState(str(folder), 'Nord')
+        first = self.extend(settlements.copy(), 2025, state, folder, export_rasters=True)
+        assert (first['extension_distance_2025'] < 99).any()
+        assert (first['extension_distance_2025'] == 99).any()
+
+        # The settlements connected in the first year are no targets in the second
+        first['FinalElecCode2025'] = np.where(first['extension_distance_2025'] < 99, 1, 99)
+
+        read_back = GridRasterState(str(folder), 'Nord')
+        with rasterio.open(folder / 'Nord_origins_2025.tif') as origins:
+            read_back.origins = origins.read(1)
+        with rasterio.open(folder / 'Nord_extension_distance_2025.tif') as mv_distance:
+            read_back.mv_distance = mv_distance.read(1)
+
+        assert np.array_equal(state.weights, read_back.weights)
+        assert np.array_equal(state.origins, read_back.origins)
+        assert np.array_equal(state.mv_distance, read_back.mv_distance)
+        assert state.origins.sum() > 10
+
+        carried = self.extend(first.copy(), 2030, state, folder)
+        expected = self.extend(first.copy(), 2030, read_back, folder)
+
+        assert (carried['extension_distance_2030'] < 99).any()
+        assert np.array_equal(carried['extension_distance_2030'], expected['extension_distance_2030'])
+        assert np.array_equal(state.origins, read_back.origins)
+        assert np.array_equal(state.mv_distance, read_back.mv_distance)
+
+
+class TestRasterWindow:
+
+    def test_window(self, setup_grid_rasters):
+        """The window is snapped outwards to whole pixels and clipped to the raster"""
+        _, folder = setup_grid_rasters
+        with rasterio.open(folder / 'Nord_final_cost.tif') as src:
+            assert raster_window(src, None) is None
+
+            window = raster_window(src, (4705500, 1320200, 4712000, 1331000))
+            assert (window.col_off, window.row_off, window.width, window.height) == (5, 19, 7, 11)
+
+            window = raster_window(src, (4690000, 1300000, 4720500, 1360000))
+            assert (window.col_off, window.row_off, window.width, window.height) == (0, 0, 21, 40)
+
+    def test_windowed_state(self, setup_grid_rasters):
+        """The rasters of a windowed state are the part of the whole rasters within the window, placed by its
+        transform
+        """
+        settlements, folder = setup_grid_rasters
+        settlements['ClosestGrid'] = np.where(settlements.geometry.to_crs('EPSG:3395').x < 4720000, 'Nord', 'Sud')
+
+        whole = GridRasterState(str(folder), 'Nord')
+        windowed = GridRasterState(str(folder), 'Nord', grid_bounds(settlements, 'Nord', 3))
+        col_off, row_off = ~whole.meta['transform'] * (windowed.meta['transform'].c, windowed.meta['transform'].f)
+        rows = slice(int(row_off), int(row_off) + windowed.meta['height'])
+        cols = slice(int(col_off), int(col_off) + windowed.meta['width'])
+
+        assert col_off == 0 and windowed.meta['width'] < whole.meta['width']
+        assert np.array_equal(windowed.weights, whole.weights[rows, cols])
+        assert np.array_equal(windowed.origins, whole.origins[rows, cols])
+        assert windowed.mv_distance.shape == windowed.weights.shape
+        assert grid_bounds(settlements, 'Est', 3) is None
@@ -0,0 +1,61 @@
+from onsset.pathfinder import seek
+
+import numpy as np
+from pytest import fixture, approx, raises
+
+
+class TestPathfinder:
+
+    @fixture
+    def setup_grid(self):
+        n = 12
+        origins = np.zeros((n, n), dtype=np.int64)
+        origins[6, 1:5] = 1
+        targets = np.zeros((n, n))
+        targets[2, 9] = 40
+        targets[9, 8] = 40
+        weights = np.ones((n, n))
+        weights[4:8, 6] = 5
+        new_connections = np.where(targets > 0, 10., 0.)
+        new_capacity = np.where(targets > 0, 2., 0.)
+        return origins, targets, weights, new_connections, new_capacity
+
+    def test_seek(self, setup_grid):
+        """The targets are connected and the distance grows by one per straight step on unit weights
+        """
+        origins, targets, weights, new_connections, new_capacity = setup_grid
+
+        results = seek(origins, np.zeros(origins.shape), new_connections, 1e9, new_capacity, 1e9,
+                       np.zeros(origins.shape), targets=targets, weights=weights, path_handling='link')
+
+        assert results['paths'][2, 9] == 1
+        assert results['paths'][9, 8] == 1
+        assert results['mv_distance_new'][2, 9] > 0
+        assert results['distance'][5, 1] == approx(1.)
+        assert results['new_connections_remaining'] == approx(1e9 - 20)
+
+    def test_seek_debug(self, setup_grid):
+        """The compiled search gives the same paths as the search driven from Python
+        """
+        origins, targets, weights, new_connections, new_capacity = setup_grid
+        compiled = seek(origins.copy(), np.zeros(origins.shape), new_connections, 1e9, new_capacity, 1e9,
+                        np.zeros(origins.shape), targets=targets.copy(), weights=weights.copy())
+        python = seek(origins.copy(), np.zeros(origins.shape), new_connections, 1e9, new_capacity, 1e9,
+                      np.zeros(origins.shape), targets=targets.copy(), weights=weights.copy(), debug=True)
+
+        assert np.array_equal(compiled['paths'], python['paths'])
+        assert np.array_equal(compiled['mv_distance_new'], python['mv_distance_new'])
+
+    def test_seek_edge(self, setup_grid):
+        """Origins and targets on the edge of the grid, where the search can't go beyond, are rejected
+        """
+        origins, targets, weights, new_connections, new_capacity = setup_grid
+        edge_origins = origins.copy()
+        edge_origins[6, 0] = 1
+        edge_targets = targets.copy()
+        edge_targets[11, 5] = 40
+
+        for points in [dict(origins=edge_origins, targets=targets), dict(origins=origins, targets=edge_targets)]:
+            with raises(ValueError):
+                seek(points['origins'], np.zeros(origins.shape), new_connections, 1e9, new_capacity, 1e9,
+                     np.zeros(origins.shape), targets=points['targets'], weights=weights)
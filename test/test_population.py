@@ -0,0 +1,41 @@
+import os
+
+from onsset import SettlementProcessor, SET_POP, SET_POP_CALIB, SET_URBAN
+
+import numpy as np
+from pytest import fixture, approx
+
+
+class TestPopulation:
+
+    @fixture
+    def setup_settlementprocessor(self) -> SettlementProcessor:
+        csv_path = os.path.join('test', 'test_data', 'dj-test.csv')
+        sp = SettlementProcessor(csv_path)
+        sp.df[SET_POP_CALIB] = sp.df[SET_POP] * 1.5
+        return sp
+
+    def test_project_pop(self, setup_settlementprocessor):
+        """Urban settlements grow at the urban rate and the others at the rural rate
+        """
+        sp = setup_settlementprocessor
+
+        actual = sp.project_pop([2020, 2025, 2030], 2020, 1.05, 1.02)
+
+        urban = sp.df[SET_URBAN] > 1
+        assert list(actual.columns) == [2020, 2025, 2030]
+        assert actual[2020].values == approx(sp.df[SET_POP_CALIB].values)
+        assert actual.loc[urban, 2030].values == approx(sp.df.loc[urban, SET_POP_CALIB].values * 1.05 ** 10)
+        assert actual.loc[~urban, 2025].values == approx(sp.df.loc[~urban, SET_POP_CALIB].values * 1.02 ** 5)
+
+    def test_project_pop_and_urban(self, setup_settlementprocessor):
+        """The projected columns add up to the future population
+        """
+        sp = setup_settlementprocessor
+        sp.df[SET_URBAN] = np.where(sp.df.index % 2 == 0, 2, 0)
+        urban = sp.df.loc[sp.df[SET_URBAN] == 2, SET_POP_CALIB].sum() / sp.df[SET_POP_CALIB].sum()
+
+        sp.project_pop_and_urban(2 * sp.df[SET_POP_CALIB].sum(), urban, 2020, 2030, 2025)
+
+        assert sp.df[SET_POP + '2030High'].sum() == approx(2 * sp.df[SET_POP_CALIB].sum())
+        assert np.array_equal(sp.df[SET_POP + '2020'].values, sp.df[SET_POP_CALIB].values)
@@ -10,11 +10,16 @@ changes the contents of the output files.
 """
 
 import filecmp
+import multiprocessing
 import os
 from shutil import copyfile
 from tempfile import TemporaryDirectory
 
-from onsset.runner import calibration, scenario
+from onsset.runner import _fork_map, calibration, scenario
+
+import numpy as np
+import pandas as pd
+import pytest
 
 
 def run_analysis(tmpdir):
@@ -65,6 +70,47 @@ def test_regression_summary():
     assert full
 
 
+def add_to_first(values, increment):
+    values[0] += increment
+    if increment < 0:
+        raise ValueError('negative increment')
+    return values[0]
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='processes cannot be forked')
+def test_fork_map():
+    """Each task starts from the arguments as they are in this process, whatever the other tasks write to them
+
+    """
+    values = np.zeros(1000)
+
+    assert _fork_map(add_to_first, [(values, increment) for increment in range(1, 6)], 2) == [1, 2, 3, 4, 5]
+    assert values[0] == 0
+
+    with pytest.raises(ValueError, match='negative increment'):
+        _fork_map(add_to_first, [(values, 1), (values, -1), (values, 2)], 2)
+
+
+def test_duplicate_scenario_names():
+    """Scenarios that only differ in DiscountIndex would write the same results files, so they are rejected before
+    any is run
+
+    """
+    specs = pd.read_excel(os.path.join('test', 'test_data', 'dj-specs-test.xlsx'), sheet_name=None)
+    scenario_info = pd.DataFrame({'Scenario': [0, 1], 'PopIndex': 0, 'ElecRateIndex': 0, 'ResidentialDemand': 0,
+                                  'SocialProductiveDem': 0, 'IndustrialDem': 0, 'PVIndex': 0, 'DiscountIndex': [0, 1]})
+
+    with TemporaryDirectory() as tmpdir:
+        specs_path = os.path.join(tmpdir, 'dj-specs-test-calib.xlsx')
+        with pd.ExcelWriter(specs_path) as writer:
+            scenario_info.to_excel(writer, sheet_name='ScenarioInfo', index=False)
+            specs['ScenarioParameters'].to_excel(writer, sheet_name='ScenarioParameters', index=False)
+            specs['SpecsData'].to_excel(writer, sheet_name='SpecsDataCalib', index=False)
+
+        with pytest.raises(ValueError, match='DiscountIndex'):
+            scenario(specs_path, os.path.join(tmpdir, 'missing.csv'), tmpdir, tmpdir, '', False, False, False)
+
+
 def update_test_file():
     """A utility function to produce a new test file if intended changes are made
     """
@@ -0,0 +1,64 @@
+from onsset import SettlementProcessor, Technology
+
+import numpy as np
+from pandas import DataFrame
+from pytest import fixture
+
+
+class TestTechSelection:
+
+    @fixture
+    def setup_settlementprocessor(self) -> SettlementProcessor:
+        sp = SettlementProcessor.__new__(SettlementProcessor)
+        sp.df = DataFrame({'A': [0.3, 0.2, np.nan, np.nan, np.inf, 0.5],
+                           'B': [0.1, 0.2, 0.4, np.nan, np.inf, 0.5],
+                           'C': [0.2, 0.3, 0.1, np.nan, np.nan, 0.4]})
+        return sp
+
+    def test_min_tech(self, setup_settlementprocessor):
+        """The same technologies as DataFrame.idxmin, including ties, missing and infinite LCOEs
+        """
+        sp = setup_settlementprocessor
+        columns = ['A', 'B', 'C']
+
+        position, min_lcoe = sp.min_tech(columns)
+
+        expected = sp.df[columns].T.idxmin()
+        assert list(sp.tech_labels(position, columns)[expected.notna()]) == list(expected.dropna())
+        assert np.array_equal(min_lcoe, sp.df[columns].T.min().values, equal_nan=True)
+        assert position[3] == -1
+
+    def test_tech_codes(self, setup_settlementprocessor):
+        sp = setup_settlementprocessor
+
+        position, _ = sp.min_tech(['A', 'B', 'C'])
+
+        assert np.array_equal(sp.tech_codes(position, [3, 6, 5]), [6, 3, 5, np.nan, 3, 5], equal_nan=True)
+
+    def test_hydro_capacity(self):
+        """The settlements within 5 km of a hydro-power site take its capacity in turn, those beyond its capacity or
+        farther than 5 km can't use hydro-power
+        """
+        mg_hydro_calc = Technology(distribution_losses=0.05, base_to_peak_load_ratio=0.8, capacity_factor=0.5)
+        # 7 kW of hydro-power capacity per settlement
+        energy = 7 * 8760 * 0.5 * 0.8 * 0.95
+
+        sp = SettlementProcessor.__new__(SettlementProcessor)
+        sp.df = DataFrame({'HydropowerFID': [1, 2, 1, 2, 1, 2],
+                           'Hydropower': [15, 15, 15, 15, 15, 15],
+                           'HydropowerDist': [1, 2, 3, 6, 4, 1],
+                           'EnergyPerSettlement2025': energy,
+                           'MG_Hydro2025': 0.1,
+                           'SA_PV2025': 0.3,
+                           'MG_Wind2025': 0.4,
+                           'MG_PV2025': 0.4,
+                           'MG_Diesel2025': 0.4,
+                           'SA_Diesel2025': 0.4})
+
+        sp.choose_minimum_off_grid_tech(2025, mg_hydro_calc)
+
+        # The third settlement of site 1 exceeds its capacity. The settlement 6 km from site 2 does not use any of
+        # its capacity, which is enough for the other two
+        assert list(sp.df['MG_Hydro2025']) == [0.1, 0.1, 0.1, 99, 99, 0.1]
+        assert list(sp.df['Off_Grid_Code2025']) == [7, 7, 7, 3, 3, 7]
+        assert list(sp.df['Minimum_LCOE_Off_grid2025']) == [0.1, 0.1, 0.1, 0.3, 0.3, 0.1]
@@ -2,6 +2,8 @@ import os
 
 from onsset import SettlementProcessor
 
+import numpy as np
+
 from pandas import DataFrame, Series
 from pandas.testing import assert_frame_equal, assert_series_equal
 from pytest import fixture, raises, approx
@@ -76,8 +78,46 @@ class TestCalcWind:
         sp = setup_settlementprocessor
         wind_vel = -1
 
+        with raises(ValueError):
+            sp.calc_wind_cfs(wind_vel)
+
+        with raises(ValueError):
+            sp.calc_wind_cfs(np.array([5.08063, -1]), lookup_step=0.01)
+
+    def test_calc_wind_cfs_missing(self, setup_settlementprocessor):
+        """Missing wind velocities give a missing capacity factor, also from the lookup table
+        """
+        sp = setup_settlementprocessor
+        wind_vel = Series([5.08063, np.nan, 0])
+
         actual = sp.calc_wind_cfs(wind_vel)
+        tabulated = sp.calc_wind_cfs(wind_vel, lookup_step=0.01)
 
-        expected = 0
+        assert np.isnan(sp.calc_wind_cfs(np.nan))
+        for cfs in [actual, tabulated]:
+            assert cfs[0] == approx(0.08181981, abs=1e-5)
+            assert np.isnan(cfs[1])
+            assert cfs[2] == 0
 
-        assert actual == expected
+    def test_calc_wind_cfs_settlements(self, setup_settlementprocessor):
+        """The settlements get the capacity factor of their wind velocity, also from the lookup table
+        """
+        sp = setup_settlementprocessor
+
+        actual = sp.calc_wind_cfs()
+        tabulated = sp.calc_wind_cfs(lookup_step=0.01)
+
+        expected = [sp.get_wind_cf(wind_vel) for wind_vel in sp.df['WindVel']]
+        assert actual.values == approx(expected)
+        assert tabulated.values == approx(expected, abs=1e-5)
+
+    def test_calc_wind_cfs_power_curve(self, setup_settlementprocessor):
+        """A turbine with twice the output at every speed has twice the capacity factor
+        """
+        sp = setup_settlementprocessor
+        power_curve = [2 * p for p in (0, 0, 0, 0, 30, 77, 135, 208, 287, 371, 450, 514, 558,
+                                       582, 594, 598, 600, 600, 600, 600, 600, 600, 600, 600, 600)]
+
+        actual = sp.calc_wind_cfs(5.08063, power_curve=power_curve)
+
+        assert actual == approx(2 * 0.08181981)